@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the OCR pipelines.
+
+    python benchmark.py --corpus bench_corpus/ --output results.json
+    python benchmark.py --corpus bench_corpus/ --server http://localhost:5000 --concurrency 1 4 8
+    python benchmark.py --compare baseline.json results.json
+
+The corpus is a folder of synthetic or redacted images:
+
+    bench_corpus/id/*.jpg          Egyptian ID cards
+    bench_corpus/passport/*.jpg    passport data pages
+    bench_corpus/faces/*.jpg       face pairs: <name>_id.jpg + <name>_live.jpg
+
+Reports model load time, p50/p95/p99 latency for detect_and_process_id_card,
+detect_id_card_quick, process_passport and compare_faces and for each of
+their instrumented stages (see metrics.py), with the peak RSS of this
+process while it runs them, and throughput at N concurrent clients
+against a running ocr_server.py, with the server's memory as reported by
+/info after each level. Failed calls are counted separately and left out
+of the latency figures and the throughput. Results are written as JSON
+tagged with the current commit.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def percentile(values: list, q: float) -> float:
+    """Linearly interpolated percentile, q in [0, 100]."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(latencies: list) -> dict:
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2),
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "max_ms": round(1000 * max(latencies), 2)
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def list_images(folder: str) -> list:
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        os.path.join(folder, f) for f in os.listdir(folder)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def face_pairs(folder: str) -> list:
+    images = list_images(folder)
+    by_name = {os.path.basename(p): p for p in images}
+    pairs = []
+    for name, path in by_name.items():
+        stem, ext = os.path.splitext(name)
+        if stem.endswith('_id'):
+            live = by_name.get(stem[:-3] + '_live' + ext)
+            if live:
+                pairs.append((path, live))
+    if not pairs:
+        pairs = list(zip(images[0::2], images[1::2]))
+    return pairs
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def load_models() -> dict:
+    """Import the pipelines, timing each model family as it loads."""
+    load_times = {}
+
+    start = time.perf_counter()
+    import egyptian_ocr_id  # noqa: F401  (EasyOCR Arabic reader)
+    load_times["easyocr_ar"] = time.perf_counter() - start
+
+    from model_backend import YOLO_MODELS, get_detector
+    for name in YOLO_MODELS:
+        load_times[name] = timed(get_detector, name)
+
+    from passport_ocr import get_passport_ocr
+    load_times["passport_ocr"] = timed(get_passport_ocr)
+
+    start = time.perf_counter()
+    import ocr_server  # noqa: F401  (MTCNN + InceptionResnetV1)
+    load_times["face_models"] = time.perf_counter() - start
+
+    return {k: round(v, 3) for k, v in load_times.items()}
+
+
+def bench_pipelines(corpus: str, iterations: int, warmup: int) -> dict:
+    from PIL import Image
+
+    from egyptian_ocr_id import detect_and_process_id_card, detect_id_card_quick
+    from metrics import add_stage_observer
+    from passport_ocr import process_passport
+    import ocr_server
+
+    stage_samples = {}
+    recording = threading.Event()
+
+    def record_stage(pipeline, stage, field, seconds):
+        if recording.is_set():
+            key = f"{pipeline}/{stage}" + (f"[{field}]" if field else "")
+            stage_samples.setdefault(key, []).append(seconds)
+
+    add_stage_observer(record_stage)
+
+    id_images = list_images(os.path.join(corpus, 'id'))
+    passport_images = list_images(os.path.join(corpus, 'passport'))
+    pairs = face_pairs(os.path.join(corpus, 'faces'))
+
+    def compare_pair(pair):
+        id_path, live_path = pair
+        ocr_server.compare_faces(Image.open(id_path).convert('RGB'),
+                                 Image.open(live_path).convert('RGB'))
+
+    pipelines = {
+        "detect_and_process_id_card": (detect_and_process_id_card, id_images),
+        "detect_id_card_quick": (detect_id_card_quick, id_images),
+        "process_passport": (process_passport, passport_images)
+    }
+    if ocr_server.FACE_RECOGNITION_AVAILABLE:
+        pipelines["compare_faces"] = (compare_pair, pairs)
+
+    report = {}
+    for name, (fn, inputs) in pipelines.items():
+        if not inputs:
+            report[name] = {"count": 0, "skipped": "no corpus images"}
+            continue
+
+        warmup_errors = 0
+        for item in inputs[:warmup]:
+            try:
+                fn(item)
+            except Exception as e:
+                warmup_errors += 1
+                logger.warning("%s failed on %s during warmup: %s", name, item, e)
+
+        recording.set()
+        latencies = []
+        errors = 0
+        for _ in range(iterations):
+            for item in inputs:
+                start = time.perf_counter()
+                try:
+                    fn(item)
+                except Exception as e:
+                    errors += 1
+                    logger.warning("%s failed on %s: %s", name, item, e)
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        recording.clear()
+
+        report[name] = dict(summarize(latencies), errors=errors, warmup_errors=warmup_errors)
+        logger.info("%s: %s", name, report[name])
+
+    stages = {key: summarize(values)
+              for key, values in sorted(stage_samples.items())}
+    return report, stages
+
+
+def bench_server(server: str, corpus: str, concurrency_levels: list,
+                 requests_per_client: int, endpoint: str) -> dict:
+    folder = 'passport' if endpoint == '/passport' else 'id'
+    payloads = [open(p, 'rb').read()
+                for p in list_images(os.path.join(corpus, folder))]
+    if not payloads:
+        return {"skipped": f"no corpus images in {folder}/"}
+
+    url = server.rstrip('/') + endpoint
+    report = {"endpoint": endpoint, "levels": {}}
+    for clients in concurrency_levels:
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def client(index):
+            nonlocal errors
+            for i in range(requests_per_client):
+                payload = payloads[(index + i) % len(payloads)]
+                request = urllib.request.Request(
+                    url, data=payload, headers={'Content-Type': 'application/octet-stream'})
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request, timeout=300) as response:
+                        response.read()
+                except (urllib.error.URLError, OSError):
+                    with lock:
+                        errors += 1
+                    continue
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, range(clients)))
+        wall = time.perf_counter() - start
+
+        level = dict(summarize(latencies), errors=errors,
+                     throughput_rps=round(len(latencies) / wall, 3),
+                     server_memory=server_memory(server))
+        report["levels"][str(clients)] = level
+        logger.info("%s clients: %s", clients, level)
+    return report
+
+
+def server_memory(server: str) -> dict:
+    """Memory of the server worker that answers /info, or None if it cannot be read."""
+    try:
+        with urllib.request.urlopen(server.rstrip('/') + '/info', timeout=30) as response:
+            return json.load(response).get("memory")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        logger.warning("Could not read server memory: %s", e)
+        return None
+
+
+def compare_runs(baseline_path: str, current_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    print(f"{'pipeline':32} {'metric':8} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, stats in {**current.get("pipelines", {}), **current.get("stages", {})}.items():
+        before = baseline.get("pipelines", {}).get(
+            name) or baseline.get("stages", {}).get(name, {})
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric in stats and metric in before and before[metric]:
+                change = 100.0 * (stats[metric] - before[metric]) / before[metric]
+                print(f"{name:32} {metric:8} {before[metric]:>10.1f} {stats[metric]:>10.1f} {change:>+7.1f}%")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='Benchmark image folder')
+    parser.add_argument('--output', help='Write results JSON here')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--skip-pipelines', action='store_true',
+                        help='Only benchmark the running server')
+    parser.add_argument('--server', help='Base URL of a running ocr_server.py')
+    parser.add_argument('--endpoint', default='/egyptian-id')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests-per-client', type=int, default=5)
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare_runs(*args.compare)
+        return 0
+    if not args.corpus:
+        parser.error('--corpus is required')
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": os.path.abspath(args.corpus)
+    }
+
+    if not args.skip_pipelines:
+        results["model_load_seconds"] = load_models()
+        results["rss_after_load_mb"] = peak_rss_mb()
+        results["pipelines"], results["stages"] = bench_pipelines(
+            args.corpus, args.iterations, args.warmup)
+        # The pipelines ran in this process, so its peak is theirs
+        results["pipelines_peak_rss_mb"] = peak_rss_mb()
+    if args.server:
+        results["server"] = bench_server(args.server, args.corpus, args.concurrency,
+                                         args.requests_per_client, args.endpoint)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info("Results written to %s", args.output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
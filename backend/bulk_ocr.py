@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Bulk OCR over an archive of ID cards and passports.
+
+    python bulk_ocr.py --input archive/ --output results.jsonl
+    python bulk_ocr.py --manifest batch.jsonl --output results.jsonl --workers 6
+
+--input is walked recursively. A file's type is 'passport' when any
+folder on its path is named like passport/passports, otherwise --type
+(default id). A manifest has one image per line, either a bare path or
+{"image": "...", "type": "id" | "passport"}; relative paths are resolved
+against the manifest's folder.
+
+Images are read and their headers checked by a small pool of I/O
+threads ahead of the workers; only the encoded bytes go to the worker
+processes, which decode them. Each worker process loads every model
+once at startup, and the pool is replaced if a worker dies. Results
+stream to the output as JSON lines:
+
+    {"image": "...", "type": "id", "ok": true, "result": {...}, "seconds": 1.92}
+
+The output is also the checkpoint: on restart, images already recorded
+with "ok": true are skipped (failed ones are retried). --restart starts
+over. Images in flight when a worker dies are retried once on the new
+pool, then recorded as failed.
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import (ALL_COMPLETED, FIRST_COMPLETED, Future,
+                                ProcessPoolExecutor, ThreadPoolExecutor, wait)
+from concurrent.futures.process import BrokenProcessPool
+
+from log_config import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+DOCUMENT_TYPES = ['id', 'passport']
+ID_FIELDS = ['first_name', 'second_name', 'full_name', 'national_id', 'address',
+             'birth_date', 'governorate', 'gender', 'detected_fields', 'debug_image_path', 'serial']
+# Submissions per image before a worker crash records it as failed
+MAX_ATTEMPTS = 2
+
+
+def _document_type(path: str, default: str) -> str:
+    folders = os.path.normpath(os.path.dirname(path)).lower().split(os.sep)
+    return 'passport' if any(f.startswith('passport') for f in folders) else default
+
+
+def walk_images(root: str, default_type: str):
+    for folder, subfolders, files in os.walk(root):
+        subfolders.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(folder, name)
+                yield path, _document_type(path, default_type)
+
+
+def read_manifest(manifest: str, default_type: str):
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                path, doc_type = entry['image'], entry.get('type', default_type)
+            else:
+                path, doc_type = line, default_type
+            yield os.path.join(base, path), doc_type
+
+
+def completed_images(output: str) -> set:
+    """Images already processed successfully according to an existing output file."""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    # A line cut short by a crash may end inside a multi-byte character
+    with open(output, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            if record.get('ok'):
+                done.add(record['image'])
+    return done
+
+
+def open_output(output: str):
+    """Open the output for appending, ending a line cut short by a crash first."""
+    if os.path.exists(output) and os.path.getsize(output):
+        with open(output, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    return open(output, 'a', encoding='utf-8')
+
+
+def load_payload(path: str, doc_type: str) -> bytes:
+    """Runs on an I/O thread: the encoded bytes, once the header checks out."""
+    from ingest import inspect_image
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    inspect_image(data)
+    return data
+
+
+def prefetch(items, io_threads: int, depth: int):
+    """Yield (path, type, payload, error) in order, loading up to `depth` images ahead."""
+    with ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='bulk-io') as pool:
+        window = deque()
+        items = iter(items)
+        for path, doc_type in items:
+            window.append((path, doc_type, pool.submit(load_payload, path, doc_type)))
+            if len(window) >= depth:
+                break
+        while window:
+            path, doc_type, future = window.popleft()
+            next_item = next(items, None)
+            if next_item is not None:
+                window.append((*next_item, pool.submit(load_payload, *next_item)))
+            try:
+                yield path, doc_type, future.result(), None
+            except Exception as e:
+                yield path, doc_type, None, str(e)
+
+
+def _init_worker(workers: int) -> None:
+    # One request thread per process; the thread budget splits the CPUs between workers
+    os.environ['OCR_WORKERS'] = str(workers)
+    os.environ['OCR_THREADS'] = '1'
+    os.environ.setdefault('ID_DEBUG_IMAGES', '0')
+    from thread_budget import configure
+    configure()
+
+    from model_backend import YOLO_MODELS, get_detector
+    from passport_ocr import get_passport_ocr
+    import egyptian_ocr_id  # noqa: F401  (loads the Arabic reader)
+    for name in YOLO_MODELS:
+        get_detector(name)
+    get_passport_ocr()
+    logger.info("Worker %s ready", os.getpid())
+
+
+def process_document(doc_type: str, payload: bytes) -> dict:
+    if doc_type == 'passport':
+        from passport_ocr import get_passport_ocr
+        result = get_passport_ocr().process_passport_image(io.BytesIO(payload))
+        if not result['success']:
+            raise ValueError(result['error'])
+        return result['data']
+
+    from egyptian_ocr_id import process_id_card_image
+    from ingest import decode_image
+    image, _ = decode_image(payload)
+    if image is None:
+        raise ValueError("Could not decode image")
+    result = dict(zip(ID_FIELDS, process_id_card_image(image)))
+    result.pop('debug_image_path')
+    return result
+
+
+def _run_one(path: str, doc_type: str, payload: bytes) -> dict:
+    start = time.perf_counter()
+    record = {"image": path, "type": doc_type}
+    try:
+        record.update(ok=True, result=process_document(doc_type, payload))
+    except Exception as e:
+        record.update(ok=False, error=str(e))
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record["worker"] = os.getpid()
+    return record
+
+
+class WorkerPool:
+    """
+    The worker processes, replaced when one of them dies. A dead worker
+    (OOM kill, crash in native code) breaks every in-flight future; those
+    images are resubmitted to a fresh pool, up to MAX_ATTEMPTS times each.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.pending = {}
+        self.restarts = 0
+        self.executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                   initializer=_init_worker, initargs=(self.workers,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown()
+
+    def submit(self, path: str, doc_type: str, payload: bytes, attempt: int = 1) -> None:
+        try:
+            future = self.executor.submit(_run_one, path, doc_type, payload)
+        except BrokenProcessPool as e:
+            # Broken before its futures were collected; results() restarts it
+            future = Future()
+            future.set_exception(e)
+        self.pending[future] = (path, doc_type, payload, attempt)
+
+    def results(self, wait_all: bool = False) -> list:
+        """Records of finished images, after waiting for one (or all) to finish."""
+        done, _ = wait(self.pending, return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED)
+        records, crashed = self._collect(done)
+        if crashed:
+            # Every other in-flight future fails with the pool; collect them before replacing it
+            more_records, more_crashed = self._collect(wait(self.pending).done)
+            records += more_records
+            crashed += more_crashed
+            self.executor.shutdown(wait=False)
+            self.executor = self._start()
+            self.restarts += 1
+            logger.warning("A worker process died; restarted the pool (%s restarts), "
+                           "%s images in flight", self.restarts, len(crashed))
+            for path, doc_type, payload, attempt in crashed:
+                if attempt < MAX_ATTEMPTS:
+                    self.submit(path, doc_type, payload, attempt + 1)
+                else:
+                    records.append({"image": path, "type": doc_type, "ok": False,
+                                    "error": "Worker process died"})
+        return records
+
+    def _collect(self, futures):
+        records, crashed = [], []
+        for future in futures:
+            item = self.pending.pop(future)
+            try:
+                records.append(future.result())
+            except BrokenProcessPool:
+                crashed.append(item)
+        return records, crashed
+
+
+def run(items, output: str, workers: int, io_threads: int, prefetch_depth: int,
+        progress_every: int = 100) -> dict:
+    stats = {"processed": 0, "failed": 0}
+    start = time.perf_counter()
+
+    def write(out, record):
+        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        out.flush()
+        stats["processed"] += 1
+        stats["failed"] += int(not record["ok"])
+        if stats["processed"] % progress_every == 0:
+            elapsed = time.perf_counter() - start
+            logger.info("%s images, %s failed, %.2f images/s",
+                        stats['processed'], stats['failed'], stats['processed'] / elapsed)
+
+    with open_output(output) as out, WorkerPool(workers) as pool:
+        for path, doc_type, payload, error in prefetch(items, io_threads, prefetch_depth):
+            if error is not None:
+                write(out, {"image": path, "type": doc_type, "ok": False, "error": error})
+                continue
+            pool.submit(path, doc_type, payload)
+            # Keep every worker busy without queueing the whole archive in memory
+            while len(pool.pending) >= workers * 2:
+                for record in pool.results():
+                    write(out, record)
+        while pool.pending:
+            for record in pool.results(wait_all=True):
+                write(out, record)
+        stats["worker_restarts"] = pool.restarts
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 1)
+    stats["images_per_second"] = round(stats["processed"] / elapsed, 3) if elapsed else None
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='Folder to walk recursively')
+    source.add_argument('--manifest', help='File listing the images to process')
+    parser.add_argument('--output', required=True, help='JSONL results (and resume checkpoint)')
+    parser.add_argument('--type', choices=DOCUMENT_TYPES, default='id',
+                        help='Document type when not given by folder or manifest')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--io-threads', type=int, default=2)
+    parser.add_argument('--prefetch', type=int, default=16, help='Images loaded ahead')
+    parser.add_argument('--restart', action='store_true', help='Ignore and replace existing output')
+    parser.add_argument('--progress-every', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = completed_images(args.output)
+    if done:
+        logger.info("Resuming: %s images already processed", len(done))
+
+    items = (read_manifest(args.manifest, args.type) if args.manifest
+             else walk_images(args.input, args.type))
+    items = ((path, doc_type) for path, doc_type in items if path not in done)
+
+    stats = run(items, args.output, args.workers, args.io_threads,
+                args.prefetch, args.progress_every)
+    logger.info("Processed %s images (%s failed) in %ss: %s images/s",
+                stats['processed'], stats['failed'], stats['seconds'], stats['images_per_second'])
+    print(json.dumps(stats))
+    return 0 if stats['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Build the int8 model variants and compare them against fp32.
+
+    python calibrate_models.py calibrate --images calibration/
+    python calibrate_models.py report --images eval/ --labels eval/labels.jsonl
+
+`calibrate` quantizes from a local image set. It writes dynamic and
+static int8 ONNX exports of the YOLO detectors, a static int8 EasyOCR
+text detector per language and a static int8 face model into models/.
+Images in a subfolder named after a model (for example
+calibration/detect_id/ with NID crops) are used for that model only.
+
+The static int8 PyTorch models are saved as TorchScript made with
+torch.jit.script, not torch.jit.trace. A trace is specialized to the
+shape of its example input, and the EasyOCR text detector (CRAFT) sees a
+different input size for every image. When a model cannot be scripted,
+it is traced and the trace is checked against calibration inputs of
+several sizes. A trace that does not generalize then fails here rather
+than in the server.
+
+`report` runs the ID and passport pipelines once per precision, each in
+a fresh process with MODEL_PRECISION_DEFAULT set. Each run writes its
+result to a file, so log output on stdout cannot corrupt it. The report
+gives field-level accuracy and latency for every variant as JSON. Label
+lines look like:
+
+    {"image": "id_001.jpg", "type": "id", "fields": {"national_id": "...", "first_name": "..."}}
+    {"image": "pp_001.jpg", "type": "passport", "fields": {"passport_number": "..."}}
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from model_backend import YOLO_MODELS, export_model, model_paths, quantized_model_path
+from quantization import PRECISIONS, static_artifact_path
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ID_FIELDS = ['first_name', 'second_name',
+             'national_id', 'address', 'serial']
+
+
+def list_images(image_dir: str, model_name: str = None, limit: int = None) -> list:
+    if model_name and os.path.isdir(os.path.join(image_dir, model_name)):
+        image_dir = os.path.join(image_dir, model_name)
+    images = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return images[:limit] if limit else images
+
+
+def letterbox(image: np.ndarray, size: int = 640) -> np.ndarray:
+    """YOLO-style input: letterboxed, RGB, NCHW float32 in [0, 1]."""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    resized = cv2.resize(image, (int(round(width * scale)), int(round(height * scale))),
+                         interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - resized.shape[0]) // 2
+    left = (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    tensor = canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(tensor[None])
+
+
+def _copy_onnx_metadata(source: str, target: str) -> None:
+    # Ultralytics reads class names and stride from the export's metadata
+    import onnx
+
+    source_model = onnx.load(source)
+    target_model = onnx.load(target)
+    del target_model.metadata_props[:]
+    target_model.metadata_props.extend(source_model.metadata_props)
+    onnx.save(target_model, target)
+
+
+def quantize_yolo(name: str, images: list, imgsz: int = 640) -> None:
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                          QuantType, quantize_dynamic,
+                                          quantize_static)
+
+    source = model_paths(name)['onnx']
+    if not os.path.exists(source):
+        export_model(name, 'onnx', imgsz)
+
+    target = quantized_model_path(name, 'dynamic-int8')
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    _copy_onnx_metadata(source, target)
+    logger.info("Wrote %s", target)
+
+    class YoloCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._inputs = iter(images)
+
+        def get_next(self):
+            for image_path in self._inputs:
+                image = cv2.imread(image_path)
+                if image is not None:
+                    return {'images': letterbox(image, imgsz)}
+            return None
+
+    target = quantized_model_path(name, 'static-int8')
+    quantize_static(source, target, YoloCalibrationReader(),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    _copy_onnx_metadata(source, target)
+    logger.info("Wrote %s", target)
+
+
+# Differently sized inputs a trace is checked against
+TRACE_CHECK_SHAPES = 3
+
+
+def _to_torchscript(quantized, calibration_inputs):
+    """Script the quantized model, or trace it with checks across input shapes."""
+    import torch
+
+    try:
+        return torch.jit.script(quantized)
+    except Exception as e:
+        logger.warning("Could not script the quantized model (%s), tracing it", e)
+
+    checks = {}
+    for inputs in calibration_inputs:
+        checks.setdefault(tuple(inputs.shape), inputs)
+    check_inputs = [(inputs,) for inputs in list(checks.values())[:TRACE_CHECK_SHAPES]]
+    if len(checks) == 1:
+        logger.warning("All calibration inputs have shape %s; the trace is only "
+                       "verified at that size", next(iter(checks)))
+    return torch.jit.trace(quantized, calibration_inputs[0], check_inputs=check_inputs)
+
+
+def _quantize_static_fx(model, example, calibration_inputs):
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    prepared = prepare_fx(model, get_default_qconfig_mapping('fbgemm'),
+                          example_inputs=(example,))
+    with torch.no_grad():
+        for inputs in calibration_inputs:
+            prepared(inputs)
+        quantized = convert_fx(prepared)
+        return _to_torchscript(quantized, calibration_inputs)
+
+
+def quantize_easyocr_detector(lang: str, model_key: str, images: list) -> None:
+    import easyocr
+    import torch
+    from easyocr.imgproc import normalizeMeanVariance, resize_aspect_ratio
+
+    reader = easyocr.Reader([lang], gpu=False, quantize=False)
+
+    def detector_input(image):
+        resized, _, _ = resize_aspect_ratio(
+            image, 2560, interpolation=cv2.INTER_LINEAR, mag_ratio=1.0)
+        return torch.from_numpy(normalizeMeanVariance(resized)).permute(2, 0, 1).unsqueeze(0)
+
+    inputs = []
+    for image_path in images:
+        image = cv2.imread(image_path)
+        if image is not None:
+            inputs.append(detector_input(image[:, :, ::-1]))
+    if not inputs:
+        logger.warning("No calibration images for %s", model_key)
+        return
+
+    traced = _quantize_static_fx(reader.detector.eval(), inputs[0], inputs)
+    target = static_artifact_path(model_key, 'detector')
+    torch.jit.save(traced, target)
+    logger.info("Wrote %s", target)
+
+
+def quantize_face_model(images: list) -> None:
+    import torch
+    from facenet_pytorch import MTCNN, InceptionResnetV1
+    from PIL import Image
+
+    mtcnn = MTCNN(image_size=160, margin=0)
+    faces = []
+    for image_path in images:
+        face = mtcnn(Image.open(image_path).convert('RGB'))
+        if face is not None:
+            faces.append(face.unsqueeze(0))
+    if not faces:
+        logger.warning("No faces found in the calibration images")
+        return
+
+    model = InceptionResnetV1(pretrained='vggface2').eval()
+    traced = _quantize_static_fx(model, faces[0], faces)
+    target = static_artifact_path('face')
+    torch.jit.save(traced, target)
+    logger.info("Wrote %s", target)
+
+
+def calibrate(args) -> int:
+    for name in args.models:
+        if name in YOLO_MODELS:
+            quantize_yolo(name, list_images(
+                args.images, name, args.limit), args.imgsz)
+        elif name in ('easyocr_ar', 'easyocr_en'):
+            quantize_easyocr_detector(name.split('_')[1], name,
+                                      list_images(args.images, name, args.limit))
+        elif name == 'face':
+            quantize_face_model(list_images(args.images, name, args.limit))
+    return 0
+
+
+def _normalize(value) -> str:
+    return ' '.join(str(value or '').split()).upper()
+
+
+def evaluate(args) -> int:
+    """Run the pipelines at the precisions configured in the environment."""
+    from egyptian_ocr_id import detect_and_process_id_card
+    from passport_ocr import process_passport
+    from quantization import get_model_precisions
+
+    totals = {}
+    latencies = {'id': [], 'passport': []}
+    with open(args.labels, encoding='utf-8') as f:
+        labels = [json.loads(line) for line in f if line.strip()]
+
+    for label in labels:
+        image_path = os.path.join(args.images, label['image'])
+        start = time.perf_counter()
+        if label.get('type', 'id') == 'passport':
+            result = process_passport(image_path)
+            predicted = result['data'] or {}
+            kind = 'passport'
+        else:
+            try:
+                output = detect_and_process_id_card(image_path)
+                predicted = dict(zip(ID_FIELDS, [output[0], output[1], output[3],
+                                                 output[4], output[10]]))
+            except Exception as e:
+                logger.warning("%s: %s", label['image'], e)
+                predicted = {}
+            kind = 'id'
+        latencies[kind].append(time.perf_counter() - start)
+
+        for field, expected in label['fields'].items():
+            stats = totals.setdefault(field, {'correct': 0, 'total': 0})
+            stats['total'] += 1
+            stats['correct'] += int(_normalize(predicted.get(field))
+                                    == _normalize(expected))
+
+    def latency_summary(values):
+        if not values:
+            return None
+        values = sorted(values)
+        return {
+            'count': len(values),
+            'mean_ms': round(1000 * sum(values) / len(values), 1),
+            'p50_ms': round(1000 * values[len(values) // 2], 1),
+            'p95_ms': round(1000 * values[min(len(values) - 1, int(len(values) * 0.95))], 1)
+        }
+
+    result = json.dumps({
+        'precisions': get_model_precisions(),
+        'field_accuracy': {
+            field: round(stats['correct'] / stats['total'], 4)
+            for field, stats in totals.items()
+        },
+        'latency': {kind: latency_summary(values) for kind, values in latencies.items()}
+    })
+    if args.result:
+        with open(args.result, 'w', encoding='utf-8') as f:
+            f.write(result)
+    else:
+        print(result)
+    return 0
+
+
+def report(args) -> int:
+    results = {}
+    for variant in args.variants:
+        env = dict(os.environ, MODEL_PRECISION_DEFAULT=variant)
+        env.pop('MODEL_PRECISION', None)
+        with tempfile.TemporaryDirectory() as directory:
+            result_path = os.path.join(directory, 'result.json')
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), 'evaluate',
+                 '--images', args.images, '--labels', args.labels, '--result', result_path],
+                env=env, capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+            if completed.returncode != 0 or not os.path.exists(result_path):
+                logger.error("%s evaluation failed:\n%s", variant, completed.stderr)
+                results[variant] = {'error': completed.stderr.strip().splitlines()[-1:]}
+                continue
+            with open(result_path, encoding='utf-8') as f:
+                results[variant] = json.load(f)
+        logger.info("%s: %s", variant, results[variant]['field_accuracy'])
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    calibrate_parser = commands.add_parser(
+        'calibrate', help='Build int8 variants')
+    calibrate_parser.add_argument('--images', required=True)
+    calibrate_parser.add_argument('--models', nargs='+',
+                                  default=YOLO_MODELS + ['easyocr_ar', 'easyocr_en', 'face'])
+    calibrate_parser.add_argument('--limit', type=int, default=200)
+    calibrate_parser.add_argument('--imgsz', type=int, default=640)
+
+    for name, help_text in (('report', 'Compare accuracy and latency across precisions'),
+                            ('evaluate', 'Evaluate the precisions set in the environment')):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument('--images', required=True)
+        sub.add_argument('--labels', required=True)
+        if name == 'report':
+            sub.add_argument('--variants', nargs='+', default=PRECISIONS)
+            sub.add_argument('--output')
+        else:
+            sub.add_argument('--result', help='Write the result JSON here instead of stdout')
+
+    args = parser.parse_args(argv)
+    args.images = os.path.abspath(args.images)
+    if getattr(args, 'labels', None):
+        args.labels = os.path.abspath(args.labels)
+    return {'calibrate': calibrate, 'report': report, 'evaluate': evaluate}[args.command](args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,138 +1,275 @@
-from ultralytics import YOLO
+from model_backend import get_detector
+from metrics import stage_timer
+from log_config import pii
+from stage_graph import StageGraph
+from request_context import checkpoint
+from ingest import decode_image
+from load_control import (LEVEL_NO_DEBUG_IMAGES, LEVEL_NO_NLM, LEVEL_UPRIGHT_SHORTCUT,
+                          degraded, inference_args)
+from national_id import NID_DIGIT_CONF, decode_digits, decode_egyptian_id, group_digits
 import cv2
+import functools
 import re
-import easyocr
+from reader_pool import get_reader_pool
 import os
 import numpy as np
+import threading
+import time
+import logging
 from scipy import ndimage
 
-reader = easyocr.Reader(['ar'], gpu=False)
+logger = logging.getLogger(__name__)
+
+reader_pool = get_reader_pool('easyocr_ar')
+reader_pool.preload(1)
+
+# Denoising applied to field crops before OCR:
+#   none            - no denoising
+#   bilateral       - edge-preserving bilateral filter
+#   median          - 3x3 median filter
+#   nlm_downsampled - non-local means on a crop capped at NLM_MAX_SIDE
+#   nlm_card        - a single colour NLM pass over the whole card before
+#                     the fields are cut (field crops are then left alone)
+#   auto            - pick none/bilateral/nlm_downsampled per crop from a
+#                     noise estimate
+DENOISE_STRATEGIES = ['none', 'bilateral', 'median',
+                      'nlm_downsampled', 'nlm_card', 'auto']
+DENOISE_STRATEGY = os.environ.get('ID_DENOISE_STRATEGY', 'auto')
+NOISE_SIGMA_LOW = float(os.environ.get('ID_NOISE_SIGMA_LOW', '3.0'))
+NOISE_SIGMA_HIGH = float(os.environ.get('ID_NOISE_SIGMA_HIGH', '8.0'))
+NLM_MAX_SIDE = 600
+NLM_STRATEGIES = ['nlm_downsampled', 'nlm_card']
+# Fields that must all be found at 0° for the degraded orientation shortcut
+UPRIGHT_FIELDS = {'lastName', 'nid', 'address', 'serial'}
+
+# OCR language of each text field class of detect_odjects.pt
+FIELD_LANGUAGES = {
+    'firstName': 'ara',
+    'lastName': 'ara',
+    'address': 'ara',
+    'serial': 'eng'
+}
+
+# detect_id_card_quick: YOLO input size (multiple of 32, 0 = model default)
+# and the smallest long side a JPEG may be reduced to when decoding
+QUICK_INFER_SIZE = -(-int(os.environ.get('QUICK_INFER_SIZE', '416')) // 32) * 32
+QUICK_DECODE_MIN_SIDE = int(os.environ.get('QUICK_DECODE_MIN_SIDE', '1280'))
+
+# Intermediate images written to debug_images/ for the /debug-image endpoint;
+# batch jobs turn this off (ID_DEBUG_IMAGES=0)
+DEBUG_FOLDER = 'debug_images'
+DEBUG_IMAGES = os.environ.get('ID_DEBUG_IMAGES', '1') != '0'
+
+# Long side, in pixels, of the normalized card that field detection, the
+# NID digit pass and EasyOCR all operate on
+CARD_CANONICAL_LONG_SIDE = int(
+    os.environ.get('ID_CARD_CANONICAL_SIZE', '1200'))
+
+# ID-1 card format (85.60 x 53.98 mm)
+ID_CARD_ASPECT_RATIO = 85.60 / 53.98
+CARD_QUAD_SEARCH_SIDE = 500
+
+_denoise_timings = {}
+_denoise_timings_lock = threading.Lock()
+
+
+def estimate_noise(gray_image):
+    """
+    Estimate the standard deviation of additive noise in a grayscale image
+    (Immerkaer's method). Costs a single 3x3 filter pass, so it is cheap
+    enough to run on every field crop.
+    """
+    height, width = gray_image.shape[:2]
+    if height < 3 or width < 3:
+        return 0.0
+
+    kernel = np.array([[1, -2, 1],
+                       [-2, 4, -2],
+                       [1, -2, 1]], dtype=np.float32)
+    response = cv2.filter2D(gray_image.astype(np.float32), -1, kernel)
+    sigma = np.abs(response[1:-1, 1:-1]).sum()
+    sigma *= np.sqrt(0.5 * np.pi) / (6.0 * (width - 2) * (height - 2))
+    return float(sigma)
+
+
+def select_denoise_strategy(gray_image, strategy=None):
+    """Resolve 'auto' to a concrete strategy using the noise estimate."""
+    strategy = strategy or DENOISE_STRATEGY
+    if strategy not in DENOISE_STRATEGIES:
+        raise ValueError(f"Unknown denoise strategy: {strategy}")
+    if strategy != 'auto':
+        if strategy in NLM_STRATEGIES and degraded(LEVEL_NO_NLM):
+            return 'bilateral'
+        return strategy
+
+    sigma = estimate_noise(gray_image)
+    if sigma < NOISE_SIGMA_LOW:
+        selected = 'none'
+    elif sigma < NOISE_SIGMA_HIGH:
+        selected = 'bilateral'
+    elif degraded(LEVEL_NO_NLM):
+        selected = 'bilateral'
+    else:
+        selected = 'nlm_downsampled'
+    logger.debug("Estimated noise sigma %.2f -> %s", sigma, selected)
+    return selected
 
 
-def preprocess_image(cropped_image):
+def _record_denoise_timing(strategy, elapsed):
+    with _denoise_timings_lock:
+        stats = _denoise_timings.setdefault(
+            strategy, {'calls': 0, 'total_seconds': 0.0})
+        stats['calls'] += 1
+        stats['total_seconds'] += elapsed
+
+
+def get_denoise_timings():
+    """Per-strategy denoising latency accumulated since startup."""
+    with _denoise_timings_lock:
+        return {
+            strategy: {
+                'calls': stats['calls'],
+                'total_ms': round(stats['total_seconds'] * 1000, 2),
+                'avg_ms': round(stats['total_seconds'] * 1000 / stats['calls'], 2)
+            }
+            for strategy, stats in _denoise_timings.items()
+        }
+
+
+def _nlm_downsampled(gray_image):
+    height, width = gray_image.shape[:2]
+    scale = NLM_MAX_SIDE / max(height, width)
+    if scale >= 1.0:
+        return cv2.fastNlMeansDenoising(
+            gray_image, h=10, templateWindowSize=7, searchWindowSize=21)
+
+    small = cv2.resize(gray_image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+    small = cv2.fastNlMeansDenoising(
+        small, h=10, templateWindowSize=7, searchWindowSize=21)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def denoise_image(gray_image, strategy=None):
     """
-    Smart preprocessing for OCR that handles high-resolution images better.
-    Resizes images to optimal resolution and applies appropriate preprocessing.
+    Denoise a grayscale field crop with the given (or configured) strategy.
+    Returns the denoised image and the strategy that was actually applied.
     """
-    height, width = cropped_image.shape[:2]
-    print(f"🔍 Original image size: {width}x{height}")
+    strategy = select_denoise_strategy(gray_image, strategy)
+    if strategy in ('none', 'nlm_card'):
+        # nlm_card crops come from an already denoised card
+        return gray_image, strategy
+
+    start = time.perf_counter()
+    if strategy == 'bilateral':
+        denoised = cv2.bilateralFilter(gray_image, 7, 50, 50)
+    elif strategy == 'median':
+        denoised = cv2.medianBlur(gray_image, 3)
+    else:
+        denoised = _nlm_downsampled(gray_image)
+    elapsed = time.perf_counter() - start
+    _record_denoise_timing(strategy, elapsed)
 
-    # Convert to grayscale first
-    gray_image = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)
+    logger.debug("Applied %s denoising in %.1f ms", strategy, elapsed * 1000)
+    return denoised, strategy
 
-    # Smart resizing based on image dimensions
-    if width > 1500 or height > 1500:
-        print("📏 High-resolution image detected, applying smart resizing...")
-
-        # Calculate optimal size (target width around 1000-1200px)
-        optimal_width = 1000
-        if width > height:
-            # Landscape orientation
-            scale = optimal_width / width
-            new_width = optimal_width
-            new_height = int(height * scale)
-        else:
-            # Portrait orientation
-            optimal_height = 1000
-            scale = optimal_height / height
-            new_height = optimal_height
-            new_width = int(width * scale)
-
-        # Ensure minimum dimensions for readability
-        new_width = max(new_width, 400)
-        new_height = max(new_height, 300)
-
-        print(
-            f"📐 Resizing from {width}x{height} to {new_width}x{new_height} (scale: {scale:.3f})")
-
-        # Use INTER_AREA for downsampling (better for text)
-        gray_image = cv2.resize(gray_image, (new_width, new_height),
-                                interpolation=cv2.INTER_AREA)
-
-        # Apply denoising for high-res images
-        print("🧹 Applying denoising for high-resolution image...")
-        gray_image = cv2.fastNlMeansDenoising(
-            gray_image, h=10, templateWindowSize=7, searchWindowSize=21)
 
-        # Enhance contrast for better OCR
-        print("🎨 Enhancing contrast...")
-        gray_image = cv2.equalizeHist(gray_image)
+def denoise_card(card_image, strategy=None):
+    """
+    Run the card-level part of the denoise strategy. Only 'nlm_card' does
+    any work here; every other strategy is applied per field crop.
+    """
+    strategy = strategy or DENOISE_STRATEGY
+    if strategy != 'nlm_card' or degraded(LEVEL_NO_NLM):
+        # Degraded, the crops get a bilateral filter instead
+        return card_image
 
-    elif width < 400 or height < 300:
-        print("📏 Low-resolution image detected, upscaling...")
+    start = time.perf_counter()
+    denoised = reduce_noise(card_image)
+    elapsed = time.perf_counter() - start
+    _record_denoise_timing('nlm_card', elapsed)
+    logger.debug("Applied card-level NLM denoising in %.1f ms", elapsed * 1000)
+    return denoised
 
-        # Upscale small images
-        scale = max(400 / width, 300 / height)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
 
-        print(
-            f"📐 Upscaling from {width}x{height} to {new_width}x{new_height} (scale: {scale:.3f})")
+def preprocess_image(cropped_image, denoise_strategy=None):
+    """
+    Prepare a field crop for OCR. Crops come from the card normalized to
+    CARD_CANONICAL_LONG_SIDE, so they are already at the resolution OCR
+    runs at and are not resampled again here. Denoising is chosen by
+    `denoise_strategy` (see DENOISE_STRATEGIES).
+    """
+    height, width = cropped_image.shape[:2]
+    logger.debug("Field crop size %dx%d", width, height)
 
-        # Use INTER_CUBIC for upsampling
-        gray_image = cv2.resize(gray_image, (new_width, new_height),
-                                interpolation=cv2.INTER_CUBIC)
+    gray_image = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)
 
-    else:
-        print("✅ Image size is optimal for OCR")
+    # Denoising is chosen from the noise level of the crop
+    gray_image, _ = denoise_image(gray_image, denoise_strategy)
 
     # Final contrast enhancement for all images
     clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    gray_image = clahe.apply(gray_image)
+    return clahe.apply(gray_image)
+
 
-    print(
-        f"✅ Preprocessing completed. Final size: {gray_image.shape[1]}x{gray_image.shape[0]}")
-    return gray_image
+QUARTER_TURNS = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE
+}
 
 
 def auto_rotate_image(image):
+    """
+    Pick the best of the four quarter-turn orientations by field detection
+    score. Returns the rotated image together with the field detection
+    results of the winning orientation (None if scoring failed), so the
+    caller does not have to run field detection again.
+    """
     try:
-        print("🔄 Testing all four orientations (0°, 90°, 180°, 270°)...")
-
         orientations = [0, 90, 180, 270]
         best_image = image
+        best_results = None
         best_score = 0
         best_angle = 0
 
         for angle in orientations:
+            checkpoint('orientation')
+            # Exact quarter turns (counter-clockwise) keep the whole card
+            # in frame, which a same-size warpAffine does not for 90/270
             if angle == 0:
-                rotated = image.copy()
+                rotated = image
             else:
-                height, width = image.shape[:2]
-                center = (width // 2, height // 2)
-                rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-                rotated = cv2.warpAffine(image, rotation_matrix, (width, height),
-                                         flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-
-            score, detected_fields = score_orientation(rotated)
-            fields_str = ", ".join(
-                detected_fields) if detected_fields else "none"
-            print(
-                f"   📊 {angle}° orientation score: {score:.3f} (fields: {fields_str})")
-
-            if score > best_score:
+                rotated = cv2.rotate(image, QUARTER_TURNS[angle])
+
+            score, detected_fields, results = score_orientation(rotated)
+            logger.debug("Orientation %d°: score %.3f (fields: %s)",
+                         angle, score, detected_fields)
+
+            if angle == 0 and degraded(LEVEL_UPRIGHT_SHORTCUT) and \
+                    UPRIGHT_FIELDS.issubset(detected_fields):
+                logger.debug("Card upright, orientation search skipped under load")
+                return rotated, results
+
+            if angle == 0 or score > best_score:
                 best_score = score
                 best_image = rotated
+                best_results = results
                 best_angle = angle
 
-        if best_angle != 0:
-            print(
-                f"✅ Best orientation found: {best_angle}° (score: {best_score:.3f})")
-        else:
-            print(
-                f"✅ Original orientation (0°) is best (score: {best_score:.3f})")
+        logger.debug("Best orientation %d° (score %.3f)", best_angle, best_score)
 
-        return best_image
+        return best_image, best_results
 
     except Exception as e:
-        print(f"⚠️ Auto-rotation failed: {e}")
-        return image
+        logger.warning("Auto-rotation failed: %s", e)
+        return image, None
 
 
 def score_orientation(image):
     try:
-        model = YOLO('models/detect_odjects.pt')
-        results = model(image, conf=0.3)
+        model = get_detector('detect_odjects')
+        results = model(image, conf=0.3, verbose=False, **inference_args(model))
 
         field_count = 0
         total_confidence = 0
@@ -145,14 +282,6 @@ def score_orientation(image):
                     class_name = result.names[class_id]
                     confidence = float(box.conf[0].item())
 
-                    if class_name == 'firstName':
-                        x1, y1, x2, y2 = map(int, box.xyxy[0])
-                        print(
-                            f"      🔍 Detected field: {class_name} (conf: {confidence:.3f}) at [{x1}, {y1}, {x2}, {y2}]")
-                    else:
-                        print(
-                            f"      🔍 Detected field: {class_name} (conf: {confidence:.3f})")
-
                     if class_name in ['firstName', 'lastName', 'nid', 'address', 'serial']:
                         field_count += 1
                         total_confidence += confidence
@@ -164,11 +293,11 @@ def score_orientation(image):
         else:
             score = 0
 
-        return score, detected_fields
+        return score, detected_fields, results
 
     except Exception as e:
-        print(f"⚠️ Orientation scoring failed: {e}")
-        return 0, []
+        logger.warning("Orientation scoring failed: %s", e)
+        return 0, [], None
 
 
 def enhance_contrast(image):
@@ -182,11 +311,10 @@ def enhance_contrast(image):
         enhanced = cv2.merge([l, a, b])
         enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
 
-        print("✅ Contrast enhanced using CLAHE")
         return enhanced
 
     except Exception as e:
-        print(f"⚠️ Contrast enhancement failed: {e}")
+        logger.warning("Contrast enhancement failed: %s", e)
         return image
 
 
@@ -195,57 +323,69 @@ def reduce_noise(image):
         denoised = cv2.fastNlMeansDenoisingColored(image, None, h=10, hColor=10,
                                                    templateWindowSize=7, searchWindowSize=21)
 
-        print("✅ Noise reduction applied")
         return denoised
 
     except Exception as e:
-        print(f"⚠️ Noise reduction failed: {e}")
+        logger.warning("Noise reduction failed: %s", e)
         return image
 
 
-def preprocess_id_image(image):
-    print("🔧 Starting image preprocessing pipeline...")
-
-    print("1️⃣ Testing orientations...")
-    processed = auto_rotate_image(image)
+def debug_images_enabled():
+    return DEBUG_IMAGES and not degraded(LEVEL_NO_DEBUG_IMAGES)
 
-    debug_folder = 'debug_images'
-    os.makedirs(debug_folder, exist_ok=True)
-    preprocessed_path = os.path.join(debug_folder, 'preprocessed_image.jpg')
-    cv2.imwrite(preprocessed_path, processed)
-    print(f"💾 Preprocessed image saved to: {preprocessed_path}")
 
-    print("✅ Image preprocessing completed")
-    return processed
+def save_debug_image(filename, image):
+    """Write an intermediate image to the debug folder (if enabled); returns its path."""
+    path = os.path.join(DEBUG_FOLDER, filename)
+    if debug_images_enabled():
+        os.makedirs(DEBUG_FOLDER, exist_ok=True)
+        cv2.imwrite(path, image)
+    return path
 
 
-def extract_text(image, bbox, lang='ara'):
-    x1, y1, x2, y2 = bbox
-    cropped_image = image[y1:y2, x1:x2]
-    preprocessed_image = preprocess_image(cropped_image)
-    results = reader.readtext(preprocessed_image, detail=0, paragraph=True)
+def preprocess_id_image(image):
+    with stage_timer('id', 'orientation'):
+        processed, field_results = auto_rotate_image(image)
+
+    save_debug_image('preprocessed_image.jpg', processed)
+    return processed, field_results
+
+
+def extract_text(image, bbox, lang='ara', denoise_strategy=None, field=''):
+    with stage_timer('id', 'field_ocr', field=field):
+        x1, y1, x2, y2 = bbox
+        cropped_image = image[y1:y2, x1:x2]
+        preprocessed_image = preprocess_image(cropped_image, denoise_strategy)
+        with reader_pool.reader() as reader:
+            # The reader may have been waited for
+            checkpoint('field_ocr')
+            results = reader.readtext(preprocessed_image, detail=0, paragraph=True)
     text = ' '.join(results)
     return text.strip()
 
 
 def detect_national_id(cropped_image):
-    model = YOLO('models/detect_id.pt')
-    results = model(cropped_image)
-    detected_info = []
-
-    for result in results:
-        for box in result.boxes:
-            cls = int(box.cls)
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            detected_info.append((cls, x1))
-            cv2.rectangle(cropped_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(cropped_image, str(cls), (x1, y1 - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (36, 255, 12), 2)
-
-    detected_info.sort(key=lambda x: x[1])
-    id_number = ''.join([str(cls) for cls, _ in detected_info])
-
-    return id_number
+    model = get_detector('detect_id')
+    checkpoint('nid_digits')
+    with stage_timer('id', 'nid_digits'):
+        results = model(cropped_image, conf=NID_DIGIT_CONF, verbose=False,
+                        **inference_args(model))
+
+    positions = group_digits(results)
+    for position in positions:
+        x1, y1, x2, y2 = position['bbox']
+        cv2.rectangle(cropped_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(cropped_image, str(position['digit']), (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (36, 255, 12), 2)
+
+    decoded = decode_digits(positions)
+    if decoded['valid']:
+        logger.debug("NID decoded from %d digits (p=%s, checksum %s, corrected %s)",
+                     decoded['positions'], decoded['confidence'],
+                     'ok' if decoded['checksum_ok'] else 'mismatch', decoded['corrected'])
+    else:
+        logger.info("No valid NID among the digit alternatives: %s", decoded['errors'])
+    return decoded['national_id']
 
 
 def remove_numbers(text):
@@ -264,38 +404,38 @@ def expand_bbox_height(bbox, scale=1.2, image_shape=None):
     return [x1, new_y1, x2, new_y2]
 
 
-def process_image(cropped_image):
-    model = YOLO('models/detect_odjects.pt')
-    results = model(cropped_image, conf=0.3)
+def read_national_id(cropped_image, bbox):
+    expanded_bbox = expand_bbox_height(
+        bbox, scale=1.5, image_shape=cropped_image.shape)
+    # A copy: detect_national_id draws on it while other fields are read
+    cropped_nid = cropped_image[expanded_bbox[1]:expanded_bbox[3], expanded_bbox[0]:expanded_bbox[2]].copy()
+    return detect_national_id(cropped_nid)
 
-    print("🔍 DEBUG: All detections with conf >= 0.1:")
-    for result in results:
-        for box in result.boxes:
-            confidence = float(box.conf[0])
-            if confidence >= 0.1:
-                class_id = int(box.cls[0])
-                class_name = model.names[class_id]
-                print(f"      🔍 DEBUG: {class_name} (conf: {confidence:.3f})")
-
-    first_name = ''
-    second_name = ''
-    merged_name = ''
-    nid = ''
-    address = ''
-    serial = ''
+
+def process_image(cropped_image, denoise_strategy=None, field_results=None):
+    """
+    Run field detection and OCR on a normalized card. `field_results` are
+    detect_odjects.pt results already computed for this exact image (for
+    example by auto_rotate_image); field detection is skipped when given.
+    The text fields and the NID digit pass only depend on the card, so they
+    run as parallel stages (see stage_graph.py).
+    """
+    if field_results is None:
+        model = get_detector('detect_odjects')
+        checkpoint('field_detection')
+        with stage_timer('id', 'field_detection'):
+            results = model(cropped_image, conf=0.3, verbose=False, **inference_args(model))
+    else:
+        results = field_results
 
     detected_fields = []
+    field_boxes = {}
     debug_image = cropped_image.copy()
 
     for result in results:
-        debug_folder = 'debug_images'
-        os.makedirs(debug_folder, exist_ok=True)
-        output_path = os.path.join(debug_folder, 'd2.jpg')
-        result.save(output_path)
-
-        print(f"🔍 YOLO Detection Results:")
-        print(
-            f"   📊 Total detections: {len(result.boxes) if result.boxes is not None else 0}")
+        if debug_images_enabled():
+            os.makedirs(DEBUG_FOLDER, exist_ok=True)
+            result.save(os.path.join(DEBUG_FOLDER, 'd2.jpg'))
 
         for box in result.boxes:
             bbox = box.xyxy[0].tolist()
@@ -310,202 +450,289 @@ def process_image(cropped_image):
                 'bbox': bbox
             })
 
-            print(
-                f"   🎯 Detected: {class_name} (conf: {confidence:.3f}) at {bbox}")
-
-            if class_name == 'firstName':
-                print(
-                    f"      🎯 FOUND firstName with confidence {confidence:.3f}!")
-
-            if len(detected_fields) == 1:
-                print(
-                    f"      📋 Available field names: {list(result.names.values())}")
+            logger.debug("Detected %s (conf %.3f) at %s", class_name, confidence, bbox)
 
             x1, y1, x2, y2 = bbox
             cv2.rectangle(debug_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(debug_image, f"{class_name}: {confidence:.2f}", (x1, y1-10),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
-            if class_name == 'firstName':
-                first_name = extract_text(cropped_image, bbox, lang='ara')
-                print(f"   📝 First Name: '{first_name}'")
-            elif class_name == 'lastName':
-                second_name = extract_text(cropped_image, bbox, lang='ara')
-                print(f"   📝 Last Name: '{second_name}'")
-            elif class_name == 'serial':
-                serial = extract_text(cropped_image, bbox, lang='eng')
-                print(f"   📝 Serial: '{serial}'")
-            elif class_name == 'address':
-                address = extract_text(cropped_image, bbox, lang='ara')
-                print(f"   📝 Address: '{address}'")
-            elif class_name == 'nid':
-                expanded_bbox = expand_bbox_height(
-                    bbox, scale=1.5, image_shape=cropped_image.shape)
-                cropped_nid = cropped_image[expanded_bbox[1]:expanded_bbox[3], expanded_bbox[0]:expanded_bbox[2]]
-                nid = detect_national_id(cropped_nid)
-                print(f"   📝 National ID: '{nid}'")
+            # The last detection of a class is the one read
+            field_boxes[class_name] = bbox
+
+    graph = StageGraph('id')
+    for class_name, bbox in field_boxes.items():
+        if class_name in FIELD_LANGUAGES:
+            graph.add(class_name, functools.partial(
+                extract_text, cropped_image, bbox, lang=FIELD_LANGUAGES[class_name],
+                denoise_strategy=denoise_strategy, field=class_name))
+        elif class_name == 'nid':
+            graph.add(class_name, functools.partial(read_national_id, cropped_image, bbox))
+    fields = graph.run()
+
+    first_name = fields.get('firstName', '')
+    second_name = fields.get('lastName', '')
+    nid = fields.get('nid', '')
+    address = fields.get('address', '')
+    serial = fields.get('serial', '')
+    logger.debug("Read fields: first name %s, last name %s, NID %s, address %s, serial %s",
+                 pii(first_name), pii(second_name), pii(nid), pii(address), pii(serial))
 
     merged_name = f"{first_name} {second_name}"
-    print(f"First Name: {first_name}")
-    print(f"Second Name: {second_name}")
-    print(f"Full Name: {merged_name}")
-    print(f"National ID: {nid}")
-    print(f"Address: {address}")
-    print(f"Serial: {serial}")
 
     detected_field_names = [field['class'] for field in detected_fields]
     expected_fields = ['firstName', 'lastName', 'nid', 'address', 'serial']
     missing_fields = [
         field for field in expected_fields if field not in detected_field_names]
-    print(f"🔍 Field Detection Summary:")
-    print(f"   ✅ Detected: {detected_field_names}")
-    print(f"   ❌ Missing: {missing_fields}")
+    logger.debug("Fields detected: %s, missing: %s", detected_field_names, missing_fields)
 
-    debug_folder = 'debug_images'
-    os.makedirs(debug_folder, exist_ok=True)
-    debug_output_path = os.path.join(debug_folder, 'egyptian_id_debug.jpg')
-    cv2.imwrite(debug_output_path, debug_image)
-    print(f"💾 Debug image saved to: {debug_output_path}")
-    print(f"📋 Total fields detected: {len(detected_fields)}")
+    debug_output_path = save_debug_image('egyptian_id_debug.jpg', debug_image)
 
     decoded_info = decode_egyptian_id(nid)
     return (first_name, second_name, merged_name, nid, address, decoded_info["Birth Date"], decoded_info["Governorate"], decoded_info["Gender"], detected_fields, debug_output_path, serial)
 
 
-def decode_egyptian_id(id_number):
-    if not id_number or len(id_number) < 14:
-        print(
-            f"⚠️ Invalid ID number length: {len(id_number) if id_number else 0} (expected 14)")
-        return {
-            'Birth Date': 'Unknown',
-            'Governorate': 'Unknown',
-            'Gender': 'Unknown'
-        }
+def order_quad_points(points):
+    """Order four corner points as top-left, top-right, bottom-right, bottom-left."""
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    # Clockwise on screen (y grows downwards) by angle around the centroid;
+    # unlike sum/difference ordering this never repeats a corner, even for
+    # a card turned 45 degrees
+    center = points.mean(axis=0)
+    angles = np.arctan2(points[:, 1] - center[1], points[:, 0] - center[0])
+    points = points[np.argsort(angles)]
+    # Start from the corner nearest the top-left
+    return np.roll(points, -int(np.argmin(points.sum(axis=1))), axis=0)
 
-    governorates = {
-        '01': 'Cairo',
-        '02': 'Alexandria',
-        '03': 'Port Said',
-        '04': 'Suez',
-        '11': 'Damietta',
-        '12': 'Dakahlia',
-        '13': 'Ash Sharqia',
-        '14': 'Kaliobeya',
-        '15': 'Kafr El - Sheikh',
-        '16': 'Gharbia',
-        '17': 'Monoufia',
-        '18': 'El Beheira',
-        '19': 'Ismailia',
-        '21': 'Giza',
-        '22': 'Beni Suef',
-        '23': 'Fayoum',
-        '24': 'El Menia',
-        '25': 'Assiut',
-        '26': 'Sohag',
-        '27': 'Qena',
-        '28': 'Aswan',
-        '29': 'Luxor',
-        '31': 'Red Sea',
-        '32': 'New Valley',
-        '33': 'Matrouh',
-        '34': 'North Sinai',
-        '35': 'South Sinai',
-        '88': 'Foreign'
-    }
 
-    try:
-        century_digit = int(id_number[0])
-        year = int(id_number[1:3])
-        month = int(id_number[3:5])
-        day = int(id_number[5:7])
-        governorate_code = id_number[7:9]
-        gender_code = int(id_number[12:13])
-    except (ValueError, IndexError) as e:
-        print(f"⚠️ Error parsing ID number '{id_number}': {e}")
-        return {
-            'Birth Date': 'Unknown',
-            'Governorate': 'Unknown',
-            'Gender': 'Unknown'
-        }
+def find_card_quad(image, bbox):
+    """
+    Refine an axis-aligned card box to the card's four corners.
+    Searches the edge contours inside `bbox` for a large quadrilateral with
+    a card-like aspect ratio. Returns the ordered corners in image
+    coordinates, or None when no confident quad is found.
+    """
+    x1, y1, x2, y2 = bbox
+    roi = image[y1:y2, x1:x2]
+    if roi.size == 0:
+        return None
+
+    # Corner search does not need full resolution
+    scale = min(1.0, CARD_QUAD_SEARCH_SIDE / max(roi.shape[:2]))
+    if scale < 1.0:
+        roi = cv2.resize(roi, None, fx=scale, fy=scale,
+                         interpolation=cv2.INTER_AREA)
+
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if len(
+        roi.shape) == 3 else roi
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.Canny(gray, 50, 150)
+    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE,
+                             np.ones((5, 5), np.uint8), iterations=2)
+
+    contours, _ = cv2.findContours(
+        edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    roi_area = float(roi.shape[0] * roi.shape[1])
+
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        hull = cv2.convexHull(contour)
+        if cv2.contourArea(hull) < 0.5 * roi_area:
+            break
+
+        approx = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+        if len(approx) == 4:
+            corners = approx.reshape(4, 2).astype(np.float32)
+        else:
+            # Rounded or partly occluded corners: fall back to the
+            # minimum-area rectangle around the contour
+            corners = cv2.boxPoints(cv2.minAreaRect(hull)).astype(np.float32)
 
-    if century_digit == 2:
-        century = "1900-1999"
-        full_year = 1900 + year
-    elif century_digit == 3:
-        century = "2000-2099"
-        full_year = 2000 + year
-    else:
-        raise ValueError("Invalid century digit")
+        corners = order_quad_points(corners)
+        top_left, top_right, bottom_right, bottom_left = corners
+        quad_width = np.linalg.norm(top_right - top_left)
+        quad_height = np.linalg.norm(bottom_left - top_left)
+        aspect = max(quad_width, quad_height) / \
+            max(min(quad_width, quad_height), 1.0)
+        if not 1.3 <= aspect <= 1.9:
+            continue
 
-    gender = "Male" if gender_code % 2 != 0 else "Female"
-    governorate = governorates.get(governorate_code, "Unknown")
-    birth_date = f"{full_year:04d}-{month:02d}-{day:02d}"
+        corners = corners / scale + np.array([x1, y1], dtype=np.float32)
+        logger.debug("Card corners refined: %s (aspect %.2f)", corners.astype(int).tolist(), aspect)
+        return corners
 
-    return {
-        'Birth Date': birth_date,
-        'Governorate': governorate,
-        'Gender': gender
-    }
+    return None
 
 
-def detect_and_process_id_card(image_path):
-    print(f"🖼️ Processing image: {image_path}")
+def normalize_card(image, quad, long_side=None, aspect_ratio=None):
+    """
+    Warp the card outlined by `quad` to a canonical, bounded resolution.
+    The output keeps the quad's aspect ratio (or `aspect_ratio`, long side
+    over short side, when given) with its long side scaled to `long_side`,
+    so field detection and OCR always see the card at the same scale
+    whatever the upload resolution was.
+    """
+    long_side = long_side or CARD_CANONICAL_LONG_SIDE
+    quad = order_quad_points(quad)
+    top_left, top_right, bottom_right, bottom_left = quad
+
+    quad_width = max(np.linalg.norm(top_right - top_left),
+                     np.linalg.norm(bottom_right - bottom_left))
+    quad_height = max(np.linalg.norm(bottom_left - top_left),
+                      np.linalg.norm(bottom_right - top_right))
+    scale = long_side / max(quad_width, quad_height, 1.0)
+    out_width = max(1, int(round(quad_width * scale)))
+    out_height = max(1, int(round(quad_height * scale)))
+    if aspect_ratio:
+        short_side = max(1, int(round(long_side / aspect_ratio)))
+        if quad_width >= quad_height:
+            out_width, out_height = long_side, short_side
+        else:
+            out_width, out_height = short_side, long_side
 
-    image = cv2.imread(image_path)
+    # Cut the quad's bounding rectangle first so large uploads are never
+    # warped at full size, and shrink it with INTER_AREA (warpPerspective
+    # only interpolates bilinearly, which aliases on large downscales).
+    height, width = image.shape[:2]
+    rx1 = max(0, int(np.floor(quad[:, 0].min())))
+    ry1 = max(0, int(np.floor(quad[:, 1].min())))
+    rx2 = min(width, int(np.ceil(quad[:, 0].max())) + 1)
+    ry2 = min(height, int(np.ceil(quad[:, 1].max())) + 1)
+    region = image[ry1:ry2, rx1:rx2]
+    quad = quad - np.array([rx1, ry1], dtype=np.float32)
+
+    if scale < 1.0:
+        region_height, region_width = region.shape[:2]
+        region = cv2.resize(region, (max(1, int(round(region_width * scale))),
+                                     max(1, int(round(region_height * scale)))),
+                            interpolation=cv2.INTER_AREA)
+        quad = quad * np.array([region.shape[1] / region_width,
+                                region.shape[0] / region_height], dtype=np.float32)
+
+    target = np.array([
+        [0, 0],
+        [out_width - 1, 0],
+        [out_width - 1, out_height - 1],
+        [0, out_height - 1]
+    ], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(quad, target)
+    normalized = cv2.warpPerspective(region, matrix, (out_width, out_height),
+                                     flags=cv2.INTER_CUBIC if scale > 1.0 else cv2.INTER_LINEAR,
+                                     borderMode=cv2.BORDER_REPLICATE)
+
+    logger.debug("Normalized card from %dx%d to %dx%d",
+                 quad_width, quad_height, out_width, out_height)
+    return normalized
+
+
+def detect_and_process_id_card(image_path, denoise_strategy=None):
+    """`image_path` may also be the encoded image bytes."""
+    logger.debug("Processing image %s", image_path if isinstance(image_path, str) else 'upload')
+
+    with stage_timer('id', 'decode'):
+        image, _ = decode_image(image_path)
 
     if image is None:
-        raise ValueError(f"Could not load image from {image_path}")
+        raise ValueError("Could not load image")
 
-    print("🔧 Applying image preprocessing...")
-    preprocessed_image = preprocess_id_image(image)
+    return process_id_card_image(image, denoise_strategy)
 
-    id_card_model = YOLO('models/detect_id_card.pt')
 
-    id_card_results = id_card_model(preprocessed_image)
+def process_id_card_image(image, denoise_strategy=None):
+    """The full ID pipeline on an already decoded BGR image."""
+    # Localize the card on the upload as-is; orientation is scored on the
+    # small normalized crop afterwards instead of on the full image.
+    id_card_model = get_detector('detect_id_card')
 
-    print(f"🃏 ID Card Detection Results:")
-    print(
-        f"   📊 Total ID card detections: {len(id_card_results[0].boxes) if id_card_results[0].boxes is not None else 0}")
+    checkpoint('card_detection')
+    with stage_timer('id', 'card_detection'):
+        id_card_results = id_card_model(image, verbose=False, **inference_args(id_card_model))
 
+    best_box = None
+    best_confidence = -1.0
     for result in id_card_results:
         for box in result.boxes:
             x1, y1, x2, y2 = map(int, box.xyxy[0])
             confidence = float(box.conf[0].item())
-            print(
-                f"   🎯 ID Card detected (conf: {confidence:.3f}) at [{x1}, {y1}, {x2}, {y2}]")
+            logger.debug("ID card detected (conf %.3f) at [%d, %d, %d, %d]",
+                         confidence, x1, y1, x2, y2)
+            if confidence > best_confidence:
+                best_confidence = confidence
+                best_box = (x1, y1, x2, y2)
 
-            height, width = preprocessed_image.shape[:2]
-            padding_top = max(20, int((y2 - y1) * 0.1))
-            padding_sides = max(10, int((x2 - x1) * 0.05)
-                                )
-            padding_bottom = max(50, int((y2 - y1) * 0.15)
-                                 )
+    height, width = image.shape[:2]
+    if best_box is not None:
+        x1, y1, x2, y2 = best_box
+        padding_top = max(20, int((y2 - y1) * 0.1))
+        padding_sides = max(10, int((x2 - x1) * 0.05)
+                            )
+        padding_bottom = max(50, int((y2 - y1) * 0.15)
+                             )
+
+        x1_padded = max(0, x1 - padding_sides)
+        y1_padded = max(0, y1 - padding_top)
+        x2_padded = min(width, x2 + padding_sides)
+        y2_padded = min(height, y2 + padding_bottom)
+    else:
+        logger.info("No ID card detected, using the full image")
+        x1_padded, y1_padded, x2_padded, y2_padded = 0, 0, width, height
+
+    with stage_timer('id', 'card_rectification'):
+        card_quad = find_card_quad(
+            image, (x1_padded, y1_padded, x2_padded, y2_padded))
+        if card_quad is not None:
+            cropped_image = normalize_card(
+                image, card_quad, aspect_ratio=ID_CARD_ASPECT_RATIO)
+        else:
+            logger.debug("Cropping with padding: [%d, %d, %d, %d]",
+                         x1_padded, y1_padded, x2_padded, y2_padded)
+            card_quad = [(x1_padded, y1_padded), (x2_padded, y1_padded),
+                         (x2_padded, y2_padded), (x1_padded, y2_padded)]
+            cropped_image = normalize_card(image, card_quad)
+
+    save_debug_image('cropped_id_card.jpg', cropped_image)
+    cropped_image, field_results = preprocess_id_image(cropped_image)
 
-            x1_padded = max(0, x1 - padding_sides)
-            y1_padded = max(0, y1 - padding_top)
-            x2_padded = min(width, x2 + padding_sides)
-            y2_padded = min(height, y2 + padding_bottom)
+    cropped_image = denoise_card(cropped_image, denoise_strategy)
+    return process_image(cropped_image, denoise_strategy=denoise_strategy,
+                         field_results=field_results)
 
-            print(
-                f"   📐 Cropping with padding: [{x1_padded}, {y1_padded}, {x2_padded}, {y2_padded}]")
-            cropped_image = preprocessed_image[y1_padded:y2_padded,
-                                               x1_padded:x2_padded]
 
-            debug_folder = 'debug_images'
-            os.makedirs(debug_folder, exist_ok=True)
-            cropped_path = os.path.join(debug_folder, 'cropped_id_card.jpg')
-            cv2.imwrite(cropped_path, cropped_image)
-            print(f"💾 Cropped ID card saved to: {cropped_path}")
+def frame_bbox(x1, y1, x2, y2, width, height, scale_x=1.0, scale_y=1.0):
+    """
+    A box on the decoded image (width x height) in original frame pixels,
+    plus frame-normalized coordinates, which do not depend on the scale.
+    """
+    fx1, fy1 = int(round(x1 * scale_x)), int(round(y1 * scale_y))
+    fx2, fy2 = int(round(x2 * scale_x)), int(round(y2 * scale_y))
+    return {
+        "x1": fx1,
+        "y1": fy1,
+        "x2": fx2,
+        "y2": fy2,
+        "x1_norm": round(float(x1 / width), 3),
+        "y1_norm": round(float(y1 / height), 3),
+        "x2_norm": round(float(x2 / width), 3),
+        "y2_norm": round(float(y2 / height), 3),
+        "width": fx2 - fx1,
+        "height": fy2 - fy1
+    }
+
 
-    return process_image(cropped_image)
+def quick_inference_args(detector):
+    """Reduced input size for the real-time path, where the export allows it."""
+    if not QUICK_INFER_SIZE or not detector.dynamic_input:
+        return {}
+    return {'imgsz': QUICK_INFER_SIZE}
 
 
-def check_image_quality(image):
+def check_image_quality(image, frame_size=None):
     """
     Check image quality for ID card detection.
     Returns quality metrics: blur, brightness, size, and overall quality score.
+    `frame_size` is the (width, height) of the original frame when `image`
+    was decoded at reduced scale.
     """
-    height, width = image.shape[:2]
+    width, height = frame_size or image.shape[1::-1]
 
     # Convert to grayscale for blur detection
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(
@@ -579,10 +806,13 @@ def detect_id_card_quick(image_path):
     Detects individual fields (firstName, lastName, nid, address, serial) 
     and individual ID number digits in real-time.
     Returns detection status, field bounding boxes, and quality metrics.
+    `image_path` may also be the encoded image bytes; images refused by
+    ingest.inspect_image raise UploadRejected.
     """
-    print(f"🔍 Quick field detection for: {image_path}")
+    logger.debug("Quick field detection for %s", image_path if isinstance(image_path, str) else 'upload')
 
-    image = cv2.imread(image_path)
+    with stage_timer('id_quick', 'decode'):
+        image, frame_size = decode_image(image_path, min_side=QUICK_DECODE_MIN_SIDE)
 
     if image is None:
         return {
@@ -595,14 +825,20 @@ def detect_id_card_quick(image_path):
         }
 
     # Check image quality first
-    quality_metrics = check_image_quality(image)
+    quality_metrics = check_image_quality(image, frame_size)
 
     try:
         height, width = image.shape[:2]
+        # Everything below works on the decoded image; boxes are scaled back
+        # to the original frame on output
+        scale_x = frame_size[0] / width
+        scale_y = frame_size[1] / height
 
         # Step 1: Detect ID card boundary first
-        id_card_model = YOLO('models/detect_id_card.pt')
-        card_results = id_card_model(image, conf=0.5, verbose=False)
+        id_card_model = get_detector('detect_id_card')
+        with stage_timer('id_quick', 'card_detection'):
+            card_results = id_card_model(
+                image, conf=0.5, verbose=False, **quick_inference_args(id_card_model))
 
         card_detected = False
         cropped_image = image
@@ -629,10 +865,14 @@ def detect_id_card_quick(image_path):
                 break
 
         # Step 2: Detect individual fields on the ID card
-        fields_model = YOLO('models/detect_odjects.pt')
-        field_results = fields_model(cropped_image, conf=0.3, verbose=False)
+        fields_model = get_detector('detect_odjects')
+        checkpoint('field_detection')
+        with stage_timer('id_quick', 'field_detection'):
+            field_results = fields_model(
+                cropped_image, conf=0.3, verbose=False, **quick_inference_args(fields_model))
 
         detected_fields = []
+        nid_box = None
         field_counts = {
             'firstName': 0,
             'lastName': 0,
@@ -662,19 +902,12 @@ def detect_id_card_quick(image_path):
                     detected_fields.append({
                         "field": class_name,
                         "confidence": round(confidence, 3),
-                        "bbox": {
-                            "x1": int(x1_orig),
-                            "y1": int(y1_orig),
-                            "x2": int(x2_orig),
-                            "y2": int(y2_orig),
-                            "x1_norm": round(float(x1_orig / width), 3),
-                            "y1_norm": round(float(y1_orig / height), 3),
-                            "x2_norm": round(float(x2_orig / width), 3),
-                            "y2_norm": round(float(y2_orig / height), 3),
-                            "width": int(x2_orig - x1_orig),
-                            "height": int(y2_orig - y1_orig)
-                        }
+                        "bbox": frame_bbox(x1_orig, y1_orig, x2_orig, y2_orig,
+                                           width, height, scale_x, scale_y)
                     })
+                    if class_name == 'nid' and nid_box is None:
+                        # Decoded-image coordinates, for the digit pass
+                        nid_box = (x1_orig, y1_orig, x2_orig, y2_orig)
 
         # Step 3: Detect photo region on Egyptian ID (on the LEFT side)
         photo_detected = False
@@ -695,77 +928,60 @@ def detect_id_card_quick(image_path):
                 photo_detected = True
 
                 # Calculate photo bounding box in original image coordinates (LEFT side)
-                photo_bbox = {
-                    "x1": int(crop_offset_x),
-                    "y1": int(crop_offset_y),
-                    "x2": int(photo_region_x_end + crop_offset_x),
-                    "y2": int(cropped_image.shape[0] + crop_offset_y),
-                    "x1_norm": round(float(crop_offset_x / width), 3),
-                    "y1_norm": round(float(crop_offset_y / height), 3),
-                    "x2_norm": round(float((photo_region_x_end + crop_offset_x) / width), 3),
-                    "y2_norm": round(float((cropped_image.shape[0] + crop_offset_y) / height), 3),
-                    "width": int(photo_region_x_end),
-                    "height": int(cropped_image.shape[0]),
-                    "variance": float(photo_variance),
-                    "is_clear": bool(photo_variance > 200)
-                }
-
-                print(
-                    f"   📸 Photo detected in LEFT region (variance: {photo_variance:.2f})")
+                photo_bbox = frame_bbox(
+                    crop_offset_x, crop_offset_y,
+                    photo_region_x_end + crop_offset_x, cropped_image.shape[0] + crop_offset_y,
+                    width, height, scale_x, scale_y)
+                photo_bbox["variance"] = float(photo_variance)
+                photo_bbox["is_clear"] = bool(photo_variance > 200)
+
+                logger.debug("Photo detected in left region (variance %.2f)", photo_variance)
             else:
-                print(
-                    f"   ⚠️ No clear photo detected (variance: {photo_variance:.2f}, threshold: 100)")
+                logger.debug("No clear photo detected (variance %.2f, threshold 100)", photo_variance)
 
         # Step 4: Detect individual ID number digits (if nid field was detected)
         id_digits = []
-        nid_field = next(
-            (f for f in detected_fields if f['field'] == 'nid'), None)
+        nid_decoded = None
 
-        if nid_field:
-            nid_bbox = nid_field['bbox']
-            expand_y = int((nid_bbox['y2'] - nid_bbox['y1']) * 0.25)
-            y1_exp = max(0, nid_bbox['y1'] - expand_y)
-            y2_exp = min(height, nid_bbox['y2'] + expand_y)
+        if nid_box is not None:
+            nid_x1, nid_y1, nid_x2, nid_y2 = nid_box
+            expand_y = int((nid_y2 - nid_y1) * 0.25)
+            y1_exp = max(0, nid_y1 - expand_y)
+            y2_exp = min(height, nid_y2 + expand_y)
 
-            nid_region = image[y1_exp:y2_exp, nid_bbox['x1']:nid_bbox['x2']]
+            nid_region = image[y1_exp:y2_exp, nid_x1:nid_x2]
 
             try:
-                digits_model = YOLO('models/detect_id.pt')
-                digit_results = digits_model(
-                    nid_region, conf=0.4, verbose=False)
-
-                for result in digit_results:
-                    if result.boxes is not None:
-                        for box in result.boxes:
-                            digit = int(box.cls[0].item())
-                            confidence = float(box.conf[0].item())
-                            x1, y1, x2, y2 = map(int, box.xyxy[0])
-
-                            # Adjust to original image coordinates
-                            x1_orig = x1 + nid_bbox['x1']
-                            y1_orig = y1 + y1_exp
-                            x2_orig = x2 + nid_bbox['x1']
-                            y2_orig = y2 + y1_exp
-
-                            id_digits.append({
-                                "digit": int(digit),
-                                "confidence": round(confidence, 3),
-                                "bbox": {
-                                    "x1": int(x1_orig),
-                                    "y1": int(y1_orig),
-                                    "x2": int(x2_orig),
-                                    "y2": int(y2_orig),
-                                    "x1_norm": round(float(x1_orig / width), 3),
-                                    "y1_norm": round(float(y1_orig / height), 3),
-                                    "x2_norm": round(float(x2_orig / width), 3),
-                                    "y2_norm": round(float(y2_orig / height), 3)
-                                }
-                            })
-
-                # Sort digits by x position (left to right)
-                id_digits.sort(key=lambda d: d['bbox']['x1'])
+                digits_model = get_detector('detect_id')
+                checkpoint('nid_digits')
+                with stage_timer('id_quick', 'nid_digits'):
+                    digit_results = digits_model(
+                        nid_region, conf=NID_DIGIT_CONF, verbose=False,
+                        **quick_inference_args(digits_model))
+
+                positions = group_digits(digit_results)
+                nid_decoded = decode_digits(positions)
+
+                # Positions come back sorted left to right
+                for position in positions:
+                    if position['confidence'] < 0.4:
+                        continue
+                    x1, y1, x2, y2 = position['bbox']
+
+                    # Adjust to original image coordinates
+                    x1_orig = x1 + nid_x1
+                    y1_orig = y1 + y1_exp
+                    x2_orig = x2 + nid_x1
+                    y2_orig = y2 + y1_exp
+
+                    id_digits.append({
+                        "digit": int(position['digit']),
+                        "confidence": round(position['confidence'], 3),
+                        "bbox": frame_bbox(x1_orig, y1_orig, x2_orig, y2_orig,
+                                           width, height, scale_x, scale_y)
+                    })
             except Exception as e:
-                print(f"⚠️ Digit detection error: {e}")
+                logger.warning("Digit detection error: %s", e)
 
         # Calculate overall detection quality
         # firstName is optional (model struggles with it), but other 4 fields are required
@@ -842,15 +1058,18 @@ def detect_id_card_quick(image_path):
         else:
             message = f"All required fields detected. Improve image quality."
 
-        print(f"   📊 Fields detected: {field_counts}")
-        print(f"   🔢 ID digits detected: {len(id_digits)}")
-        print(f"   📸 Photo detected: {photo_detected}")
-        print(f"   ✅ Ready for capture: {ready_for_capture}")
+        logger.debug("Quick detection: fields %s, %d digits, photo %s, ready %s",
+                     field_counts, len(id_digits), photo_detected, ready_for_capture)
 
         return {
             "detected": bool(len(detected_fields) > 0),
             "fields": detected_fields,
             "id_digits": id_digits,
+            "national_id": {
+                "value": nid_decoded['national_id'],
+                "valid": nid_decoded['valid'],
+                "checksum_ok": nid_decoded['checksum_ok']
+            } if nid_decoded else None,
             "photo": {
                 "detected": bool(photo_detected),
                 "bbox": photo_bbox if photo_detected else None
@@ -865,9 +1084,7 @@ def detect_id_card_quick(image_path):
         }
 
     except Exception as e:
-        print(f"⚠️ Quick detection error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Quick detection error: %s", e)
         return {
             "detected": False,
             "error": str(e),
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+1:N face search for duplicate-identity screening.
+
+Face embeddings (InceptionResnetV1, 512-d) are stored L2-normalized, one
+row per enrolled face, in a flat matrix on disk that every worker
+memory-maps read-only, so the index costs page cache rather than heap:
+
+    OCR_FACE_INDEX_DIR/vectors.bin   rows of OCR_FACE_INDEX_DTYPE
+    OCR_FACE_INDEX_DIR/ids.jsonl     {"row": ..., "id": ..., "added": ...}
+    OCR_FACE_INDEX_DIR/meta.json     dimension and dtype of the rows
+
+Rows are float16 (1 KB per face) or int8 (512 bytes, cosine within about
+0.01). Inserts append under an exclusive flock, so gunicorn workers can
+enroll concurrently; each worker maps rows added by the others on its
+next search. Where fcntl is missing (Windows) the index is unavailable
+and the server answers its endpoints with 503.
+
+A search scores the query against every row with one matrix product per
+block of SEARCH_CHUNK_ROWS and keeps the top k with argpartition. With
+OCR_FACE_INDEX_ANN=hnsw and hnswlib installed, indexes of at least
+OCR_FACE_INDEX_ANN_MIN rows are searched through an HNSW graph instead
+(approximate, sub-millisecond). The graph is kept in memory and extended
+as rows arrive; build it ahead of time so workers load it rather than
+build it on their first search:
+
+    python face_index.py build
+    python face_index.py stats
+
+Search latency is exported as ocr_face_index_search_seconds and the
+recent percentiles are reported by /face-index/stats.
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from metrics import FACE_INDEX_SEARCH_SECONDS, Gauge
+
+try:
+    import fcntl
+except ImportError:
+    # No flock to serialize appends from several workers
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FACE_INDEX_DIR = os.environ.get('OCR_FACE_INDEX_DIR', 'face_index')
+FACE_INDEX_DTYPE = os.environ.get('OCR_FACE_INDEX_DTYPE', 'float16')
+# '' for exact search only, 'hnsw' for an hnswlib graph on large indexes
+FACE_INDEX_ANN = os.environ.get('OCR_FACE_INDEX_ANN', '')
+ANN_MIN_ROWS = int(os.environ.get('OCR_FACE_INDEX_ANN_MIN', '50000'))
+ANN_EF = int(os.environ.get('OCR_FACE_INDEX_ANN_EF', '64'))
+# Same cut-off as /verify-face
+DUPLICATE_THRESHOLD = float(os.environ.get('OCR_FACE_DUPLICATE_THRESHOLD', '0.7'))
+
+EMBEDDING_DIM = 512
+DTYPES = ['float16', 'int8']
+INT8_SCALE = 127.0
+# Rows converted to float32 and scored per matrix product (8 MB at 512-d)
+SEARCH_CHUNK_ROWS = 4096
+LATENCY_WINDOW = 1000
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+
+ANN_AVAILABLE = importlib.util.find_spec('hnswlib') is not None
+FACE_INDEX_AVAILABLE = fcntl is not None
+
+
+def normalize(embedding) -> np.ndarray:
+    """A 1-d float32 unit vector from an embedding (array or (1, d) tensor)."""
+    if hasattr(embedding, 'detach'):
+        embedding = embedding.detach().float().cpu().numpy()
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    if not norm or not np.isfinite(norm):
+        raise ValueError("Embedding has no direction")
+    return vector / norm
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class FaceIndex:
+    def __init__(self, directory: str = FACE_INDEX_DIR, dtype: str = FACE_INDEX_DTYPE,
+                 dim: int = EMBEDDING_DIM, ann: str = FACE_INDEX_ANN):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, 'vectors.bin')
+        self.ids_path = os.path.join(directory, 'ids.jsonl')
+        self.hnsw_path = os.path.join(directory, 'hnsw.bin')
+
+        meta = self._load_meta(dtype, dim)
+        self.dtype = np.dtype(meta['dtype'])
+        self.dim = meta['dim']
+        self.row_bytes = self.dim * self.dtype.itemsize
+        self.scale = 1.0 / INT8_SCALE if self.dtype == np.int8 else 1.0
+
+        self.ann = ann if ann and ANN_AVAILABLE else None
+        if ann and not self.ann:
+            logger.warning("OCR_FACE_INDEX_ANN=%s but hnswlib is not installed; "
+                           "searching exactly", ann)
+
+        self._lock = threading.Lock()
+        self._ann_lock = threading.Lock()
+        self._matrix = np.empty((0, self.dim), self.dtype)
+        self._records = []
+        self._ids_offset = 0
+        self._graph = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._searches = {'exact': 0, 'hnsw': 0}
+        self.refresh()
+
+    def _load_meta(self, dtype: str, dim: int) -> dict:
+        path = os.path.join(self.directory, 'meta.json')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['dtype'] != dtype:
+                logger.warning("Face index %s stores %s, not %s; keeping %s",
+                               self.directory, meta['dtype'], dtype, meta['dtype'])
+            return meta
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown face index dtype: {dtype}")
+        meta = {'dim': dim, 'dtype': dtype}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return meta
+
+    def _encode(self, vector: np.ndarray) -> np.ndarray:
+        if len(vector) != self.dim:
+            raise ValueError(f"Embedding has {len(vector)} dimensions, the index {self.dim}")
+        if self.dtype == np.int8:
+            return np.clip(np.rint(vector * INT8_SCALE), -127, 127).astype(np.int8)
+        return vector.astype(self.dtype)
+
+    def _read_records(self) -> None:
+        """Pick up id records appended since the last read (complete lines only)."""
+        try:
+            with open(self.ids_path, 'rb') as f:
+                f.seek(self._ids_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        # A new list rather than an in-place edit: searches hold on to the old one
+        records = list(self._records)
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            row = record['row']
+            # A row rewritten after an interrupted insert replaces its record
+            del records[row:]
+            records.append(record)
+        self._records = records
+        self._ids_offset += end
+
+    def refresh(self) -> int:
+        """Map rows appended since the last call, by any process; returns the row count."""
+        with self._lock:
+            self._read_records()
+            try:
+                rows = os.path.getsize(self.vectors_path) // self.row_bytes
+            except FileNotFoundError:
+                rows = 0
+            count = min(rows, len(self._records))
+            if count != len(self._matrix):
+                self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r',
+                                         shape=(count, self.dim))
+            matrix = self._matrix
+        if self.ann and len(matrix) >= ANN_MIN_ROWS:
+            self._extend_graph(matrix)
+        return len(matrix)
+
+    def add(self, embedding, identity: str) -> int:
+        """Append one face under `identity`; returns its row."""
+        row_data = self._encode(normalize(embedding)).tobytes()
+        with open(self.vectors_path, 'ab') as vectors, open(self.ids_path, 'ab') as ids:
+            fcntl.flock(vectors, fcntl.LOCK_EX)
+            try:
+                # Drop the tail of an insert interrupted between its two writes
+                size = os.fstat(vectors.fileno()).st_size
+                row = size // self.row_bytes
+                if size % self.row_bytes:
+                    vectors.truncate(row * self.row_bytes)
+                record = {'row': row, 'id': identity, 'added': round(time.time(), 3)}
+                ids.write(json.dumps(record).encode('utf-8') + b'\n')
+                ids.flush()
+                vectors.write(row_data)
+                vectors.flush()
+            finally:
+                fcntl.flock(vectors, fcntl.LOCK_UN)
+        self.refresh()
+        return row
+
+    def _load_graph(self):
+        import hnswlib
+        graph = hnswlib.Index(space='ip', dim=self.dim)
+        if os.path.exists(self.hnsw_path):
+            graph.load_index(self.hnsw_path, max_elements=len(self._matrix))
+            logger.info("Loaded HNSW graph of %s faces", graph.get_current_count())
+        else:
+            graph.init_index(max_elements=len(self._matrix), M=HNSW_M,
+                             ef_construction=HNSW_EF_CONSTRUCTION)
+        graph.set_ef(ANN_EF)
+        return graph
+
+    def _extend_graph(self, matrix: np.ndarray) -> None:
+        """Bring the HNSW graph up to `matrix`, creating or loading it first."""
+        with self._ann_lock:
+            if self._graph is None:
+                self._graph = self._load_graph()
+            graph = self._graph
+            start = graph.get_current_count()
+            if start >= len(matrix):
+                return
+            started = time.perf_counter()
+            if graph.get_max_elements() < len(matrix):
+                graph.resize_index(max(len(matrix), graph.get_max_elements() * 2))
+            for offset in range(start, len(matrix), SEARCH_CHUNK_ROWS):
+                block = np.asarray(matrix[offset:offset + SEARCH_CHUNK_ROWS], dtype=np.float32)
+                graph.add_items(block * self.scale,
+                                np.arange(offset, offset + len(block)))
+            if len(matrix) - start > 1:
+                logger.info("Added %s faces to the HNSW graph in %.2fs",
+                            len(matrix) - start, time.perf_counter() - started)
+
+    def _search_exact(self, matrix: np.ndarray, query: np.ndarray, k: int):
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        query = query * np.float32(self.scale)
+        # Converting the stored rows costs more than scoring them; reuse one buffer
+        buffer = np.empty((min(SEARCH_CHUNK_ROWS, len(matrix)), self.dim), dtype=np.float32)
+        for offset in range(0, len(matrix), SEARCH_CHUNK_ROWS):
+            rows = matrix[offset:offset + SEARCH_CHUNK_ROWS]
+            block = buffer[:len(rows)]
+            np.copyto(block, rows)
+            scores = block @ query
+            top = _top_k(scores, k)
+            best_rows = np.concatenate([best_rows, top + offset])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            keep = _top_k(best_scores, k)
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+        return best_rows, best_scores
+
+    def _search_graph(self, query: np.ndarray, k: int):
+        with self._ann_lock:
+            graph = self._graph
+            k = min(k, graph.get_current_count())
+            if graph.ef < k:
+                graph.set_ef(k)
+            labels, distances = graph.knn_query(query, k=k)
+        # hnswlib's 'ip' distance is 1 - dot product
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+    def search(self, embedding, k: int = 5, threshold: float = None):
+        """
+        The k enrolled faces most similar to `embedding`, best first, as
+        dicts with id, row and similarity (cosine), and the method used.
+        With `threshold`, only matches scoring at least that are returned.
+        """
+        start = time.perf_counter()
+        query = normalize(embedding)
+        if len(query) != self.dim:
+            raise ValueError(f"Embedding has {len(query)} dimensions, the index {self.dim}")
+        self.refresh()
+        with self._lock:
+            matrix, records = self._matrix, self._records
+
+        method = 'exact'
+        if not len(matrix) or k < 1:
+            rows, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        elif self._graph is not None and len(matrix) >= ANN_MIN_ROWS:
+            method = 'hnsw'
+            rows, scores = self._search_graph(query, k)
+        else:
+            rows, scores = self._search_exact(matrix, query, k)
+
+        matches = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            if threshold is not None and score < threshold:
+                break
+            if row >= len(matrix):
+                # Added to the graph by a concurrent refresh after this snapshot
+                continue
+            matches.append({"id": records[row]['id'], "row": row,
+                            "similarity": round(score, 4)})
+
+        seconds = time.perf_counter() - start
+        FACE_INDEX_SEARCH_SECONDS.observe(seconds, method=method)
+        with self._lock:
+            self._latencies.append(seconds)
+            self._searches[method] += 1
+        return matches, method
+
+    def save_graph(self) -> int:
+        """Build the HNSW graph over every row and write it for workers to load."""
+        count = self.refresh()
+        if not ANN_AVAILABLE:
+            raise RuntimeError("hnswlib is not installed")
+        with self._lock:
+            matrix = self._matrix
+        if self._graph is None:
+            # Loading a stale file and extending it is as good as a rebuild
+            if not len(matrix):
+                return 0
+            self._extend_graph(matrix)
+        with self._ann_lock:
+            self._graph.save_index(self.hnsw_path)
+        return count
+
+    def __len__(self) -> int:
+        return len(self._matrix)
+
+    def info(self) -> dict:
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            searches = dict(self._searches)
+            rows = len(self._matrix)
+        graph = self._graph
+        return {
+            "directory": self.directory,
+            "faces": rows,
+            "dtype": self.dtype.name,
+            "dimension": self.dim,
+            "bytes": rows * self.row_bytes,
+            "ann": {
+                "method": self.ann,
+                "available": ANN_AVAILABLE,
+                "min_rows": ANN_MIN_ROWS,
+                "graph_faces": graph.get_current_count() if graph is not None else 0
+            },
+            "searches": searches,
+            "latency_ms": {
+                "window": len(latencies),
+                "p50": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+                "p95": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+                "p99": round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+                "max": round(float(latencies.max()), 3) if len(latencies) else None
+            }
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_face_index() -> FaceIndex:
+    """The process-wide face index, opened on first use."""
+    global _index
+    if not FACE_INDEX_AVAILABLE:
+        raise RuntimeError("The face index needs fcntl, which this platform lacks")
+    with _index_lock:
+        if _index is None:
+            _index = FaceIndex()
+            logger.info("Face index opened with %s faces (%s)", len(_index), _index.dtype.name)
+        return _index
+
+
+def get_face_index_info() -> dict:
+    if _index is None:
+        return {"directory": FACE_INDEX_DIR, "opened": False, "available": FACE_INDEX_AVAILABLE}
+    return _index.info()
+
+
+FACE_INDEX_SIZE = Gauge('ocr_face_index_faces', 'Faces enrolled in the face index (as mapped)',
+                        callback=lambda: [({}, len(_index) if _index is not None else 0)])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build', help='Build and save the HNSW graph over every face')
+    commands.add_parser('stats', help='Print the size and settings of the index')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if not ANN_AVAILABLE:
+            print("hnswlib is not installed (pip install hnswlib)", file=sys.stderr)
+            return 1
+        start = time.perf_counter()
+        index = FaceIndex(ann=FACE_INDEX_ANN or 'hnsw')
+        count = index.save_graph()
+        logger.info("Wrote an HNSW graph of %s faces to %s in %.1fs",
+                    count, index.hnsw_path, time.perf_counter() - start)
+        return 0
+
+    print(json.dumps(FaceIndex(ann='').info(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Bounded-memory upload ingestion.
+
+An upload is read from the request stream in chunks into one buffer and
+refused as soon as it passes the size limit. The image header is parsed
+(PIL reads it without decoding pixels) before any pixel memory is
+allocated, so unsupported formats and decompression bombs are refused
+early, and large JPEGs are decoded straight to a reduced scale with
+cv2.IMREAD_REDUCED_*. Other formats are decoded at full size (the pixel
+limit bounds that) and resized down.
+
+A request thus holds at most the body plus one image of at most
+OCR_DECODE_MAX_SIDE pixels on its long side when the pipeline starts.
+
+    OCR_MAX_PIXELS        largest accepted image, in pixels (50 MP)
+    OCR_DECODE_MAX_SIDE   long side images are decoded down to (4000)
+"""
+
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+MAX_PIXELS = int(os.environ.get('OCR_MAX_PIXELS', 50_000_000))
+DECODE_MAX_SIDE = int(os.environ.get('OCR_DECODE_MAX_SIDE', '4000'))
+CHUNK_SIZE = 256 * 1024
+# MPO is what some phone cameras call their JPEGs
+ACCEPTED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'BMP', 'TIFF'}
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+class UploadRejected(ValueError):
+    """An upload refused before processing; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def read_body(stream, limit: int, length: int = None) -> bytearray:
+    """Read a request body of at most `limit` bytes, in chunks."""
+    if length is not None and length > limit:
+        raise UploadRejected(f"Request body exceeds {limit / (1024 * 1024):g} MB", 413)
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        if len(buffer) > limit:
+            raise UploadRejected(f"Request body exceeds {limit / (1024 * 1024):g} MB", 413)
+    return buffer
+
+
+def inspect_image(source):
+    """
+    Format and size of an image (a path or the encoded bytes) from its
+    header alone. Raises UploadRejected for anything not to be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source) as header:
+            image_format, (width, height) = header.format, header.size
+    except Image.DecompressionBombError:
+        raise UploadRejected("Image has too many pixels", 413)
+    except (OSError, ValueError):
+        raise UploadRejected("Data is not a supported image")
+    if image_format not in ACCEPTED_FORMATS:
+        raise UploadRejected(f"Unsupported image format {image_format}", 415)
+    if width * height > MAX_PIXELS:
+        raise UploadRejected(f"Image is {width}x{height}, larger than "
+                             f"{MAX_PIXELS / 1e6:g} MP", 413)
+    return image_format, width, height
+
+
+def reduction_factor(long_side: int, min_side: int = None, max_side: int = None) -> int:
+    """
+    JPEG decode scale: the largest of 1/8, 1/4, 1/2 keeping the long side
+    at least `min_side`, or else the smallest bringing it to `max_side`.
+    """
+    if min_side:
+        return next((f for f in (8, 4, 2) if long_side / f >= min_side), 1)
+    if max_side:
+        return next((f for f in (1, 2, 4) if long_side / f <= max_side), 8)
+    return 1
+
+
+def decode_image(source, min_side: int = None, max_side: int = DECODE_MAX_SIDE):
+    """
+    Decode a path or encoded bytes to BGR, reduced per `reduction_factor`.
+    Returns (image, (frame_width, frame_height)), the frame being the
+    full-resolution image after EXIF rotation, or (None, None) when the
+    pixel data is corrupt. Raises UploadRejected from inspect_image.
+    """
+    image_format, raw_width, raw_height = inspect_image(source)
+    factor = 1
+    if image_format in ('JPEG', 'MPO'):
+        factor = reduction_factor(max(raw_width, raw_height), min_side, max_side)
+    flags = REDUCED_DECODE_FLAGS[factor]
+    if isinstance(source, (bytes, bytearray)):
+        image = cv2.imdecode(np.frombuffer(source, np.uint8), flags)
+    else:
+        image = cv2.imread(source, flags)
+    if image is None:
+        return None, None
+
+    height, width = image.shape[:2]
+    if max_side and not min_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    # OpenCV applies the EXIF orientation; follow it for the frame size
+    if raw_width != raw_height and (width > height) != (raw_width > raw_height):
+        raw_width, raw_height = raw_height, raw_width
+    return image, (raw_width, raw_height)
@@ -0,0 +1,133 @@
+"""
+Overload control: under pressure the ID pipeline trades polish for speed.
+
+The controller turns batch lane occupancy and latency into a pressure
+value:
+
+    pressure = max((running + waiting) / OCR_THREADS,
+                   latency EWMA / OCR_LATENCY_TARGET)
+
+and picks a degradation level from OCR_DEGRADE_THRESHOLDS (one pressure
+per level, "1.0,1.5,2.0,3.0"). Each level adds to the ones below it:
+
+    1  no debug images
+    2  orientation: stop at 0° when every required field is found there
+    3  NLM denoising replaced by a bilateral filter
+    4  YOLO runs at OCR_DEGRADED_INFER_SIZE (480)
+
+The level is raised as soon as pressure calls for it and lowered one step
+at a time once pressure falls clearly below the level's threshold. A
+request keeps the level it was admitted at, and responses report it as
+"degradation_level" so results produced under load can be re-verified.
+OCR_DEGRADE=0 turns the controller off.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+
+from metrics import DEGRADED_REQUESTS, Gauge
+from scheduler import lanes
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NO_DEBUG_IMAGES = 1
+LEVEL_UPRIGHT_SHORTCUT = 2
+LEVEL_NO_NLM = 3
+LEVEL_SMALL_INPUT = 4
+
+ENABLED = os.environ.get('OCR_DEGRADE', '1') != '0'
+THRESHOLDS = [float(value) for value in
+              os.environ.get('OCR_DEGRADE_THRESHOLDS', '1.0,1.5,2.0,3.0').split(',')]
+LATENCY_TARGET = float(os.environ.get('OCR_LATENCY_TARGET', '5.0'))
+DEGRADED_INFER_SIZE = -(-int(os.environ.get('OCR_DEGRADED_INFER_SIZE', '480')) // 32) * 32
+LATENCY_ALPHA = 0.2
+# Step down only below this fraction of the current level's threshold
+HYSTERESIS = 0.8
+
+# Level the current request was admitted at
+current_level = contextvars.ContextVar('degradation_level', default=0)
+
+
+class LoadController:
+    def __init__(self, thresholds: list = THRESHOLDS, latency_target: float = LATENCY_TARGET):
+        self.thresholds = thresholds
+        self.latency_target = latency_target
+        self.level = 0
+        self.latency_ewma = None
+        self._lock = threading.Lock()
+
+    def pressure(self, occupancy: float) -> float:
+        latency = (self.latency_ewma or 0.0) / self.latency_target
+        return max(occupancy, latency)
+
+    def update(self, occupancy: float) -> int:
+        """Re-evaluate the level for the current occupancy; returns it."""
+        if not ENABLED:
+            return 0
+        with self._lock:
+            pressure = self.pressure(occupancy)
+            target = sum(pressure >= threshold for threshold in self.thresholds)
+            previous = self.level
+            if target > self.level:
+                self.level = target
+            elif target < self.level and pressure < self.thresholds[self.level - 1] * HYSTERESIS:
+                self.level -= 1
+            level = self.level
+        if level > previous:
+            logger.warning("Load pressure %.2f: degradation level %s -> %s",
+                           pressure, previous, level)
+        elif level < previous:
+            logger.info("Load pressure %.2f: degradation level %s -> %s", pressure, previous, level)
+        return level
+
+    def observe_latency(self, seconds: float) -> None:
+        with self._lock:
+            if self.latency_ewma is None:
+                self.latency_ewma = seconds
+            else:
+                self.latency_ewma += LATENCY_ALPHA * (seconds - self.latency_ewma)
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": ENABLED,
+                "level": self.level,
+                "thresholds": self.thresholds,
+                "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+                "latency_target": self.latency_target
+            }
+
+
+controller = LoadController()
+
+DEGRADATION_LEVEL = Gauge('ocr_degradation_level', 'Current pipeline degradation level',
+                          callback=lambda: [({}, controller.level)])
+
+
+def begin_request():
+    """
+    Fix the degradation level of the current request from the lane load.
+    Returns the token to pass to `end_request` when the request is done.
+    """
+    level = controller.update(lanes.batch_occupancy())
+    DEGRADED_REQUESTS.inc(level=level)
+    return current_level.set(level)
+
+
+def end_request(token) -> None:
+    """Restore the level from before `begin_request`, so a reused thread starts clean."""
+    current_level.reset(token)
+
+
+def degraded(level: int) -> bool:
+    """Whether the current request runs at `level` or below it in quality."""
+    return current_level.get() >= level
+
+
+def inference_args(detector) -> dict:
+    """YOLO arguments for the current level (see model_backend.Detector.dynamic_input)."""
+    if degraded(LEVEL_SMALL_INPUT) and detector.dynamic_input:
+        return {'imgsz': DEGRADED_INFER_SIZE}
+    return {}
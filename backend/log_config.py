@@ -0,0 +1,125 @@
+"""
+Logging setup for the OCR server.
+
+Records are handed to a QueueHandler and written by a background
+QueueListener thread, so request threads never block on stdout. Levels
+are set per module and disabled levels are skipped before any message
+formatting happens; call sites use %-style arguments for this reason:
+
+    logger.debug("Field %s: %r", name, pii(text))
+
+Environment:
+
+    LOG_LEVEL   root level (INFO)
+    LOG_LEVELS  per-module levels, e.g. "egyptian_ocr_id=DEBUG,passport_ocr=WARNING"
+    LOG_FORMAT  text | json (text)
+    LOG_PII     1 to log names, ID numbers and other extracted values verbatim (0)
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_PII = os.environ.get('LOG_PII', '0') == '1'
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+_queue_handler = None
+
+
+def _parse_levels(spec: str) -> dict:
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _PII:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if LOG_PII:
+            return str(self.value)
+        if not self.value:
+            return ''
+        # Stable per value, so the same person can be followed across log lines
+        digest = hashlib.sha256(str(self.value).encode('utf-8')).hexdigest()[:8]
+        return f'<pii:{digest}>'
+
+    __repr__ = __str__
+
+
+def pii(value):
+    """Wrap an extracted value for logging; redacted unless LOG_PII=1."""
+    return _PII(value)
+
+
+def _start_listener(handler: logging.Handler) -> None:
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logging() -> None:
+    """Install the queue handler on the root logger (once per process)."""
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_levels(os.environ.get('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _start_listener(output)
+    atexit.register(_stop_listener)
+    # The listener thread does not survive fork; preloaded gunicorn workers need their own
+    os.register_at_fork(after_in_child=lambda: _start_listener(output))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Copy-on-write model sharing for forked workers, and per-process memory.
+
+serve.py loads every model in the gunicorn master and then calls
+`prepare_for_fork`:
+
+- a full collection runs and the surviving objects are moved to the
+  permanent generation with gc.freeze(), so the workers' cyclic GC does
+  not write to the headers of the parent's objects and copy their pages;
+- with OCR_SHARE_TENSORS=1 model tensors are also moved into shared
+  memory. Inference never writes weights, so their pages stay shared
+  without this; it guards against anything that would (at the cost of a
+  file descriptor per tensor storage).
+
+What a worker really costs is its private memory (USS). It is reported
+by `process_memory` (in /info) and, for a running server, by:
+
+    python memory_sharing.py report <master pid>
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+SHARE_TENSORS = os.environ.get('OCR_SHARE_TENSORS', '0') == '1'
+
+_SMAPS_FIELDS = {
+    'Rss': 'rss_mb',
+    'Pss': 'pss_mb',
+    'Shared_Clean': 'shared_clean_mb',
+    'Shared_Dirty': 'shared_dirty_mb',
+    'Private_Clean': 'private_clean_mb',
+    'Private_Dirty': 'private_dirty_mb'
+}
+
+
+def _torch_modules(obj) -> list:
+    """The torch modules inside a loaded model object."""
+    import torch
+
+    if isinstance(obj, torch.nn.Module):
+        return [obj]
+    modules = []
+    # easyocr.Reader
+    for attribute in ('detector', 'recognizer'):
+        module = getattr(obj, attribute, None)
+        if isinstance(module, torch.nn.Module):
+            modules.append(module)
+    # ultralytics YOLO (a model_backend.Detector instance) -> nn.Module (PyTorch backend only)
+    inner = getattr(getattr(obj, 'model', None), 'model', None)
+    if isinstance(inner, torch.nn.Module):
+        modules.append(inner)
+    return modules
+
+
+def share_model_memory(models: dict) -> dict:
+    """Move the tensors of each model into shared memory; returns MB shared per model."""
+    shared = {}
+    for name, obj in models.items():
+        size = 0
+        for module in _torch_modules(obj):
+            try:
+                module.share_memory()
+            except (RuntimeError, TypeError) as e:
+                # Packed quantized weights and TorchScript modules cannot be moved
+                logger.warning("Could not share %s tensors: %s", name, e)
+                continue
+            size += sum(t.numel() * t.element_size()
+                        for t in list(module.parameters()) + list(module.buffers()))
+        shared[name] = round(size / (1024 * 1024), 1)
+    return shared
+
+
+def prepare_for_fork(models: dict) -> None:
+    """Freeze the heap (and optionally share tensors); call in the parent right before forking."""
+    if SHARE_TENSORS:
+        logger.info("Model tensors moved to shared memory (MB): %s", share_model_memory(models))
+    gc.collect()
+    gc.freeze()
+    logger.info("%s objects frozen before fork", gc.get_freeze_count())
+
+
+def process_memory(pid: int = None) -> dict:
+    """RSS, PSS and private (USS) memory of a process in MB (Linux smaps_rollup)."""
+    pid = pid or os.getpid()
+    memory = {"pid": pid}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in _SMAPS_FIELDS:
+                    memory[_SMAPS_FIELDS[key]] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        import resource
+
+        # No smaps_rollup (not Linux, or an old kernel): only peak RSS is known
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+        return memory
+
+    memory["uss_mb"] = round(memory.get('private_clean_mb', 0) + memory.get('private_dirty_mb', 0), 1)
+    if pid == os.getpid():
+        memory["gc_frozen_objects"] = gc.get_freeze_count()
+    return memory
+
+
+def child_pids(pid: int) -> list:
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; ppid follows the closing paren
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def worker_report(master_pid: int) -> dict:
+    """Memory of a gunicorn master and its workers, and the cost of one more worker."""
+    workers = [process_memory(pid) for pid in child_pids(master_pid)]
+    workers = [w for w in workers if 'uss_mb' in w]
+    report = {"master": process_memory(master_pid), "workers": workers}
+    if workers:
+        report["total_pss_mb"] = round(
+            report["master"].get('pss_mb', 0) + sum(w['pss_mb'] for w in workers), 1)
+        # Incremental cost of a worker: its private pages, the shared ones are already paid for
+        report["mean_worker_uss_mb"] = round(sum(w['uss_mb'] for w in workers) / len(workers), 1)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_parser = commands.add_parser('report', help='Per-worker memory of a running server')
+    report_parser.add_argument('pid', type=int, help='gunicorn master PID')
+    args = parser.parse_args(argv)
+
+    print(json.dumps(worker_report(args.pid), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Process-local metrics rendered in the Prometheus text exposition format.
+
+Pipeline stages are timed with `stage_timer`:
+
+    with stage_timer('id', 'field_ocr', field='firstName'):
+        ...
+
+which feeds the ocr_stage_duration_seconds histogram served at /metrics.
+Functions registered with `add_stage_observer` also receive every raw
+stage duration (the benchmark uses this for exact percentiles).
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.metric_type}"] + self._samples()
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.label_names, key)} {value}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or computed at scrape time by `callback`."""
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._callback is not None:
+            values = {self._key(labels): value for labels, value in self._callback()}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            series_items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in series_items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'ocr_stage_duration_seconds', 'Time spent in each pipeline stage',
+    ('pipeline', 'stage', 'field'))
+REQUEST_SECONDS = Histogram(
+    'ocr_request_duration_seconds', 'HTTP request latency by endpoint',
+    ('endpoint', 'status'))
+IN_FLIGHT = Gauge(
+    'ocr_requests_in_flight', 'Requests currently being processed', ('endpoint',))
+MODEL_QUEUE_DEPTH = Gauge(
+    'ocr_model_queue_depth', 'Calls waiting for a model to become free', ('model',))
+READER_WAIT_SECONDS = Histogram(
+    'ocr_reader_wait_seconds', 'Time spent waiting to check out an OCR reader', ('model',))
+READERS_IN_USE = Gauge(
+    'ocr_readers_in_use', 'OCR readers currently checked out', ('model',))
+REQUESTS_CANCELLED = Counter(
+    'ocr_requests_cancelled_total', 'Requests abandoned after their deadline, by the stage that stopped',
+    ('endpoint', 'stage'))
+LANE_IN_FLIGHT = Gauge(
+    'ocr_lane_requests_in_flight', 'Requests admitted to each priority lane', ('lane',))
+LANE_QUEUE_SECONDS = Histogram(
+    'ocr_lane_queue_seconds', 'Time requests waited for a slot in their lane', ('lane',))
+LANE_REQUEST_SECONDS = Histogram(
+    'ocr_lane_request_duration_seconds', 'Request latency by priority lane', ('lane',),
+    buckets=(0.05, 0.1, 0.2, 0.35, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+LANE_REJECTED = Counter(
+    'ocr_lane_rejected_total', 'Requests turned away because their lane was full', ('lane',))
+BATCH_YIELD_SECONDS = Counter(
+    'ocr_batch_yield_seconds_total', 'Time batch requests spent paused for interactive ones')
+DEGRADED_REQUESTS = Counter(
+    'ocr_requests_by_degradation_total', 'Requests by the degradation level they ran at', ('level',))
+FACE_INDEX_SEARCH_SECONDS = Histogram(
+    'ocr_face_index_search_seconds', 'Face index search latency by method', ('method',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+CACHE_REQUESTS = Counter(
+    'ocr_cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+
+_stage_observers = []
+
+
+def add_stage_observer(observer) -> None:
+    """Call `observer(pipeline, stage, field, seconds)` for every stage timing."""
+    _stage_observers.append(observer)
+
+
+def observe_stage(pipeline: str, stage: str, seconds: float, field: str = '') -> None:
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage, field=field)
+    for observer in _stage_observers:
+        observer(pipeline, stage, field, seconds)
+
+
+@contextmanager
+def stage_timer(pipeline: str, stage: str, field: str = ''):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(pipeline, stage, time.perf_counter() - start, field)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
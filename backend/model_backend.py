@@ -0,0 +1,368 @@
+"""
+Inference backends for the YOLO detectors.
+
+The PyTorch weights in models/ can be exported to ONNX (run with ONNX
+Runtime) or OpenVINO. Exports are loaded through ultralytics, so call
+sites keep the same `model(image, conf=...)` interface and Results
+objects whichever backend runs underneath. When no export exists for the
+configured backend, or its runtime is not installed, the PyTorch weights
+are used.
+
+    python model_backend.py export --format onnx
+    python model_backend.py parity --images path/to/images --backend onnx
+
+parity exits non-zero unless every model has an export, at least one
+image was compared and all detections matched.
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from ultralytics import YOLO
+
+from metrics import MODEL_QUEUE_DEPTH, record_cache_lookup
+from scheduler import PrioritySemaphore
+from quantization import get_precision
+from thread_budget import request_threads
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+YOLO_MODELS = ['detect_id_card', 'detect_odjects', 'detect_id']
+
+# pytorch | onnx | openvino | auto (first available export, else pytorch)
+BACKENDS = ['pytorch', 'onnx', 'openvino', 'auto']
+YOLO_BACKEND = os.environ.get('YOLO_BACKEND', 'auto')
+# Instances of each detector that may run at once (default OCR_THREADS)
+DETECTOR_POOL_SIZE = max(1, int(os.environ.get('OCR_DETECTOR_POOL_SIZE', request_threads())))
+
+_RUNTIME_MODULES = {
+    'onnx': 'onnxruntime',
+    'openvino': 'openvino'
+}
+
+
+def model_paths(name: str) -> dict:
+    """Where each backend's artifact for a model lives (ultralytics export layout)."""
+    return {
+        'pytorch': os.path.join(MODELS_DIR, f'{name}.pt'),
+        'onnx': os.path.join(MODELS_DIR, f'{name}.onnx'),
+        'openvino': os.path.join(MODELS_DIR, f'{name}_openvino_model')
+    }
+
+
+def quantized_model_path(name: str, precision: str) -> str:
+    """Quantized ONNX export written by calibrate_models.py."""
+    return os.path.join(MODELS_DIR, f'{name}.{precision}.onnx')
+
+
+def runtime_available(backend: str) -> bool:
+    module = _RUNTIME_MODULES.get(backend)
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def resolve_model_path(name: str, backend: str = None, precision: str = None):
+    """
+    Return (path, backend) for the model, falling back to PyTorch. An int8
+    precision (see quantization.py) selects its quantized ONNX export,
+    which always runs on ONNX Runtime.
+    """
+    backend = backend or YOLO_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown YOLO backend: {backend}")
+
+    precision = precision or get_precision(name)
+    if precision != 'fp32':
+        path = quantized_model_path(name, precision)
+        if os.path.exists(path) and runtime_available('onnx'):
+            return path, 'onnx'
+        logger.warning("No usable %s export for %s, using fp32", precision, name)
+
+    if backend == 'auto':
+        candidates = ['openvino', 'onnx']
+    elif backend == 'pytorch':
+        candidates = []
+    else:
+        candidates = [backend]
+
+    paths = model_paths(name)
+    for candidate in candidates:
+        if not os.path.exists(paths[candidate]):
+            if backend != 'auto':
+                logger.warning("No %s export for %s, falling back to PyTorch", candidate, name)
+            continue
+        if not runtime_available(candidate):
+            logger.warning("%s is not installed, cannot run %s with %s",
+                           _RUNTIME_MODULES[candidate], name, candidate)
+            continue
+        return paths[candidate], candidate
+
+    return paths['pytorch'], 'pytorch'
+
+
+class Detector:
+    """
+    A YOLO model shared between requests. Ultralytics predictors keep
+    per-call state, so every call runs on an instance of its own, taken
+    from a pool of up to OCR_DETECTOR_POOL_SIZE like the EasyOCR reader
+    pools. Instances are loaded on demand, or all at once by `preload()`
+    in the gunicorn master so forked workers share their weights. When
+    every instance is busy, interactive callers are served first (see
+    scheduler.py).
+    """
+
+    def __init__(self, name: str, path: str, backend: str, size: int = DETECTOR_POOL_SIZE):
+        self.name = name
+        self.path = path
+        self.backend = backend
+        self.size = size
+        self.precision = get_precision(name) if '-int8.' in path else 'fp32'
+        # The first instance, also used for class names and memory sharing
+        self.model = YOLO(path, task='detect')
+        self.instances = [self.model]
+        self._idle = [self.model]
+        self._pending = 0
+        self._instances_lock = threading.Lock()
+        self._slots = PrioritySemaphore(size)
+
+    @property
+    def names(self) -> dict:
+        return self.model.names
+
+    @property
+    def dynamic_input(self) -> bool:
+        """Whether inference may use an input size other than the export's."""
+        # PyTorch always can; ONNX exports are dynamic (see export_model); OpenVINO ones are not
+        return self.backend != 'openvino'
+
+    def _create(self):
+        start = time.perf_counter()
+        instance = YOLO(self.path, task='detect')
+        logger.info("Created %s instance %d/%d in %.2fs",
+                    self.name, len(self.instances) + 1, self.size, time.perf_counter() - start)
+        return instance
+
+    def preload(self, count: int = None) -> list:
+        """Load instances until the pool holds `count` (default: its size); returns them all."""
+        count = min(count or self.size, self.size)
+        while True:
+            with self._instances_lock:
+                if len(self.instances) + self._pending >= count:
+                    return list(self.instances)
+                self._pending += 1
+            try:
+                instance = self._create()
+            finally:
+                with self._instances_lock:
+                    self._pending -= 1
+            with self._instances_lock:
+                self.instances.append(instance)
+                self._idle.append(instance)
+
+    def __call__(self, source, **kwargs):
+        MODEL_QUEUE_DEPTH.inc(model=self.name)
+        self._slots.acquire()
+        MODEL_QUEUE_DEPTH.dec(model=self.name)
+        try:
+            with self._instances_lock:
+                instance = self._idle.pop() if self._idle else None
+            if instance is None:
+                # A free slot without an idle instance: the pool is still growing
+                instance = self._create()
+                with self._instances_lock:
+                    self.instances.append(instance)
+            try:
+                return instance(source, **kwargs)
+            finally:
+                with self._instances_lock:
+                    self._idle.append(instance)
+        finally:
+            self._slots.release()
+
+    def info(self) -> dict:
+        with self._instances_lock:
+            return {"backend": self.backend,
+                    "precision": self.precision,
+                    "path": os.path.basename(self.path),
+                    "pool_size": self.size,
+                    "instances": len(self.instances),
+                    "idle": len(self._idle)}
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def get_detector(name: str, backend: str = None) -> Detector:
+    """Load (once) and return the detector for a model name, e.g. 'detect_id'."""
+    backend = backend or YOLO_BACKEND
+    key = (name, backend)
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        record_cache_lookup('detector', detector is not None)
+        if detector is None:
+            path, resolved = resolve_model_path(name, backend)
+            start = time.perf_counter()
+            detector = Detector(name, path, resolved)
+            logger.info("Loaded %s (%s) from %s in %.2fs",
+                        name, resolved, path, time.perf_counter() - start)
+            _detectors[key] = detector
+        return detector
+
+
+def get_backend_info() -> dict:
+    """Backend and artifact of every detector loaded so far."""
+    with _detectors_lock:
+        detectors = dict(_detectors)
+    return {name: detector.info() for (name, _), detector in detectors.items()}
+
+
+def export_model(name: str, fmt: str, imgsz: int = 640) -> str:
+    """Export a model's PyTorch weights next to them in models/."""
+    model = YOLO(model_paths(name)['pytorch'])
+    # Dynamic input shapes keep ONNX usable at non-default inference sizes
+    return model.export(format=fmt, imgsz=imgsz, dynamic=(fmt == 'onnx'))
+
+
+def _box_iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _detections(results) -> list:
+    detections = []
+    for result in results:
+        if result.boxes is None:
+            continue
+        for box in result.boxes:
+            detections.append((int(box.cls[0].item()),
+                               float(box.conf[0].item()),
+                               [float(v) for v in box.xyxy[0].tolist()]))
+    return detections
+
+
+def compare_detections(reference: list, candidate: list, iou_threshold: float = 0.9) -> dict:
+    """Greedily match candidate boxes to reference boxes of the same class."""
+    unmatched = list(candidate)
+    ious = []
+    conf_deltas = []
+    for cls, conf, box in sorted(reference, key=lambda d: -d[1]):
+        best_index, best_iou = None, 0.0
+        for index, (other_cls, _, other_box) in enumerate(unmatched):
+            if other_cls != cls:
+                continue
+            iou = _box_iou(box, other_box)
+            if iou > best_iou:
+                best_index, best_iou = index, iou
+        if best_index is not None and best_iou >= iou_threshold:
+            conf_deltas.append(abs(conf - unmatched[best_index][1]))
+            ious.append(best_iou)
+            unmatched.pop(best_index)
+
+    matched = len(ious)
+    return {
+        "reference_boxes": len(reference),
+        "candidate_boxes": len(candidate),
+        "matched": matched,
+        "mean_iou": round(sum(ious) / matched, 4) if matched else None,
+        "max_conf_delta": round(max(conf_deltas), 4) if conf_deltas else None,
+        "passed": matched == len(reference) == len(candidate)
+    }
+
+
+def check_parity(image_dir: str, backend: str, conf: float = 0.3,
+                 iou_threshold: float = 0.9) -> dict:
+    """
+    Compare each model's exported backend against its PyTorch weights. A
+    model passes only if at least one image was compared and every
+    comparison matched; a model without an export fails.
+    """
+    import cv2
+
+    images = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir)
+        if f.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    report = {}
+    for name in YOLO_MODELS:
+        path, resolved = resolve_model_path(name, backend)
+        if resolved == 'pytorch':
+            report[name] = {"passed": False, "skipped": f"no {backend} export available"}
+            continue
+
+        reference_model = YOLO(model_paths(name)['pytorch'], task='detect')
+        candidate_model = YOLO(path, task='detect')
+        timings = {'pytorch': 0.0, resolved: 0.0}
+        per_image = []
+        unreadable = []
+        for image_path in images:
+            image = cv2.imread(image_path)
+            if image is None:
+                unreadable.append(os.path.basename(image_path))
+                continue
+            start = time.perf_counter()
+            reference = _detections(reference_model(image, conf=conf, verbose=False))
+            timings['pytorch'] += time.perf_counter() - start
+            start = time.perf_counter()
+            candidate = _detections(candidate_model(image, conf=conf, verbose=False))
+            timings[resolved] += time.perf_counter() - start
+
+            comparison = compare_detections(reference, candidate, iou_threshold)
+            comparison["image"] = os.path.basename(image_path)
+            per_image.append(comparison)
+
+        count = max(len(per_image), 1)
+        report[name] = {
+            "backend": resolved,
+            "images": len(per_image),
+            "unreadable": unreadable,
+            "passed": bool(per_image) and all(c["passed"] for c in per_image),
+            "avg_ms": {k: round(v * 1000 / count, 2) for k, v in timings.items()},
+            "mismatches": [c for c in per_image if not c["passed"]]
+        }
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Export the YOLO weights')
+    export_parser.add_argument('--format', choices=['onnx', 'openvino'], default='onnx')
+    export_parser.add_argument('--imgsz', type=int, default=640)
+    export_parser.add_argument('--models', nargs='+', default=YOLO_MODELS)
+
+    parity_parser = commands.add_parser(
+        'parity', help='Compare exported models against PyTorch on a folder of images')
+    parity_parser.add_argument('--images', required=True)
+    parity_parser.add_argument('--backend', choices=['onnx', 'openvino'], default='onnx')
+    parity_parser.add_argument('--conf', type=float, default=0.3)
+    parity_parser.add_argument('--iou', type=float, default=0.9)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'parity' and not os.path.isdir(args.images):
+        parser.error(f"--images {args.images} is not a folder")
+
+    if args.command == 'export':
+        for name in args.models:
+            logger.info("Exported %s to %s", name, export_model(name, args.format, args.imgsz))
+        return 0
+
+    report = check_parity(args.images, args.backend, args.conf, args.iou)
+    print(json.dumps(report, indent=2))
+    return 0 if all(r["passed"] for r in report.values()) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Decoding of the 14-digit Egyptian National ID from detect_id.pt digits.
+
+    C YY MM DD GG SSSS K
+    |  |  |  |  |   |  '- check digit
+    |  |  |  |  |   '--- sequence (its last digit is odd for men)
+    |  |  |  |  '------- governorate of birth
+    |  '--'--'---------- birth date
+    '------------------- century: 2 = 1900s, 3 = 2000s
+
+The detector emits one box per digit class it sees, so a blurred digit can
+produce two overlapping boxes ("3" and "8") and noise a stray one. Boxes
+are grouped into positions by horizontal overlap (per-digit NMS), each
+position keeping its top-k classes. A beam search then returns the most
+probable 14-digit string with a valid century, a real birth date and a
+known governorate. A matching check digit is preferred but not required:
+its weighting is not officially published.
+"""
+
+import datetime
+import math
+import os
+
+NID_LENGTH = 14
+DIGIT_TOP_K = 3
+# Detector confidence floor for digit candidates; alternatives live below the usual 0.4
+NID_DIGIT_CONF = float(os.environ.get('NID_DIGIT_CONF', '0.1'))
+NID_BEAM_WIDTH = 64
+# Log-probability bonus for a candidate whose check digit matches
+CHECK_DIGIT_BONUS = math.log(4.0)
+CHECK_WEIGHTS = (2, 7, 6, 5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+GOVERNORATES = {
+    '01': 'Cairo',
+    '02': 'Alexandria',
+    '03': 'Port Said',
+    '04': 'Suez',
+    '11': 'Damietta',
+    '12': 'Dakahlia',
+    '13': 'Ash Sharqia',
+    '14': 'Kaliobeya',
+    '15': 'Kafr El - Sheikh',
+    '16': 'Gharbia',
+    '17': 'Monoufia',
+    '18': 'El Beheira',
+    '19': 'Ismailia',
+    '21': 'Giza',
+    '22': 'Beni Suef',
+    '23': 'Fayoum',
+    '24': 'El Menia',
+    '25': 'Assiut',
+    '26': 'Sohag',
+    '27': 'Qena',
+    '28': 'Aswan',
+    '29': 'Luxor',
+    '31': 'Red Sea',
+    '32': 'New Valley',
+    '33': 'Matrouh',
+    '34': 'North Sinai',
+    '35': 'South Sinai',
+    '88': 'Foreign'
+}
+
+CENTURIES = {'2': 1900, '3': 2000}
+
+UNKNOWN = {
+    'Birth Date': 'Unknown',
+    'Governorate': 'Unknown',
+    'Gender': 'Unknown'
+}
+
+
+def compute_check_digit(first_13: str) -> int:
+    total = sum(int(d) * w for d, w in zip(first_13, CHECK_WEIGHTS))
+    return (11 - total % 11) % 10
+
+
+def birth_date(id_number: str):
+    """The encoded birth date, or None if it is not a real past date."""
+    century = CENTURIES.get(id_number[0])
+    if century is None:
+        return None
+    try:
+        date = datetime.date(century + int(id_number[1:3]),
+                             int(id_number[3:5]), int(id_number[5:7]))
+    except ValueError:
+        return None
+    return date if date <= datetime.date.today() else None
+
+
+def validation_errors(id_number: str) -> list:
+    """Structural problems with an ID number; empty when it is well formed."""
+    if len(id_number) != NID_LENGTH or not id_number.isdigit():
+        return [f"expected {NID_LENGTH} digits"]
+    errors = []
+    if id_number[0] not in CENTURIES:
+        errors.append("invalid century digit")
+    elif birth_date(id_number) is None:
+        errors.append("invalid birth date")
+    if id_number[7:9] not in GOVERNORATES:
+        errors.append("unknown governorate code")
+    return errors
+
+
+def checksum_matches(id_number: str) -> bool:
+    return compute_check_digit(id_number[:13]) == int(id_number[13])
+
+
+def _prefix_valid(prefix: str) -> bool:
+    # Checked as soon as each component is complete, so the beam drops dead ends early
+    length = len(prefix)
+    if length == 1:
+        return prefix in CENTURIES
+    if length == 5:
+        return 1 <= int(prefix[3:5]) <= 12
+    if length == 7:
+        return birth_date(prefix) is not None
+    if length == 9:
+        return prefix[7:9] in GOVERNORATES
+    return True
+
+
+def _box_overlap(a, b) -> float:
+    """Horizontal overlap of two boxes relative to the narrower one."""
+    inter = min(a[2], b[2]) - max(a[0], b[0])
+    narrower = min(a[2] - a[0], b[2] - b[0])
+    return inter / narrower if narrower > 0 else 0.0
+
+
+def group_digits(results, min_overlap: float = 0.5, top_k: int = DIGIT_TOP_K) -> list:
+    """
+    Cluster digit boxes into positions, left to right. Each position has
+    its box (of the most confident class) and up to `top_k` alternatives
+    as (digit, probability), most likely first.
+    """
+    boxes = []
+    for result in results:
+        if result.boxes is None:
+            continue
+        for box in result.boxes:
+            boxes.append((float(box.conf[0]), int(box.cls[0]),
+                          [int(v) for v in box.xyxy[0].tolist()]))
+
+    positions = []
+    for confidence, digit, xyxy in sorted(boxes, key=lambda b: -b[0]):
+        for position in positions:
+            if _box_overlap(position['bbox'], xyxy) >= min_overlap:
+                scores = position['scores']
+                scores[digit] = max(scores.get(digit, 0.0), confidence)
+                break
+        else:
+            positions.append({'bbox': xyxy, 'scores': {digit: confidence}})
+
+    for position in positions:
+        scores = position.pop('scores')
+        total = max(1.0, sum(scores.values()))
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+        position['alternatives'] = [(digit, score / total) for digit, score in ranked]
+        position['digit'], position['confidence'] = ranked[0]
+    positions.sort(key=lambda p: p['bbox'][0])
+    return positions
+
+
+def _select_positions(positions: list) -> list:
+    """Drop the least confident positions when more than 14 were found."""
+    if len(positions) <= NID_LENGTH:
+        return positions
+    keep = sorted(range(len(positions)),
+                  key=lambda i: -positions[i]['confidence'])[:NID_LENGTH]
+    return [positions[i] for i in sorted(keep)]
+
+
+def decode_digits(positions: list, beam_width: int = NID_BEAM_WIDTH) -> dict:
+    """
+    The most probable valid ID from grouped digit positions. Falls back to
+    the most confident digit at every position when nothing valid exists.
+    """
+    positions = _select_positions(positions)
+    best_guess = ''.join(str(p['digit']) for p in positions)
+    result = {
+        'national_id': best_guess,
+        'valid': False,
+        'checksum_ok': False,
+        'confidence': 0.0,
+        'errors': validation_errors(best_guess),
+        'positions': len(positions)
+    }
+    if len(positions) != NID_LENGTH:
+        return result
+
+    beam = [('', 0.0)]
+    for position in positions:
+        extended = []
+        for prefix, log_prob in beam:
+            for digit, probability in position['alternatives']:
+                candidate = prefix + str(digit)
+                if _prefix_valid(candidate):
+                    extended.append((candidate, log_prob + math.log(max(probability, 1e-6))))
+        if not extended:
+            return result
+        extended.sort(key=lambda c: -c[1])
+        beam = extended[:beam_width]
+
+    scored = [(candidate, log_prob + (CHECK_DIGIT_BONUS if checksum_matches(candidate) else 0.0),
+               log_prob) for candidate, log_prob in beam]
+    candidate, _, log_prob = max(scored, key=lambda c: c[1])
+    result.update({
+        'national_id': candidate,
+        'valid': True,
+        'checksum_ok': checksum_matches(candidate),
+        'confidence': round(math.exp(log_prob), 4),
+        'errors': [],
+        'corrected': candidate != best_guess
+    })
+    return result
+
+
+def decode_egyptian_id(id_number):
+    """Birth date, governorate and gender encoded in an ID number ('Unknown' when unreadable)."""
+    if not id_number or len(id_number) < NID_LENGTH or not id_number[:NID_LENGTH].isdigit():
+        return dict(UNKNOWN)
+
+    decoded = dict(UNKNOWN)
+    date = birth_date(id_number)
+    if date is not None:
+        decoded['Birth Date'] = date.strftime('%Y-%m-%d')
+    decoded['Governorate'] = GOVERNORATES.get(id_number[7:9], 'Unknown')
+    decoded['Gender'] = "Male" if int(id_number[12]) % 2 != 0 else "Female"
+    return decoded
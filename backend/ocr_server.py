@@ -1,39 +1,70 @@
 #!/usr/bin/env python3
 
-from flask import Flask, request, jsonify
+from log_config import pii, setup_logging
+setup_logging()
+
+# Thread limits must be in place before torch, numpy and cv2 are imported
+from thread_budget import configure as configure_threads, get_thread_info
+configure_threads()
+
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-from egyptian_ocr_id import detect_and_process_id_card, detect_id_card_quick
-from passport_ocr import process_passport, get_passport_debug_info
+from werkzeug.exceptions import RequestEntityTooLarge
+from egyptian_ocr_id import detect_id_card_quick, process_id_card_image, DENOISE_STRATEGY, get_denoise_timings
+from passport_ocr import process_passport, get_passport_debug_info, get_passport_ocr
+from model_backend import YOLO_BACKEND, YOLO_MODELS, get_backend_info, get_detector
+from quantization import get_model_precisions
+from metrics import Gauge, IN_FLIGHT, REQUEST_SECONDS, render_metrics, stage_timer
+from memory_sharing import process_memory
+from stage_graph import StageGraph
+from reference_data import get_reference_info
+from face_index import (DUPLICATE_THRESHOLD, FACE_INDEX_AVAILABLE, get_face_index,
+                        get_face_index_info)
+from reader_pool import READER_LANGUAGES, get_reader_pool, get_reader_pool_info
+from request_context import (DEADLINE_HEADER, DeadlineExceeded, checkpoint, current_deadline,
+                             record_cancellation, request_timeout, start_deadline)
+from scheduler import BATCH, ENDPOINT_LANES, LaneFull, lanes
+import load_control
+from ingest import UploadRejected, decode_image, inspect_image, read_body
+from profiling import (ProfileSession, current_profile, is_valid_profile_id, is_valid_request_id,
+                       load_profile, should_profile)
+import functools
 import logging
 import time
-import tempfile
 import os
 import base64
 import io
+import uuid
 from PIL import Image
 import cv2
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 # Face recognition imports
 try:
     from facenet_pytorch import MTCNN, InceptionResnetV1
     import torch
     from torch.nn.functional import cosine_similarity
+    from quantization import apply_face_precision
     FACE_RECOGNITION_AVAILABLE = True
 
     # Initialize face recognition models
-    print("🔍 Initializing face recognition models...")
+    logger.info("Initializing face recognition models")
     mtcnn = MTCNN(image_size=160, margin=0)
-    face_model = InceptionResnetV1(pretrained='vggface2').eval()
-    print("✅ Face recognition models loaded successfully!")
+    face_model = apply_face_precision(
+        InceptionResnetV1(pretrained='vggface2').eval())
+    logger.info("Face recognition models loaded")
 
     def get_face_embedding(img):
         """Extract face embedding from image"""
-        face = mtcnn(img)
-        if face is None:
-            return None
-        with torch.no_grad():
-            return face_model(face.unsqueeze(0))
+        with stage_timer('face', 'face_embedding'):
+            checkpoint('face_embedding')
+            face = mtcnn(img)
+            if face is None:
+                return None
+            with torch.no_grad():
+                return face_model(face.unsqueeze(0))
 
     def compare_faces(id_image, live_image):
         """Compare two face images and return similarity score"""
@@ -57,22 +88,22 @@ try:
         }, None
 
 except ImportError as e:
-    print(f"⚠️ Face recognition not available: {e}")
-    print("💡 To enable face recognition, run: pip install torch torchvision facenet-pytorch")
+    logger.warning("Face recognition not available (pip install torch torchvision facenet-pytorch): %s", e)
     FACE_RECOGNITION_AVAILABLE = False
 except Exception as e:
-    print(f"⚠️ Face recognition initialization failed: {e}")
+    logger.error("Face recognition initialization failed: %s", e)
     FACE_RECOGNITION_AVAILABLE = False
 
 
-def extract_face_from_id(image_path):
-    """Extract face from ID card image using YOLO face detection"""
-    try:
-        # Load the image
-        image = cv2.imread(image_path)
-        if image is None:
-            return None, "Could not load image"
+def extract_face_from_id(image):
+    """Extract the face from a decoded (BGR) ID card image"""
+    with stage_timer('id', 'face_extraction'):
+        return _extract_face_from_id(image)
 
+
+def _extract_face_from_id(image):
+    checkpoint('face_extraction')
+    try:
         # Load YOLO face detection model (you might need to train this or use a pre-trained one)
         # For now, we'll use MTCNN to detect face
         if FACE_RECOGNITION_AVAILABLE:
@@ -104,19 +135,201 @@ def extract_face_from_id(image_path):
         return None, f"Error extracting face: {str(e)}"
 
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 app = Flask(__name__)
+# Uploads larger than this are rejected with 413 before they are read
+MAX_UPLOAD_MB = float(os.environ.get('OCR_MAX_UPLOAD_MB', '20'))
+# Image bodies read by ingest.read_body instead of request.data
+UPLOAD_ENDPOINTS = {'/egyptian-id', '/ocr', '/passport', '/detect-id-card'}
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)
 CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "X-Request-ID", "X-Profile", DEADLINE_HEADER],
+        "expose_headers": ["X-Request-ID", "X-Profile-Id"]
     }
 })
 
 
+def _model_load_state():
+    loaded = get_backend_info()
+    for name in YOLO_MODELS:
+        yield {"model": name}, int(name in loaded)
+    yield {"model": "easyocr_ar"}, 1
+    yield {"model": "face"}, int(FACE_RECOGNITION_AVAILABLE)
+
+
+def preload_models() -> dict:
+    """Load the lazily created models now and return every loaded model by key."""
+    models = {}
+    for name in YOLO_MODELS:
+        # Every instance of the pool, so forked workers share their weights
+        for index, instance in enumerate(get_detector(name).preload()):
+            models[name if index == 0 else f'{name}.{index}'] = instance
+    get_passport_ocr()
+    for key in READER_LANGUAGES:
+        # The whole pool, so forked workers share every reader's weights
+        for index, reader in enumerate(get_reader_pool(key).preload()):
+            models[key if index == 0 else f'{key}.{index}'] = reader
+    if FACE_RECOGNITION_AVAILABLE:
+        models['face'] = face_model
+        models['mtcnn'] = mtcnn
+    return models
+
+
+MODEL_LOADED = Gauge('ocr_model_loaded', 'Whether a model is loaded in this process',
+                     ('model',), callback=_model_load_state)
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if is_valid_request_id(
+        request_id) else uuid.uuid4().hex
+    if should_profile(request.headers):
+        g.profile = ProfileSession(g.request_id).start()
+        current_profile.set(g.profile)
+
+
+@app.before_request
+def start_request_deadline():
+    start_deadline(request_timeout(request.headers))
+
+
+def _upload():
+    """The image body of an upload endpoint, read by read_request_body."""
+    return g.get('upload') or b''
+
+
+def abandon_on_deadline(view):
+    """Answer 504 when the pipeline gives up on a request that ran out of time."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except DeadlineExceeded as e:
+            record_cancellation(e, g.get('metrics_endpoint', request.path))
+            logger.warning("Request %s abandoned: %s", g.get('request_id'), e)
+            return jsonify({"error": str(e), "stage": e.stage}), 504
+    return wrapper
+
+
+@app.before_request
+def read_request_body():
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if g.metrics_endpoint in UPLOAD_ENDPOINTS and request.method == 'POST':
+        # Read before a lane slot is taken, so slow uploads do not hold one
+        try:
+            g.upload = read_body(request.stream, limit, request.content_length)
+        except UploadRejected as e:
+            return jsonify({"error": str(e)}), e.status
+        except RequestEntityTooLarge:
+            return jsonify({"error": f"Request body exceeds {MAX_UPLOAD_MB:g} MB"}), 413
+        return None
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": f"Request body exceeds {MAX_UPLOAD_MB:g} MB"}), 413
+    if request.content_length is None and request.headers.get('Transfer-Encoding') == 'chunked':
+        # No declared length: read it here so the limit surfaces as a 413
+        try:
+            request.get_data()
+        except RequestEntityTooLarge:
+            return jsonify({"error": f"Request body exceeds {MAX_UPLOAD_MB:g} MB"}), 413
+
+
+@app.before_request
+def admit_to_lane():
+    lane = ENDPOINT_LANES.get(g.metrics_endpoint)
+    if lane is None:
+        return None
+    try:
+        lanes.admit(lane)
+    except LaneFull as e:
+        logger.warning("Request %s rejected: %s", g.request_id, e)
+        return jsonify({"error": f"Server busy: {e}"}), 503, {"Retry-After": "1"}
+    except DeadlineExceeded as e:
+        record_cancellation(e, g.metrics_endpoint)
+        return jsonify({"error": str(e), "stage": e.stage}), 504
+    g.lane = lane
+    g.degradation_token = load_control.begin_request()
+    g.degradation_level = load_control.current_level.get()
+
+
+def _finish_profile():
+    profile = g.pop('profile', None)
+    if profile is None:
+        return None
+    current_profile.set(None)
+    profile.stop()
+    try:
+        profile.save()
+    except OSError as e:
+        logger.error("Could not save profile %s: %s", profile.profile_id, e)
+        return None
+    return profile.profile_id
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    _finish_profile()
+    current_deadline.set(None)
+    degradation_token = g.pop('degradation_token', None)
+    if degradation_token is not None:
+        load_control.end_request(degradation_token)
+    lane = g.pop('lane', None)
+    if lane is not None:
+        elapsed = time.perf_counter() - g.request_start
+        lanes.release(lane, elapsed)
+        if lane == BATCH:
+            load_control.controller.observe_latency(elapsed)
+    if 'request_start' not in g:
+        return
+    IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                            endpoint=g.metrics_endpoint,
+                            status=g.get('response_status', 500 if exc else 200))
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    profile_id = _finish_profile()
+    if profile_id:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Download a stored request profile by its X-Profile-Id (?format=folded|speedscope)"""
+    if not is_valid_profile_id(profile_id):
+        return jsonify({"error": "Invalid profile ID"}), 400
+
+    fmt = request.args.get('format', 'folded')
+    if fmt not in ('folded', 'speedscope'):
+        return jsonify({"error": "format must be folded or speedscope"}), 400
+
+    profile = load_profile(profile_id, fmt)
+    if profile is None:
+        return jsonify({"error": f"No profile {profile_id}"}), 404
+
+    body, mimetype = profile
+    extension = 'speedscope.json' if fmt == 'speedscope' else 'folded'
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={profile_id}.{extension}"
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     health_status = {
@@ -160,67 +373,64 @@ def health_check():
 
 
 @app.route('/ocr', methods=['POST'])
+@abandon_on_deadline
 def process_ocr():
     try:
-        if not request.data:
+        if not _upload():
             return jsonify({"error": "No image data provided"}), 400
 
-        logger.info(f"Received OCR request: {len(request.data)} bytes")
+        logger.debug("Received OCR request: %d bytes", len(_upload()))
 
         return process_egyptian_id()
 
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/passport', methods=['POST'])
+@abandon_on_deadline
 def process_passport_ocr():
     try:
         start_time = time.time()
 
-        if not request.data:
+        data = _upload()
+        if not data:
             return jsonify({"error": "No image data provided"}), 400
 
-        logger.info(f"Passport OCR request: {len(request.data)} bytes")
+        logger.debug("Passport OCR request: %d bytes", len(data))
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_file.write(request.data)
-            tmp_file_path = tmp_file.name
+        inspect_image(data)
+        # read_mrz takes file objects; each call reads its own
+        result = process_passport(io.BytesIO(data))
 
-        try:
-            result = process_passport(tmp_file_path)
-
-            debug_info = get_passport_debug_info(tmp_file_path)
-
-            processing_time = time.time() - start_time
-
-            response = {
-                "success": result["success"],
-                "processing_time": round(processing_time, 2),
-                "data": result["data"] if result["success"] else None,
-                "error": result["error"] if not result["success"] else None,
-                "debug_info": debug_info
-            }
-
-            if result["success"]:
-                logger.info(
-                    f"Passport OCR completed in {processing_time:.2f}s")
-                logger.info("📋 Passport Data Extracted:")
-                data = result["data"]
-                for key, value in data.items():
-                    logger.info(f"   {key.replace('_', ' ').title()}: {value}")
-            else:
-                logger.warning(f"Passport OCR failed: {result['error']}")
+        debug_info = get_passport_debug_info(io.BytesIO(data))
 
-            return jsonify(response)
+        processing_time = time.time() - start_time
 
-        finally:
-            if os.path.exists(tmp_file_path):
-                os.remove(tmp_file_path)
+        response = {
+            "success": result["success"],
+            "processing_time": round(processing_time, 2),
+            "data": result["data"] if result["success"] else None,
+            "error": result["error"] if not result["success"] else None,
+            "debug_info": debug_info,
+            "degradation_level": g.get('degradation_level', 0)
+        }
+
+        if result["success"]:
+            logger.info("Passport OCR completed in %.2fs", processing_time)
+            if logger.isEnabledFor(logging.DEBUG):
+                for key, value in result["data"].items():
+                    logger.debug("Passport %s: %s", key, pii(value))
+        else:
+            logger.warning("Passport OCR failed: %s", result['error'])
 
+        return jsonify(response)
+
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"Passport OCR error: {e}")
+        logger.error("Passport OCR error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -239,135 +449,151 @@ def server_info():
             "/egyptian-id": "Egyptian ID card processing",
             "/passport": "Passport OCR using MRZ extraction and EasyOCR",
             "/debug-image/<filename>": "Serve debug images",
+            "/metrics": "Prometheus metrics",
+            "/profiles/<profile_id>": "Download a request profile (X-Profile-Id of a profiled request)",
+            "/face-index/add": "Enroll a face, reporting possible duplicate identities",
+            "/face-index/search": "Top-k search of the enrolled faces",
+            "/face-index/stats": "Face index size and search latency",
             "/info": "Server information"
-        }
+        },
+        "models": {
+            "yolo_backend": YOLO_BACKEND,
+            "loaded": get_backend_info(),
+            "precisions": get_model_precisions()
+        },
+        "denoise": {
+            "strategy": DENOISE_STRATEGY,
+            "timings": get_denoise_timings()
+        },
+        "memory": process_memory(),
+        "threads": get_thread_info(),
+        "reference_data": get_reference_info(),
+        "reader_pools": get_reader_pool_info(),
+        "lanes": lanes.info(),
+        "load_control": load_control.controller.info(),
+        "face_index": get_face_index_info()
     })
 
 
 @app.route('/detect-id-card', methods=['POST'])
+@abandon_on_deadline
 def detect_id_card():
     """
     Quick ID card detection endpoint for real-time camera feedback.
     Returns detection status, bounding box, and quality metrics without full OCR.
     """
     try:
-        if not request.data:
+        data = _upload()
+        if not data:
             return jsonify({"error": "No image data provided"}), 400
 
-        logger.info(f"ID detection request: {len(request.data)} bytes")
+        logger.debug("ID detection request: %d bytes", len(data))
 
-        if len(request.data) < 100:
+        if len(data) < 100:
             return jsonify({"error": "Data too small to be a valid image"}), 400
 
-        # Save image temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            temp_file.write(request.data)
-            temp_file_path = temp_file.name
-
-        try:
-            # Run quick detection
-            result = detect_id_card_quick(temp_file_path)
-
-            logger.info(
-                f"Detection: {result['detected']}, "
-                f"Confidence: {result.get('confidence', 0):.2f}, "
-                f"Quality: {result.get('quality', {}).get('quality_level', 'unknown')}"
-            )
+        result = detect_id_card_quick(data)
+        result["degradation_level"] = g.get('degradation_level', 0)
 
-            return jsonify(result)
+        logger.debug("Detection: %s, confidence %.2f, quality %s",
+                     result['detected'], result.get('confidence', 0),
+                     (result.get('quality') or {}).get('quality_level', 'unknown'))
 
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+        return jsonify(result)
 
+    except UploadRejected as e:
+        return jsonify({"error": str(e), "detected": False}), e.status
     except Exception as e:
-        logger.error(f"Detection error: {e}")
+        logger.error("Detection error: %s", e)
         return jsonify({"error": str(e), "detected": False}), 500
 
 
 @app.route('/egyptian-id', methods=['POST'])
+@abandon_on_deadline
 def process_egyptian_id():
     try:
         start_time = time.time()
 
-        if not request.data:
+        data = _upload()
+        if not data:
             return jsonify({"error": "No image data provided"}), 400
 
-        logger.info(f"Egyptian ID request: {len(request.data)} bytes")
-        logger.info(f"Request content type: {request.content_type}")
+        logger.debug("Egyptian ID request: %d bytes (%s)", len(data), request.content_type)
 
-        if len(request.data) < 100:
-            logger.error(
-                f"Data too small to be a valid image: {len(request.data)} bytes")
-            return jsonify({"error": f"Data too small to be a valid image: {len(request.data)} bytes"}), 400
+        if len(data) < 100:
+            logger.error("Data too small to be a valid image: %s bytes", len(data))
+            return jsonify({"error": f"Data too small to be a valid image: {len(data)} bytes"}), 400
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            temp_file.write(request.data)
-            temp_file_path = temp_file.name
+        with stage_timer('id', 'decode'):
+            image, _ = decode_image(data)
+        if image is None:
+            return jsonify({"error": "Could not decode image"}), 400
+        # Only the decoded image is needed from here on
+        del data
+        g.pop('upload', None)
 
-        try:
-            first_name, second_name, full_name, national_id, address, birth_date, governorate, gender, detected_fields, debug_image_path, serial = detect_and_process_id_card(
-                temp_file_path)
-
-            processing_time = time.time() - start_time
-
-            # Extract face from ID card for verification
-            face_image_base64, face_error = extract_face_from_id(
-                temp_file_path)
-
-            # Extract just the filename from the debug image path
-            debug_image_filename = os.path.basename(
-                debug_image_path) if debug_image_path else "egyptian_id_debug.jpg"
-
-            result = {
-                "success": True,
-                "processing_time": round(processing_time, 2),
-                "method": "egyptian_id",
-                "extracted_data": {
-                    "first_name": first_name,
-                    "second_name": second_name,
-                    "full_name": full_name,
-                    "national_id": national_id,
-                    "address": address,
-                    "birth_date": birth_date,
-                    "governorate": governorate,
-                    "gender": gender,
-                    "serial": serial,
-                    "face_image": face_image_base64
-                },
-                "face_verification": {
-                    "face_detected": face_image_base64 is not None,
-                    "face_image": face_image_base64,
-                    "face_error": face_error
-                },
-                "debug_info": {
-                    "detected_fields": detected_fields,
-                    "debug_image_path": debug_image_filename,
-                    "cropped_image_path": "cropped_id_card.jpg",
-                    "yolo_output_path": "d2.jpg",
-                    "preprocessed_image_path": "preprocessed_image.jpg"
-                },
-                "total_fields": 8
-            }
-
-            logger.info(
-                f"Egyptian ID processing completed in {processing_time:.2f}s")
-            logger.info(
-                f"Extracted: {full_name} - ID: {national_id} - {governorate}")
-
-            return jsonify(result)
-
-        finally:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+        # Face extraction only needs the upload, so it runs alongside the OCR
+        graph = StageGraph('egyptian_id')
+        graph.add('ocr', functools.partial(process_id_card_image, image))
+        graph.add('face', functools.partial(extract_face_from_id, image))
+        stages = graph.run()
+
+        first_name, second_name, full_name, national_id, address, birth_date, governorate, gender, detected_fields, debug_image_path, serial = stages['ocr']
+        face_image_base64, face_error = stages['face']
+
+        processing_time = time.time() - start_time
+
+        # Extract just the filename from the debug image path
+        debug_image_filename = os.path.basename(
+            debug_image_path) if debug_image_path else "egyptian_id_debug.jpg"
+
+        result = {
+            "success": True,
+            "processing_time": round(processing_time, 2),
+            "method": "egyptian_id",
+            "extracted_data": {
+                "first_name": first_name,
+                "second_name": second_name,
+                "full_name": full_name,
+                "national_id": national_id,
+                "address": address,
+                "birth_date": birth_date,
+                "governorate": governorate,
+                "gender": gender,
+                "serial": serial,
+                "face_image": face_image_base64
+            },
+            "face_verification": {
+                "face_detected": face_image_base64 is not None,
+                "face_image": face_image_base64,
+                "face_error": face_error
+            },
+            "debug_info": {
+                "detected_fields": detected_fields,
+                "debug_image_path": debug_image_filename,
+                "cropped_image_path": "cropped_id_card.jpg",
+                "yolo_output_path": "d2.jpg",
+                "preprocessed_image_path": "preprocessed_image.jpg"
+            },
+            "total_fields": 8,
+            "degradation_level": g.get('degradation_level', 0)
+        }
+
+        logger.info("Egyptian ID processing completed in %.2fs", processing_time)
+        logger.debug("Extracted: %s - ID: %s - %s",
+                     pii(full_name), pii(national_id), governorate)
+
+        return jsonify(result)
 
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"Egyptian ID processing error: {e}")
+        logger.error("Egyptian ID processing error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/verify-face', methods=['POST'])
+@abandon_on_deadline
 def verify_face():
     """Verify face similarity between ID image and live selfie"""
     try:
@@ -381,7 +607,7 @@ def verify_face():
         # Add timestamp for debugging
         import time
         request_timestamp = time.time()
-        logger.info(f"Face verification request at {request_timestamp}")
+        logger.debug("Face verification request at %s", request_timestamp)
 
         # Decode base64 images
         try:
@@ -391,22 +617,21 @@ def verify_face():
             id_image = Image.open(io.BytesIO(id_image_data)).convert('RGB')
             live_image = Image.open(io.BytesIO(live_image_data)).convert('RGB')
 
-            logger.info(
-                f"Images decoded successfully - ID: {id_image.size}, Live: {live_image.size}")
+            logger.debug("Images decoded - ID: %s, live: %s", id_image.size, live_image.size)
 
         except Exception as e:
-            logger.error(f"Image decoding error: {e}")
+            logger.error("Image decoding error: %s", e)
             return jsonify({"error": f"Invalid image data: {str(e)}"}), 400
 
         # Compare faces
         result, error = compare_faces(id_image, live_image)
 
         if error:
-            logger.error(f"Face comparison error: {error}")
+            logger.error("Face comparison error: %s", error)
             return jsonify({"error": error}), 400
 
-        logger.info(
-            f"Face verification completed - Similarity: {result['similarity_score']:.3f}, Match: {result['is_match']}")
+        logger.info("Face verification completed - Similarity: %.3f, Match: %s",
+                    result['similarity_score'], result['is_match'])
 
         return jsonify({
             "success": True,
@@ -415,10 +640,139 @@ def verify_face():
         })
 
     except Exception as e:
-        logger.error(f"Face verification error: {e}")
+        logger.error("Face verification error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+def _face_index_embedding(data):
+    """
+    Embedding of the face in a JSON body's base64 "image" as
+    (embedding, milliseconds, error response).
+    """
+    if not isinstance(data, dict) or 'image' not in data:
+        return None, 0.0, (jsonify({"error": "image is required"}), 400)
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(data['image']))).convert('RGB')
+    except Exception as e:
+        return None, 0.0, (jsonify({"error": f"Invalid image data: {str(e)}"}), 400)
+    start = time.perf_counter()
+    embedding = get_face_embedding(image)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if embedding is None:
+        return None, elapsed_ms, (jsonify({"error": "No face detected in image"}), 400)
+    return embedding, elapsed_ms, None
+
+
+def _search_arguments(data):
+    """(k, threshold) of a face index request; ValueError when malformed."""
+    try:
+        k = int(data.get('k', 5))
+        threshold = data.get('threshold', DUPLICATE_THRESHOLD)
+        threshold = None if threshold is None else float(threshold)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("k must be an integer and threshold a number or null")
+    # Also rejects NaN
+    if threshold is not None and not -1.0 <= threshold <= 1.0:
+        raise ValueError("threshold must be between -1 and 1")
+    return max(1, min(k, 100)), threshold
+
+
+def _face_index_unavailable():
+    if not FACE_RECOGNITION_AVAILABLE:
+        return jsonify({"error": "Face recognition not available"}), 503
+    if not FACE_INDEX_AVAILABLE:
+        return jsonify({"error": "Face index not available on this platform"}), 503
+    return None
+
+
+@app.route('/face-index/add', methods=['POST'])
+@abandon_on_deadline
+def face_index_add():
+    """Enroll a face under an applicant id, reporting earlier faces it matches"""
+    try:
+        unavailable = _face_index_unavailable()
+        if unavailable:
+            return unavailable
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not str(data.get('id', '')).strip():
+            return jsonify({"error": "id and image are required"}), 400
+        k, threshold = _search_arguments(data)
+
+        embedding, embedding_ms, error = _face_index_embedding(data)
+        if error:
+            return error
+        checkpoint('face_index')
+
+        index = get_face_index()
+        duplicates, method = index.search(embedding, k, threshold)
+        row = index.add(embedding, str(data['id']).strip())
+        logger.info("Face enrolled at row %s with %s possible duplicates", row, len(duplicates))
+
+        return jsonify({
+            "success": True,
+            "row": row,
+            "faces": len(index),
+            "duplicates": duplicates,
+            "threshold": threshold,
+            "method": method,
+            "embedding_ms": round(embedding_ms, 2)
+        })
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Face index enrollment error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/face-index/search', methods=['POST'])
+@abandon_on_deadline
+def face_index_search():
+    """Find the enrolled faces most similar to the face in an image"""
+    try:
+        unavailable = _face_index_unavailable()
+        if unavailable:
+            return unavailable
+
+        data = request.get_json(silent=True)
+        embedding, embedding_ms, error = _face_index_embedding(data)
+        if error:
+            return error
+        k, threshold = _search_arguments(data)
+        checkpoint('face_index')
+
+        index = get_face_index()
+        start = time.perf_counter()
+        matches, method = index.search(embedding, k, threshold)
+        search_ms = (time.perf_counter() - start) * 1000
+
+        return jsonify({
+            "success": True,
+            "matches": matches,
+            "is_duplicate": bool(matches) and threshold is not None,
+            "k": k,
+            "threshold": threshold,
+            "faces": len(index),
+            "method": method,
+            "embedding_ms": round(embedding_ms, 2),
+            "search_ms": round(search_ms, 3)
+        })
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Face index search error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/face-index/stats', methods=['GET'])
+def face_index_stats():
+    if not FACE_INDEX_AVAILABLE:
+        return jsonify({"error": "Face index not available on this platform"}), 503
+    return jsonify(get_face_index().info())
+
+
 @app.route('/debug-image/<filename>', methods=['GET'])
 def get_debug_image(filename):
     import os
@@ -434,13 +788,13 @@ def get_debug_image(filename):
     file_path = os.path.join(debug_folder, filename)
 
     if not os.path.exists(file_path):
-        logger.warning(f"Debug image not found: {file_path}")
+        logger.warning("Debug image not found: %s", file_path)
         return jsonify({"error": f"Debug image not found: {filename}"}), 404
 
     try:
         return send_file(file_path, mimetype='image/jpeg')
     except Exception as e:
-        logger.error(f"Error serving debug image {filename}: {e}")
+        logger.error("Error serving debug image %s: %s", filename, e)
         return jsonify({"error": f"Error serving debug image: {str(e)}"}), 500
 
 
@@ -448,7 +802,7 @@ def get_debug_image(filename):
 def index():
     return jsonify({
         "message": "OCR Server is running",
-        "endpoints": ["/health", "/ocr", "/egyptian-id", "/passport", "/debug-image/<filename>", "/info"],
+        "endpoints": ["/health", "/ocr", "/egyptian-id", "/passport", "/debug-image/<filename>", "/metrics", "/info"],
         "status": "ready"
     })
 
@@ -466,13 +820,16 @@ if __name__ == '__main__':
     print("  🛂 Passport OCR: http://localhost:5000/passport")
     print("  🖼️ Debug Images: http://localhost:5000/debug-image/<filename>")
     print("  ℹ️ Info: http://localhost:5000/info")
+    print("  📈 Metrics: http://localhost:5000/metrics")
     if FACE_RECOGNITION_AVAILABLE:
         print("  👤 Face Verification: http://localhost:5000/verify-face")
+        print("  🗂️ Face Index: http://localhost:5000/face-index/search")
     else:
         print(
             "  👤 Face Verification: Not available (install face recognition dependencies)")
 
-    print("\n🚀 Starting server on http://localhost:5000")
+    print("\n🚀 Starting development server on http://localhost:5000")
+    print("💡 For production run: python serve.py")
     print("=" * 40)
 
     app.run(
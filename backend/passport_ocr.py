@@ -6,37 +6,39 @@ import numpy as np
 from dateutil import parser
 import matplotlib.image as mpimg
 from passporteye import read_mrz
-import easyocr
+from log_config import pii
+from reader_pool import get_reader_pool
+from request_context import checkpoint
+from metrics import stage_timer
+from reference_data import build_tables, country_name
+import threading
 import warnings
 from typing import Dict, Optional, Tuple
 import logging
 
 warnings.filterwarnings('ignore')
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class PassportOCR:
     def __init__(self, country_codes_path: str = None):
-        self.country_codes_path = country_codes_path or os.path.join(
-            os.path.dirname(__file__), 'models', 'country_codes.json'
-        )
-        self.country_codes = self._load_country_codes()
-        self.reader = easyocr.Reader(lang_list=['en'], gpu=False)
+        # The shared reference_data index, unless a custom country list is given
+        self.country_codes_path = country_codes_path
+        self.country_codes = self._load_country_codes() if country_codes_path else None
+        self.readers = get_reader_pool('easyocr_en')
+        self.readers.preload(1)
         logger.info("Passport OCR initialized successfully")
 
     def _load_country_codes(self) -> Dict:
         try:
-            with open(self.country_codes_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return build_tables(self.country_codes_path)["countries"]
         except FileNotFoundError:
-            logger.warning(
-                f"Country codes file not found at {self.country_codes_path}")
-            return []
+            logger.warning("Country codes file not found at %s", self.country_codes_path)
+            return {}
         except Exception as e:
-            logger.error(f"Error loading country codes: {e}")
-            return []
+            logger.error("Error loading country codes: %s", e)
+            return {}
 
     def _parse_date(self, date_string: str) -> str:
         try:
@@ -48,20 +50,27 @@ class PassportOCR:
             date_obj = parser.parse(full_date, yearfirst=True).date()
             return date_obj.strftime('%d/%m/%Y')
         except Exception as e:
-            logger.warning(f"Error parsing date '{date_string}': {e}")
+            # dateutil's message repeats the date, so only the error type is logged
+            logger.warning("Error parsing date %s: %s", pii(date_string), type(e).__name__)
             return date_string
 
+    @staticmethod
+    def _roi_to_bgr(roi: np.ndarray) -> np.ndarray:
+        # Same result as saving the ROI with a gray colormap and reading it back,
+        # without a temp file shared by every concurrent request
+        roi = np.asarray(roi, dtype=np.float64)
+        low, high = roi.min(), roi.max()
+        scaled = (roi - low) / (high - low) if high > low else np.zeros_like(roi)
+        gray = np.round(scaled * 255).astype(np.uint8)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
     def _clean_string(self, text: str) -> str:
         return ''.join(char for char in text if char.isalnum()).upper()
 
     def _get_country_name(self, country_code: str) -> str:
-        if not self.country_codes:
-            return country_code
-
-        for country in self.country_codes:
-            if country.get('alpha-3') == country_code:
-                return country.get('name', country_code).upper()
-        return country_code
+        if self.country_codes is not None:
+            return self.country_codes.get(country_code, country_code)
+        return country_name(country_code)
 
     def _get_sex(self, sex_code: str) -> str:
         if sex_code in ['M', 'm']:
@@ -103,11 +112,13 @@ class PassportOCR:
 
         return result
 
-    def process_passport_image(self, image_path: str) -> Dict[str, any]:
+    def process_passport_image(self, image_path) -> Dict[str, any]:
+        """`image_path` may also be a binary file object (read_mrz accepts both)."""
         try:
-            logger.info(f"Processing passport image: {image_path}")
+            logger.debug("Processing passport image: %s", image_path)
 
-            mrz = read_mrz(image_path, save_roi=True)
+            with stage_timer('passport', 'mrz_locate'):
+                mrz = read_mrz(image_path, save_roi=True)
 
             if not mrz:
                 return {
@@ -116,44 +127,35 @@ class PassportOCR:
                     'data': None
                 }
 
-            temp_mrz_path = 'temp_mrz.png'
-            mpimg.imsave(temp_mrz_path, mrz.aux['roi'], cmap='gray')
-
-            try:
-                mrz_img = cv2.imread(temp_mrz_path)
-                if mrz_img is None:
-                    raise ValueError("Could not load MRZ image")
-
-                mrz_img = cv2.resize(mrz_img, (1110, 140))
+            mrz_img = cv2.resize(self._roi_to_bgr(mrz.aux['roi']), (1110, 140))
 
-                allowlist = st.ascii_letters + st.digits + '< '
-                ocr_results = self.reader.readtext(
-                    mrz_img,
-                    paragraph=False,
-                    detail=0,
-                    allowlist=allowlist
-                )
+            allowlist = st.ascii_letters + st.digits + '< '
+            with stage_timer('passport', 'mrz_ocr'):
+                with self.readers.reader() as reader:
+                    checkpoint('mrz_ocr')
+                    ocr_results = reader.readtext(
+                        mrz_img,
+                        paragraph=False,
+                        detail=0,
+                        allowlist=allowlist
+                    )
 
-                if len(ocr_results) < 2:
-                    raise ValueError(
-                        "Insufficient OCR results: Expected 2 MRZ lines")
+            if len(ocr_results) < 2:
+                raise ValueError(
+                    "Insufficient OCR results: Expected 2 MRZ lines")
 
-                passport_data = self._extract_mrz_data(ocr_results)
+            passport_data = self._extract_mrz_data(ocr_results)
 
-                logger.info("Passport data extracted successfully")
-
-                return {
-                    'success': True,
-                    'error': None,
-                    'data': passport_data
-                }
+            logger.debug("Passport data extracted successfully")
 
-            finally:
-                if os.path.exists(temp_mrz_path):
-                    os.remove(temp_mrz_path)
+            return {
+                'success': True,
+                'error': None,
+                'data': passport_data
+            }
 
         except Exception as e:
-            logger.error(f"Error processing passport image: {e}")
+            logger.error("Error processing passport image: %s", e)
             return {
                 'success': False,
                 'error': str(e),
@@ -162,7 +164,8 @@ class PassportOCR:
 
     def get_debug_info(self, image_path: str) -> Dict[str, any]:
         try:
-            mrz = read_mrz(image_path, save_roi=True)
+            with stage_timer('passport_debug', 'mrz_locate'):
+                mrz = read_mrz(image_path, save_roi=True)
 
             if not mrz:
                 return {
@@ -182,7 +185,7 @@ class PassportOCR:
             }
 
         except Exception as e:
-            logger.error(f"Error getting debug info: {e}")
+            logger.error("Error getting debug info: %s", e)
             return {
                 'mrz_detected': False,
                 'mrz_roi_path': None,
@@ -190,17 +193,29 @@ class PassportOCR:
             }
 
 
+_passport_ocr = None
+_passport_ocr_lock = threading.Lock()
+
+
+def get_passport_ocr() -> PassportOCR:
+    """The shared PassportOCR instance, created on first use."""
+    global _passport_ocr
+    with _passport_ocr_lock:
+        if _passport_ocr is None:
+            _passport_ocr = PassportOCR()
+        return _passport_ocr
+
+
 def process_passport(image_path: str) -> Dict[str, any]:
-    ocr_processor = PassportOCR()
-    return ocr_processor.process_passport_image(image_path)
+    return get_passport_ocr().process_passport_image(image_path)
 
 
 def get_passport_debug_info(image_path: str) -> Dict[str, any]:
-    ocr_processor = PassportOCR()
-    return ocr_processor.get_debug_info(image_path)
+    return get_passport_ocr().get_debug_info(image_path)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     test_image = "test_passport.jpg"
     if os.path.exists(test_image):
         result = process_passport(test_image)
@@ -0,0 +1,198 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it is sampled at PROFILE_SAMPLE_RATE (0
+disables sampling), or when it sends `X-Profile: <PROFILE_TOKEN>`. Without
+a PROFILE_TOKEN the header is ignored, so clients cannot turn profiling
+on. While it runs, a background thread samples the Python stacks of the
+request's threads every PROFILE_INTERVAL_MS. The result is stored under
+PROFILE_DIR as collapsed stacks (flamegraph.pl / speedscope compatible),
+named by a random profile ID the server generates. That ID is returned
+in X-Profile-Id next to the client's X-Request-ID, so a client can never
+pick or overwrite another request's profile. It can also be downloaded
+converted to speedscope JSON.
+
+With profiling disabled the only per-request cost is the header lookup.
+"""
+
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000.0
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+# Value of X-Profile that turns profiling on for a request; empty disables the header
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+
+# The session profiling the current request, for code that hands work to other threads
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+_PROFILE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def should_profile(headers) -> bool:
+    requested = headers.get(PROFILE_HEADER, '')
+    if PROFILE_TOKEN and requested and hmac.compare_digest(requested, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def is_valid_request_id(request_id: str) -> bool:
+    return bool(request_id) and bool(_REQUEST_ID_PATTERN.match(request_id))
+
+
+def new_profile_id() -> str:
+    return uuid.uuid4().hex
+
+
+def is_valid_profile_id(profile_id: str) -> bool:
+    return bool(_PROFILE_ID_PATTERN.match(profile_id or ''))
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfileSession:
+    """Samples the stacks of a set of threads until stopped."""
+
+    def __init__(self, request_id: str, thread_ids=None, interval: float = None):
+        # Files are named by a server-generated ID, never by the client's request ID
+        self.profile_id = new_profile_id()
+        self.request_id = request_id
+        self.interval = interval or PROFILE_INTERVAL
+        self._thread_ids = set(thread_ids or [threading.get_ident()])
+        self._counts = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._run, name=f'profiler-{self.profile_id}', daemon=True)
+        self.started_at = None
+        self.duration = None
+
+    def add_thread(self, thread_id: int) -> None:
+        """Also sample a worker thread running part of this request."""
+        self._thread_ids.add(thread_id)
+
+    def discard_thread(self, thread_id: int) -> None:
+        self._thread_ids.discard(thread_id)
+
+    def start(self) -> 'ProfileSession':
+        self.started_at = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self._thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = _collapse(frame)
+                    self._counts[stack] = self._counts.get(stack, 0) + 1
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self._counts
+
+    def save(self, directory: str = None) -> str:
+        """Write the collapsed stacks; returns the artifact path."""
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = profile_path(self.profile_id, directory)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self._counts.items()):
+                f.write(f"{stack} {count}\n")
+        _prune(directory)
+        logger.info("Profile %s for request %s: %s samples over %.2fs saved to %s",
+                    self.profile_id, self.request_id, sum(self._counts.values()),
+                    self.duration, path)
+        return path
+
+
+def _prune(directory: str) -> None:
+    files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.folded')]
+    if len(files) <= PROFILE_MAX_FILES:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - PROFILE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def profile_path(profile_id: str, directory: str = None) -> str:
+    return os.path.join(directory or PROFILE_DIR, f"{profile_id}.folded")
+
+
+def folded_to_speedscope(folded_text: str, name: str) -> dict:
+    """Convert collapsed stacks to a speedscope 'sampled' profile."""
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+    for line in folded_text.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if not stack:
+            continue
+        sample = []
+        for frame in stack.split(';'):
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame})
+            sample.append(frame_index[frame])
+        samples.append(sample)
+        weights.append(int(count))
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "none",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights
+        }],
+        "name": name,
+        "exporter": "kyc-ocr-profiler"
+    }
+
+
+def load_profile(profile_id: str, fmt: str = 'folded'):
+    """Return (body, mimetype) for a stored profile, or None if missing."""
+    path = profile_path(profile_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        folded = f.read()
+    if fmt == 'speedscope':
+        return json.dumps(folded_to_speedscope(folded, profile_id)), 'application/json'
+    return folded, 'text/plain'
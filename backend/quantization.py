@@ -0,0 +1,121 @@
+"""
+Per-model precision switch for the CPU models.
+
+Every model has a key and runs at one of three precisions:
+
+    fp32          original weights
+    dynamic-int8  int8 weights, activations quantized on the fly
+    static-int8   int8 weights and activations, calibrated offline with
+                  calibrate_models.py
+
+Keys: easyocr_ar, easyocr_en, face, detect_id_card, detect_odjects,
+detect_id. Precisions are chosen with MODEL_PRECISION, for example
+"easyocr_ar=fp32,face=static-int8"; MODEL_PRECISION_DEFAULT applies to
+every model not listed.
+
+The face model has no dynamic-int8: dynamic quantization only converts
+Linear and LSTM layers, which in InceptionResnetV1 are the final
+projection alone, so it would stay effectively fp32. face=dynamic-int8
+is rejected, and a dynamic-int8 default leaves the face model at fp32.
+
+EasyOCR already quantizes dynamically on CPU by default, so the EasyOCR
+readers default to dynamic-int8 and everything else to fp32. Its
+recognizer is an LSTM model and stays dynamically quantized under
+static-int8, which swaps in a calibrated text detector. Static int8
+PyTorch models are TorchScript scripted from the FX-quantized modules (see
+calibrate_models.py), so the text detector accepts any input size. The
+YOLO detectors use quantized ONNX exports resolved by model_backend.
+"""
+
+import logging
+import os
+
+import easyocr
+import torch
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+PRECISIONS = ['fp32', 'dynamic-int8', 'static-int8']
+MODEL_KEYS = ['easyocr_ar', 'easyocr_en', 'face',
+              'detect_id_card', 'detect_odjects', 'detect_id']
+# Precisions a model cannot run at meaningfully
+UNSUPPORTED_PRECISIONS = {'face': {'dynamic-int8'}}
+
+
+def _parse_precisions(spec: str) -> dict:
+    precisions = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        key, _, precision = item.partition('=')
+        key, precision = key.strip(), precision.strip()
+        if key not in MODEL_KEYS or precision not in PRECISIONS:
+            raise ValueError(f"Invalid MODEL_PRECISION entry: {item}")
+        if precision in UNSUPPORTED_PRECISIONS.get(key, ()):
+            raise ValueError(f"MODEL_PRECISION {item} is not supported "
+                             f"(only the final Linear layers would be quantized); "
+                             f"use {key}=static-int8")
+        precisions[key] = precision
+    return precisions
+
+
+# Matches easyocr.Reader(quantize=True), which the readers always used
+BUILTIN_PRECISIONS = {
+    'easyocr_ar': 'dynamic-int8',
+    'easyocr_en': 'dynamic-int8'
+}
+
+DEFAULT_PRECISION = os.environ.get('MODEL_PRECISION_DEFAULT')
+if DEFAULT_PRECISION is not None and DEFAULT_PRECISION not in PRECISIONS:
+    raise ValueError(f"Invalid MODEL_PRECISION_DEFAULT: {DEFAULT_PRECISION}")
+MODEL_PRECISIONS = _parse_precisions(os.environ.get('MODEL_PRECISION', ''))
+
+
+def get_precision(model_key: str) -> str:
+    if model_key in MODEL_PRECISIONS:
+        return MODEL_PRECISIONS[model_key]
+    if DEFAULT_PRECISION and DEFAULT_PRECISION not in UNSUPPORTED_PRECISIONS.get(model_key, ()):
+        return DEFAULT_PRECISION
+    return BUILTIN_PRECISIONS.get(model_key, 'fp32')
+
+
+def static_artifact_path(model_key: str, part: str = None) -> str:
+    """Where calibrate_models.py stores a statically quantized TorchScript model."""
+    name = f"{model_key}_{part}" if part else model_key
+    return os.path.join(MODELS_DIR, f"{name}.static-int8.pt")
+
+
+def get_model_precisions() -> dict:
+    return {key: get_precision(key) for key in MODEL_KEYS}
+
+
+def _load_static(model_key: str, part: str = None):
+    path = static_artifact_path(model_key, part)
+    if not os.path.exists(path):
+        logger.warning("No static-int8 artifact at %s, run calibrate_models.py first", path)
+        return None
+    return torch.jit.load(path, map_location='cpu').eval()
+
+
+def build_reader(lang_list: list, model_key: str) -> easyocr.Reader:
+    """Create an EasyOCR reader and apply the configured precision."""
+    precision = get_precision(model_key)
+    # EasyOCR's own quantize flag applies dynamic int8 to both networks
+    reader = easyocr.Reader(lang_list, gpu=False,
+                            quantize=(precision != 'fp32'))
+    if precision == 'static-int8':
+        detector = _load_static(model_key, 'detector')
+        if detector is not None:
+            reader.detector = detector
+    logger.info("EasyOCR reader %s running at %s", model_key, precision)
+    return reader
+
+
+def apply_face_precision(face_model: torch.nn.Module) -> torch.nn.Module:
+    """Return the face embedding model at its configured precision."""
+    precision = get_precision('face')
+    if precision == 'static-int8':
+        quantized = _load_static('face')
+        if quantized is not None:
+            face_model = quantized
+    logger.info("Face model running at %s", precision)
+    return face_model
@@ -0,0 +1,149 @@
+"""
+Pools of EasyOCR readers, so concurrent requests do not queue on one reader.
+
+    with get_reader_pool('easyocr_ar').reader() as reader:
+        reader.readtext(image)
+
+An easyocr.Reader keeps per-call state and is not safe to share between
+threads. Each pool holds up to OCR_READER_POOL_SIZE readers (default
+OCR_THREADS, see thread_budget.request_threads) for one language.
+Readers are created on demand the first time every existing one is
+busy, or all at once by `preload()` in the gunicorn master so forked
+workers share their weights. When the pool is full a caller waits for a
+reader to be returned; the wait is reported as ocr_reader_wait_seconds.
+
+Every reader runs its torch ops on the process-wide thread pool sized by
+thread_budget, so a larger pool adds overlap, not threads.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import MODEL_QUEUE_DEPTH, READER_WAIT_SECONDS, READERS_IN_USE
+from quantization import build_reader
+from thread_budget import request_threads
+
+logger = logging.getLogger(__name__)
+
+READER_POOL_SIZE = max(1, int(os.environ.get('OCR_READER_POOL_SIZE', request_threads())))
+
+# Languages of the reader behind each model key (see quantization.MODEL_KEYS)
+READER_LANGUAGES = {
+    'easyocr_ar': ['ar'],
+    'easyocr_en': ['en']
+}
+
+
+class ReaderPool:
+    def __init__(self, model_key: str, lang_list: list, size: int = READER_POOL_SIZE):
+        self.model_key = model_key
+        self.lang_list = lang_list
+        self.size = size
+        self.readers = []
+        self._idle = []
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+
+    def _create(self):
+        start = time.perf_counter()
+        reader = build_reader(self.lang_list, self.model_key)
+        logger.info("Created %s reader %s/%s in %.2fs",
+                    self.model_key, len(self.readers) + 1, self.size, time.perf_counter() - start)
+        return reader
+
+    def _add(self, reader) -> None:
+        with self._condition:
+            self._pending -= 1
+            self.readers.append(reader)
+
+    def preload(self, count: int = None) -> list:
+        """Create readers until the pool holds `count` (default: its size); returns them all."""
+        count = min(count or self.size, self.size)
+        while True:
+            with self._condition:
+                if len(self.readers) + self._pending >= count:
+                    return list(self.readers)
+                self._pending += 1
+            reader = self._create()
+            self._add(reader)
+            with self._condition:
+                self._idle.append(reader)
+                self._condition.notify()
+
+    @contextmanager
+    def reader(self):
+        """Check out a reader for the duration of the block."""
+        start = time.perf_counter()
+        MODEL_QUEUE_DEPTH.inc(model=self.model_key)
+        try:
+            with self._condition:
+                while not self._idle and len(self.readers) + self._pending >= self.size:
+                    self._condition.wait()
+                reader = self._idle.pop() if self._idle else None
+                if reader is None:
+                    self._pending += 1
+        finally:
+            MODEL_QUEUE_DEPTH.dec(model=self.model_key)
+        waited = time.perf_counter() - start
+
+        if reader is None:
+            # Growing the pool is a load, not a wait
+            try:
+                reader = self._create()
+            except Exception:
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify()
+                raise
+            self._add(reader)
+
+        READER_WAIT_SECONDS.observe(waited, model=self.model_key)
+        READERS_IN_USE.inc(model=self.model_key)
+        with self._condition:
+            self._checkouts += 1
+            if waited > 0.001:
+                self._waits += 1
+                self._wait_seconds += waited
+        try:
+            yield reader
+        finally:
+            READERS_IN_USE.dec(model=self.model_key)
+            with self._condition:
+                self._idle.append(reader)
+                self._condition.notify()
+
+    def info(self) -> dict:
+        with self._condition:
+            return {
+                "size": self.size,
+                "created": len(self.readers),
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds": round(self._wait_seconds, 3)
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_reader_pool(model_key: str) -> ReaderPool:
+    """The process-wide pool for a reader key, e.g. 'easyocr_ar' (readers are created on use)."""
+    with _pools_lock:
+        pool = _pools.get(model_key)
+        if pool is None:
+            pool = _pools[model_key] = ReaderPool(model_key, READER_LANGUAGES[model_key])
+        return pool
+
+
+def get_reader_pool_info() -> dict:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {key: pool.info() for key, pool in pools.items()}
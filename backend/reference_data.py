@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Country and governorate lookups for the OCR pipelines.
+
+The indexes are built once at import from models/reference_data.json, a
+compact artifact precomputed from models/country_codes.json:
+
+    python reference_data.py build
+
+It holds ISO 3166 alpha-3 code -> name and the MRZ codes ICAO Doc 9303
+adds (D for Germany, GBD/GBN/... for British nationality classes,
+UNO/UNA/UNK, XXA/XXB/XXC/XXX, ...). When the artifact is missing the
+index is built from the source JSON, with a warning.
+
+`country_name(code)` also resolves codes damaged by OCR: digits read in
+place of letters (0 -> O, 1 -> I, 5 -> S, ...) are mapped back, then a
+code one character away from exactly one known code is taken to be it.
+"""
+
+import json
+import logging
+import os
+import sys
+
+from national_id import GOVERNORATES
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), 'models')
+SOURCE_PATH = os.path.join(MODELS_DIR, 'country_codes.json')
+ARTIFACT_PATH = os.path.join(MODELS_DIR, 'reference_data.json')
+ARTIFACT_VERSION = 1
+
+# MRZ codes that are not ISO 3166 alpha-3 (ICAO Doc 9303 part 3)
+ICAO_CODES = {
+    'D': 'GERMANY',
+    'EUE': 'EUROPEAN UNION',
+    'GBD': 'BRITISH OVERSEAS TERRITORIES CITIZEN',
+    'GBN': 'BRITISH NATIONAL (OVERSEAS)',
+    'GBO': 'BRITISH OVERSEAS CITIZEN',
+    'GBP': 'BRITISH PROTECTED PERSON',
+    'GBS': 'BRITISH SUBJECT',
+    'RKS': 'KOSOVO',
+    'UNA': 'UNITED NATIONS SPECIALIZED AGENCY',
+    'UNK': 'KOSOVO (UNMIK)',
+    'UNO': 'UNITED NATIONS',
+    'XBA': 'AFRICAN DEVELOPMENT BANK',
+    'XCC': 'CARIBBEAN COMMUNITY',
+    'XCE': 'COUNCIL OF EUROPE',
+    'XCO': 'COMMON MARKET FOR EASTERN AND SOUTHERN AFRICA',
+    'XEC': 'ECONOMIC COMMUNITY OF WEST AFRICAN STATES',
+    'XES': 'ORGANISATION OF EASTERN CARIBBEAN STATES',
+    'XIM': 'AFRICAN EXPORT-IMPORT BANK',
+    'XOM': 'SOVEREIGN MILITARY ORDER OF MALTA',
+    'XPO': 'INTERPOL',
+    'XXA': 'STATELESS PERSON',
+    'XXB': 'REFUGEE',
+    'XXC': 'REFUGEE (OTHER)',
+    'XXX': 'UNSPECIFIED NATIONALITY'
+}
+
+# Digits OCR reads in place of the letters of a country code
+OCR_CONFUSIONS = str.maketrans({
+    '0': 'O', '1': 'I', '2': 'Z', '4': 'A', '5': 'S',
+    '6': 'G', '7': 'T', '8': 'B', '9': 'G'
+})
+
+_countries = {}
+# 'A?G' -> codes matching it, for codes one character off
+_near_codes = {}
+
+
+def build_tables(source_path: str = SOURCE_PATH) -> dict:
+    """The artifact contents, from the ISO country list plus ICAO_CODES."""
+    with open(source_path, encoding='utf-8') as f:
+        countries = {entry['alpha-3']: entry['name'].upper()
+                     for entry in json.load(f) if entry.get('alpha-3')}
+    countries.update(ICAO_CODES)
+    return {
+        "version": ARTIFACT_VERSION,
+        "countries": dict(sorted(countries.items()))
+    }
+
+
+def write_artifact(source_path: str = SOURCE_PATH, artifact_path: str = ARTIFACT_PATH) -> dict:
+    tables = build_tables(source_path)
+    with open(artifact_path, 'w', encoding='utf-8') as f:
+        json.dump(tables, f, ensure_ascii=False, separators=(',', ':'))
+        f.write('\n')
+    return tables
+
+
+def _load_tables() -> dict:
+    try:
+        with open(ARTIFACT_PATH, encoding='utf-8') as f:
+            tables = json.load(f)
+        if tables.get("version") == ARTIFACT_VERSION:
+            return tables
+        logger.warning("%s has an old format; run `python reference_data.py build`", ARTIFACT_PATH)
+    except FileNotFoundError:
+        logger.warning("%s not found; run `python reference_data.py build`", ARTIFACT_PATH)
+    try:
+        return build_tables()
+    except FileNotFoundError:
+        logger.warning("Country codes file not found at %s", SOURCE_PATH)
+        return {"countries": dict(ICAO_CODES)}
+
+
+def load(countries: dict) -> None:
+    """Replace the country index (alpha-3 -> name) and rebuild the near-code index."""
+    global _countries, _near_codes
+    near_codes = {}
+    for code in countries:
+        if len(code) != 3:
+            continue
+        for i in range(len(code)):
+            near_codes.setdefault(code[:i] + '?' + code[i + 1:], []).append(code)
+    _countries, _near_codes = countries, near_codes
+
+
+def nearest_code(code: str):
+    """The known code `code` was most likely read from, or None if unknown or ambiguous."""
+    code = code.strip('<').upper()
+    if code in _countries:
+        return code
+    repaired = code.translate(OCR_CONFUSIONS)
+    if repaired in _countries:
+        return repaired
+    if len(repaired) != 3:
+        return None
+    candidates = set()
+    for i in range(len(repaired)):
+        candidates.update(_near_codes.get(repaired[:i] + '?' + repaired[i + 1:], ()))
+    return candidates.pop() if len(candidates) == 1 else None
+
+
+def country_name(code: str, fuzzy: bool = True) -> str:
+    """Upper-case name for an MRZ country code; the code itself when it is unknown."""
+    name = _countries.get(code.strip('<').upper())
+    if name is None and fuzzy:
+        nearest = nearest_code(code)
+        if nearest is not None:
+            name = _countries[nearest]
+    return name or code
+
+
+def governorate_name(code: str, default: str = 'Unknown') -> str:
+    return GOVERNORATES.get(code, default)
+
+
+def get_reference_info() -> dict:
+    return {"countries": len(_countries), "governorates": len(GOVERNORATES),
+            "artifact": ARTIFACT_PATH if os.path.exists(ARTIFACT_PATH) else None}
+
+
+load(_load_tables()["countries"])
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] != ['build']:
+        print(f"usage: {os.path.basename(__file__)} build", file=sys.stderr)
+        return 2
+    tables = write_artifact()
+    print(f"Wrote {len(tables['countries'])} country codes to {ARTIFACT_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Request deadlines and cooperative cancellation.
+
+Every OCR request gets a deadline: the X-Request-Timeout header (seconds),
+capped by OCR_REQUEST_DEADLINE (30, 0 = none), which is also the default.
+Pipeline stages call `checkpoint(stage)` at their boundaries; once the
+deadline has passed it raises DeadlineExceeded and the rest of the work
+is dropped, so a client that already gave up stops costing CPU:
+
+    checkpoint('field_ocr')
+
+DeadlineExceeded derives from BaseException, like KeyboardInterrupt, so
+the `except Exception` fallbacks inside the pipelines do not swallow it.
+The server answers 504 and counts it in ocr_requests_cancelled_total by
+the stage that gave up. Stages run by stage_graph inherit the deadline
+with the rest of the request's contextvars.
+
+Functions registered with `add_checkpoint_hook` run at every checkpoint
+first; the scheduler uses this to pause batch work between stages.
+"""
+
+import contextvars
+import os
+import time
+
+from metrics import REQUESTS_CANCELLED
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+DEFAULT_DEADLINE = float(os.environ.get('OCR_REQUEST_DEADLINE', '30'))
+
+# time.monotonic() value after which the current request is abandoned
+current_deadline = contextvars.ContextVar('current_deadline', default=None)
+
+_checkpoint_hooks = []
+
+
+class DeadlineExceeded(BaseException):
+    def __init__(self, stage: str, overrun: float):
+        super().__init__(f"Request deadline exceeded before {stage} ({overrun:.2f}s over)")
+        self.stage = stage
+        self.overrun = overrun
+
+
+def request_timeout(headers):
+    """Seconds allowed for a request with these headers, or None for no deadline."""
+    timeout = DEFAULT_DEADLINE or None
+    try:
+        requested = float(headers.get(DEADLINE_HEADER, ''))
+    except ValueError:
+        return timeout
+    if requested <= 0:
+        return timeout
+    return min(requested, timeout) if timeout else requested
+
+
+def start_deadline(timeout, start: float = None):
+    """Set the deadline of the current context `timeout` seconds after `start` (now)."""
+    deadline = None if timeout is None else (start or time.monotonic()) + timeout
+    return current_deadline.set(deadline)
+
+
+def remaining():
+    """Seconds left before the deadline, or None without one."""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def add_checkpoint_hook(hook) -> None:
+    """Call `hook(stage)` at every checkpoint, before the deadline is checked."""
+    _checkpoint_hooks.append(hook)
+
+
+def checkpoint(stage: str) -> None:
+    """Raise DeadlineExceeded if the current request is out of time."""
+    for hook in _checkpoint_hooks:
+        hook(stage)
+    deadline = current_deadline.get()
+    if deadline is not None:
+        overrun = time.monotonic() - deadline
+        if overrun > 0:
+            raise DeadlineExceeded(stage, overrun)
+
+
+def record_cancellation(error: DeadlineExceeded, endpoint: str) -> None:
+    REQUESTS_CANCELLED.inc(endpoint=endpoint, stage=error.stage)
@@ -0,0 +1,173 @@
+"""
+Priority lanes: real-time camera frames ahead of full-document OCR.
+
+Requests are admitted to a lane by endpoint:
+
+    interactive  /detect-id-card (camera feedback, a few hundred ms)
+    batch        /egyptian-id, /ocr, /passport, /verify-face,
+                 /face-index/add, /face-index/search (seconds)
+
+Isolation works on three levels:
+
+- threads: OCR_THREADS batch requests run at once, and OCR_BATCH_QUEUE
+  more may wait for a slot (until their deadline); beyond that they get
+  a 503. serve.py gives each worker OCR_INTERACTIVE_THREADS request
+  threads on top, which batch requests can therefore never occupy;
+- models: a free detector instance goes to waiting interactive callers first;
+- CPU: at every pipeline checkpoint a batch request pauses while
+  interactive requests are in flight, for up to OCR_BATCH_YIELD_MS.
+
+Per-lane latency, queueing and yield time are exported at /metrics.
+"""
+
+import contextvars
+import os
+import threading
+import time
+
+from metrics import (BATCH_YIELD_SECONDS, LANE_IN_FLIGHT, LANE_QUEUE_SECONDS,
+                     LANE_REJECTED, LANE_REQUEST_SECONDS)
+from request_context import DeadlineExceeded, add_checkpoint_hook, remaining
+from thread_budget import request_threads
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANES = [INTERACTIVE, BATCH]
+
+ENDPOINT_LANES = {
+    '/detect-id-card': INTERACTIVE,
+    '/egyptian-id': BATCH,
+    '/ocr': BATCH,
+    '/passport': BATCH,
+    '/verify-face': BATCH,
+    '/face-index/add': BATCH,
+    '/face-index/search': BATCH
+}
+
+BATCH_SLOTS = request_threads()
+BATCH_QUEUE = int(os.environ.get('OCR_BATCH_QUEUE', BATCH_SLOTS))
+INTERACTIVE_THREADS = int(os.environ.get('OCR_INTERACTIVE_THREADS', '2'))
+BATCH_YIELD = float(os.environ.get('OCR_BATCH_YIELD_MS', '200')) / 1000.0
+
+# Lane of the request being served, None outside requests (bulk runs, benchmarks)
+current_lane = contextvars.ContextVar('current_lane', default=None)
+
+
+def worker_threads(batch_slots: int = None) -> int:
+    """Request threads a worker needs so the interactive reserve stays free."""
+    batch_slots = batch_slots or BATCH_SLOTS
+    return batch_slots + BATCH_QUEUE + INTERACTIVE_THREADS
+
+
+class LaneFull(Exception):
+    pass
+
+
+class PrioritySemaphore:
+    """A semaphore whose released slots go to waiting interactive callers first."""
+
+    def __init__(self, slots: int = 1):
+        self._condition = threading.Condition()
+        self._free = slots
+        self._urgent_waiting = 0
+
+    def acquire(self) -> None:
+        urgent = current_lane.get() == INTERACTIVE
+        with self._condition:
+            if urgent:
+                self._urgent_waiting += 1
+            try:
+                while not self._free or (not urgent and self._urgent_waiting):
+                    self._condition.wait()
+            finally:
+                if urgent:
+                    self._urgent_waiting -= 1
+            self._free -= 1
+
+    def release(self) -> None:
+        with self._condition:
+            self._free += 1
+            self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class LaneScheduler:
+    def __init__(self, batch_slots: int = BATCH_SLOTS, batch_queue: int = BATCH_QUEUE):
+        self.batch_slots = batch_slots
+        self.batch_queue = batch_queue
+        self._condition = threading.Condition()
+        self._running = {lane: 0 for lane in LANES}
+        self._waiting = {lane: 0 for lane in LANES}
+
+    def admit(self, lane: str) -> None:
+        """
+        Take a slot in `lane` for the current request. Raises LaneFull when
+        the batch queue is full, DeadlineExceeded when the deadline passes
+        while waiting.
+        """
+        start = time.monotonic()
+        with self._condition:
+            if lane == BATCH:
+                if self._running[BATCH] + self._waiting[BATCH] >= self.batch_slots + self.batch_queue:
+                    LANE_REJECTED.inc(lane=lane)
+                    raise LaneFull(f"{self.batch_slots} {lane} requests running and "
+                                   f"{self.batch_queue} waiting")
+                self._waiting[BATCH] += 1
+                try:
+                    while self._running[BATCH] >= self.batch_slots:
+                        timeout = remaining()
+                        if timeout is not None and timeout <= 0:
+                            raise DeadlineExceeded('queue', -timeout)
+                        self._condition.wait(timeout)
+                finally:
+                    self._waiting[BATCH] -= 1
+            self._running[lane] += 1
+        current_lane.set(lane)
+        LANE_IN_FLIGHT.inc(lane=lane)
+        LANE_QUEUE_SECONDS.observe(time.monotonic() - start, lane=lane)
+
+    def release(self, lane: str, seconds: float) -> None:
+        current_lane.set(None)
+        LANE_IN_FLIGHT.dec(lane=lane)
+        LANE_REQUEST_SECONDS.observe(seconds, lane=lane)
+        with self._condition:
+            self._running[lane] -= 1
+            self._condition.notify_all()
+
+    def yield_to_interactive(self, stage: str) -> None:
+        """Checkpoint hook: pause a batch request while interactive ones run."""
+        if current_lane.get() != BATCH or not self._running[INTERACTIVE]:
+            return
+        start = time.monotonic()
+        limit = BATCH_YIELD
+        timeout = remaining()
+        if timeout is not None:
+            limit = max(0.0, min(limit, timeout))
+        with self._condition:
+            self._condition.wait_for(lambda: not self._running[INTERACTIVE], limit)
+        BATCH_YIELD_SECONDS.inc(time.monotonic() - start)
+
+    def batch_occupancy(self) -> float:
+        """Running plus waiting batch requests per batch slot (above 1 means queueing)."""
+        with self._condition:
+            return (self._running[BATCH] + self._waiting[BATCH]) / self.batch_slots
+
+    def info(self) -> dict:
+        with self._condition:
+            return {
+                "batch_slots": self.batch_slots,
+                "batch_queue": self.batch_queue,
+                "interactive_threads": INTERACTIVE_THREADS,
+                "running": dict(self._running),
+                "waiting": dict(self._waiting)
+            }
+
+
+lanes = LaneScheduler()
+add_checkpoint_hook(lanes.yield_to_interactive)
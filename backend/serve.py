@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Production entry point for the OCR server (gunicorn, Linux/macOS).
+
+    python serve.py
+    python serve.py --workers 4 --threads 2 --bind 0.0.0.0:8000
+
+Each worker process runs up to `threads` OCR requests at once, and has
+request threads on top of those for queued requests and for the camera
+frames of /detect-id-card, which are never stuck behind full-document
+OCR (see scheduler.py). With
+preloading on (the default) the models are loaded once in the master
+before it forks, so workers share the weight pages copy-on-write instead
+of each loading its own copy (memory_sharing.py keeps those pages from
+being copied and measures per-worker cost). On SIGTERM the master stops
+accepting connections and gives in-flight requests up to
+`graceful_timeout` seconds to finish before the workers are killed.
+
+Every option can also be set in the environment:
+
+    OCR_BIND              address to listen on (0.0.0.0:5000)
+    OCR_WORKERS           worker processes (2)
+    OCR_THREADS           OCR requests run at once per worker (4)
+    OCR_STAGE_WIDTH       stages of one request run at once (2, see thread_budget.py)
+    OCR_BATCH_QUEUE       document requests that may wait for one of those (OCR_THREADS)
+    OCR_INTERACTIVE_THREADS  threads kept for /detect-id-card (2)
+    OCR_TIMEOUT           seconds a worker may go silent before it is restarted (120)
+    OCR_GRACEFUL_TIMEOUT  seconds in-flight requests get on shutdown (120)
+    OCR_MAX_REQUESTS      recycle a worker after this many requests, 0 = never (0)
+    OCR_PRELOAD           load models before forking, 0 to load per worker (1)
+    OCR_MAX_UPLOAD_MB     largest accepted request body, enforced by ocr_server.py (20)
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from gunicorn.app.base import BaseApplication
+
+from log_config import setup_logging
+from memory_sharing import prepare_for_fork
+from thread_budget import request_threads
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def default_options() -> dict:
+    return {
+        'bind': os.environ.get('OCR_BIND', '0.0.0.0:5000'),
+        'workers': _env_int('OCR_WORKERS', 2),
+        'threads': request_threads(),
+        'timeout': _env_int('OCR_TIMEOUT', 120),
+        'graceful_timeout': _env_int('OCR_GRACEFUL_TIMEOUT', 120),
+        'max_requests': _env_int('OCR_MAX_REQUESTS', 0),
+        'preload_app': os.environ.get('OCR_PRELOAD', '1') != '0'
+    }
+
+
+def on_starting(server):
+    cfg = server.cfg
+    logger.info("Starting %s workers x %s threads on %s (timeout %ss, graceful %ss, preload %s)",
+                cfg.workers, cfg.threads, ', '.join(cfg.bind), cfg.timeout, cfg.graceful_timeout,
+                'on' if cfg.preload_app else 'off')
+
+
+def post_fork(server, worker):
+    logger.info("Worker %s ready", worker.pid)
+
+
+def worker_int(worker):
+    logger.info("Worker %s interrupted", worker.pid)
+
+
+def worker_abort(worker):
+    logger.error("Worker %s timed out and was aborted", worker.pid)
+
+
+def worker_exit(server, worker):
+    logger.info("Worker %s exited", worker.pid)
+
+
+def on_exit(server):
+    logger.info("OCR server stopped")
+
+
+class OCRServerApplication(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        # Imported here: the lane sizes are read from OCR_THREADS, which main() sets
+        from scheduler import worker_threads
+        config = dict(self.options, worker_class='gthread',
+                      threads=worker_threads(self.options['threads']),
+                      max_requests_jitter=self.options['max_requests'] // 10,
+                      on_starting=on_starting, post_fork=post_fork,
+                      worker_int=worker_int, worker_abort=worker_abort,
+                      worker_exit=worker_exit, on_exit=on_exit)
+        for key, value in config.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Runs in the master when preloading, otherwise once per worker
+        start = time.perf_counter()
+        from ocr_server import app, preload_models
+        models = preload_models()
+        logger.info("Models loaded in %.1fs (pid %s)", time.perf_counter() - start, os.getpid())
+        if self.cfg.preload_app:
+            prepare_for_fork(models)
+        return app
+
+
+def main(argv=None) -> int:
+    defaults = default_options()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bind', default=defaults['bind'])
+    parser.add_argument('--workers', type=int, default=defaults['workers'])
+    parser.add_argument('--threads', type=int, default=defaults['threads'])
+    parser.add_argument('--timeout', type=int, default=defaults['timeout'])
+    parser.add_argument('--graceful-timeout', type=int, default=defaults['graceful_timeout'])
+    parser.add_argument('--max-requests', type=int, default=defaults['max_requests'])
+    parser.add_argument('--no-preload', dest='preload_app', action='store_false',
+                        default=defaults['preload_app'], help='Load models in each worker')
+    parser.add_argument('--max-upload-mb', type=float,
+                        help='Largest accepted request body (OCR_MAX_UPLOAD_MB)')
+    args = parser.parse_args(argv)
+
+    # ocr_server.py sizes the torch/OpenCV/OMP thread pools from these
+    os.environ['OCR_WORKERS'] = str(args.workers)
+    os.environ['OCR_THREADS'] = str(args.threads)
+    if args.max_upload_mb is not None:
+        # Read by ocr_server.py at import, which happens after this
+        os.environ['OCR_MAX_UPLOAD_MB'] = str(args.max_upload_mb)
+
+    options = vars(args)
+    options.pop('max_upload_mb')
+    OCRServerApplication(options).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Run the independent stages of one request concurrently.
+
+A pipeline is declared as stages with dependencies:
+
+    graph = StageGraph('id')
+    graph.add('fields', detect_fields)
+    graph.add('nid', read_nid, 'fields')        # called as read_nid(results['fields'])
+    graph.add('address', read_address, 'fields')
+    results = graph.run()
+
+Stages whose dependencies are met are submitted to a thread pool shared by
+all requests of the process. The pool has STAGE_POOL_SIZE threads, by
+default OCR_THREADS x (OCR_STAGE_WIDTH - 1): thread_budget gives every
+native library 1/OCR_STAGE_WIDTH of a request's share of the CPUs, so a
+larger pool would oversubscribe them again. The calling thread
+always runs one ready stage itself, and when it has nothing left to do but
+wait it takes back stages still queued in the pool and runs them inline.
+A request therefore never waits on a saturated pool, and graphs may be
+nested (a stage can run a graph of its own) without deadlocking.
+
+Stages run in a copy of the caller's contextvars, and pool threads are
+sampled by the request's profiler while they work on its stages.
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from profiling import current_profile
+from thread_budget import request_threads, stage_width
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool_size() -> int:
+    if 'STAGE_POOL_SIZE' in os.environ:
+        return max(1, int(os.environ['STAGE_POOL_SIZE']))
+    return max(1, request_threads() * (stage_width() - 1))
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_pool_size(), thread_name_prefix='stage')
+        return _executor
+
+
+class _Stage:
+    __slots__ = ('name', 'fn', 'deps')
+
+    def __init__(self, name, fn, deps):
+        self.name = name
+        self.fn = fn
+        self.deps = deps
+
+
+class StageGraph:
+    def __init__(self, name: str, executor: ThreadPoolExecutor = None):
+        self.name = name
+        self._executor = executor
+        self._stages = {}
+
+    def add(self, name: str, fn, *deps: str) -> str:
+        """Add a stage called with the results of `deps` as positional arguments."""
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage {name} in {self.name}")
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages {missing}")
+        self._stages[name] = _Stage(name, fn, deps)
+        return name
+
+    def _call(self, stage: _Stage, results: dict):
+        return stage.fn(*(results[dep] for dep in stage.deps))
+
+    def _submit(self, executor, stage: _Stage, results: dict):
+        context = contextvars.copy_context()
+        profile = current_profile.get()
+
+        def task():
+            if profile is None:
+                return context.run(self._call, stage, results)
+            thread_id = threading.get_ident()
+            profile.add_thread(thread_id)
+            try:
+                return context.run(self._call, stage, results)
+            finally:
+                profile.discard_thread(thread_id)
+
+        return executor.submit(task)
+
+    def run(self) -> dict:
+        """Run every stage; returns results by stage name. The first stage error is raised."""
+        executor = self._executor or get_executor()
+        results = {}
+        running = {}
+        started = set()
+        try:
+            while len(results) < len(self._stages):
+                ready = [stage for name, stage in self._stages.items()
+                         if name not in started and all(dep in results for dep in stage.deps)]
+                for stage in ready[1:]:
+                    running[stage.name] = self._submit(executor, stage, results)
+                    started.add(stage.name)
+
+                if ready:
+                    started.add(ready[0].name)
+                    results[ready[0].name] = self._call(ready[0], results)
+                else:
+                    for name, future in list(running.items()):
+                        # Still queued behind other requests' stages: run it here instead
+                        if future.cancel():
+                            del running[name]
+                            results[name] = self._call(self._stages[name], results)
+                            break
+                    else:
+                        wait(list(running.values()), return_when=FIRST_COMPLETED)
+
+                for name, future in list(running.items()):
+                    if future.done():
+                        del running[name]
+                        results[name] = future.result()
+        finally:
+            for future in running.values():
+                future.cancel()
+        return results
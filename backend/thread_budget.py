@@ -0,0 +1,140 @@
+"""
+CPU thread budget for the native libraries.
+
+Torch, OpenCV and the OpenMP/BLAS runtimes each size their thread pools
+to every core on the host. With several worker processes, each running
+several request threads, that oversubscribes the CPU many times over. The
+budget splits the CPUs actually available to the container (cgroup
+quota and CPU affinity) between workers, then between the request
+threads of a worker, then between the stages of a request that may run
+at once (stage_graph.py):
+
+    threads per library = max(1, cpus // OCR_WORKERS // OCR_THREADS // OCR_STAGE_WIDTH)
+
+OCR_THREADS (4) and OCR_STAGE_WIDTH (2) are read through request_threads()
+and stage_width(), which the reader pools, the lanes and the stage pool
+are sized from as well.
+
+`configure()` must run before torch, numpy or cv2 are first imported,
+because the OpenMP/BLAS runtimes only read their environment once.
+Explicit OMP_NUM_THREADS/MKL_NUM_THREADS/... values and the
+OCR_TORCH_THREADS / OCR_CV2_THREADS overrides take precedence.
+"""
+
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+ENV_LIMITS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+              'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+# OCR requests a worker runs at once, and stages of one request run at once
+DEFAULT_REQUEST_THREADS = 4
+DEFAULT_STAGE_WIDTH = 2
+
+_budget = None
+
+
+def request_threads() -> int:
+    """OCR requests run at once per worker (OCR_THREADS)."""
+    return max(1, int(os.environ.get('OCR_THREADS', DEFAULT_REQUEST_THREADS)))
+
+
+def stage_width() -> int:
+    """Stages of one request run at once, the caller's included (OCR_STAGE_WIDTH)."""
+    return max(1, int(os.environ.get('OCR_STAGE_WIDTH', DEFAULT_STAGE_WIDTH)))
+
+
+def _read(path: str):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """CPUs allowed by the cgroup quota (v2 cpu.max or v1 CFS), or None if unlimited."""
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max' and period:
+            return int(quota) / int(period)
+        return None
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus() -> dict:
+    affinity = len(os.sched_getaffinity(0)) if hasattr(
+        os, 'sched_getaffinity') else os.cpu_count()
+    quota = cgroup_cpu_limit()
+    cpus = affinity if quota is None else max(1, min(affinity, math.ceil(quota)))
+    return {"cpus": cpus, "affinity": affinity, "cgroup_quota": quota,
+            "host": os.cpu_count()}
+
+
+def compute_budget(workers: int = None, threads: int = None) -> dict:
+    workers = workers or int(os.environ.get('OCR_WORKERS', '1'))
+    threads = threads or request_threads()
+    width = stage_width()
+    detected = available_cpus()
+    per_request = max(1, detected["cpus"] // workers // threads // width)
+    return dict(
+        detected,
+        workers=workers,
+        request_threads=threads,
+        stage_width=width,
+        torch_threads=int(os.environ.get('OCR_TORCH_THREADS', per_request)),
+        cv2_threads=int(os.environ.get('OCR_CV2_THREADS', per_request)),
+        native_threads=per_request
+    )
+
+
+def configure(workers: int = None, threads: int = None) -> dict:
+    """Compute the budget and apply it to the environment, torch and OpenCV."""
+    global _budget
+    budget = compute_budget(workers, threads)
+
+    for name in ENV_LIMITS:
+        os.environ.setdefault(name, str(budget["native_threads"]))
+
+    try:
+        import torch
+        torch.set_num_threads(budget["torch_threads"])
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work
+            pass
+    except ImportError:
+        pass
+
+    import cv2
+    cv2.setNumThreads(budget["cv2_threads"])
+
+    _budget = budget
+    logger.info("Thread budget: %d CPUs / %d workers / %d request threads / %d stages -> "
+                "torch %d, cv2 %d, OMP/BLAS %s",
+                budget['cpus'], budget['workers'], budget['request_threads'], budget['stage_width'],
+                budget['torch_threads'], budget['cv2_threads'], os.environ['OMP_NUM_THREADS'])
+    return budget
+
+
+def get_thread_info() -> dict:
+    """The budget and the settings the libraries actually report."""
+    effective = {name: os.environ.get(name) for name in ENV_LIMITS}
+    try:
+        import torch
+        effective["torch"] = torch.get_num_threads()
+        effective["torch_interop"] = torch.get_num_interop_threads()
+    except ImportError:
+        pass
+    import cv2
+    effective["cv2"] = cv2.getNumThreads()
+    return {"budget": _budget, "effective": effective}